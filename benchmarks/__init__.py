@@ -0,0 +1 @@
+"""Benchmarks of nomad_bluesky, run each module with `python -m benchmarks.<module>`."""
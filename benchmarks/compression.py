@@ -0,0 +1,87 @@
+"""Bytes on the wire against CPU time for the different compression policies.
+
+Run with `python benchmarks/compression.py`.
+"""
+
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from nomad_bluesky.compression import CompressionPolicy
+from nomad_bluesky.nomad_api import _zip_dictionary, _ZipStream
+
+REPEATS = 20
+
+
+def payloads(directory: Path) -> dict[str, Path | dict]:
+    small_document = {
+        "uid": "7d0c5a2e-8a4b-4b0b-9f3a-1f2c3d4e5f60",
+        "time": 1700000000.0,
+        "descriptor": "0a1b2c3d-4e5f-6071-8293-a4b5c6d7e8f9",
+        "seq_num": 1,
+        "data": {"det": 1.5, "motor": 0.25},
+        "timestamps": {"det": 1700000000.0, "motor": 1700000000.0},
+        "filled": {},
+    }
+
+    # Stands in for a detector file written with a compression filter.
+    compressed = directory / "compressed_frames.h5"
+    compressed.write_bytes(os.urandom(8 * 1024 * 1024))
+
+    # Mostly empty frames, as from an uncompressed detector file.
+    sparse = directory / "sparse_frames.tiff"
+    frame = bytearray(64 * 1024)
+    frame[::97] = b"\x07" * len(frame[::97])
+    sparse.write_bytes(bytes(frame) * 128)
+
+    events = directory / "events.jsonl"
+    events.write_text(
+        "\n".join(
+            json.dumps({**small_document, "seq_num": i, "data": {"det": i * 0.1}})
+            for i in range(20000)
+        )
+    )
+
+    return {
+        "small document": small_document,
+        "compressed .h5": compressed,
+        "sparse .tiff": sparse,
+        "events .jsonl": events,
+    }
+
+
+def measure(payload: Path | dict, policy: CompressionPolicy) -> tuple[int, float]:
+    start = time.process_time()
+    for _ in range(REPEATS):
+        if isinstance(payload, dict):
+            size = len(_zip_dictionary("document", payload, policy).getvalue())
+        else:
+            size = sum(
+                len(chunk) for chunk in _ZipStream([(payload, payload.name)], policy)
+            )
+    return size, (time.process_time() - start) / REPEATS
+
+
+def main():
+    policies = {
+        "store": CompressionPolicy("store"),
+        "deflate 1": CompressionPolicy("deflate", 1),
+        "deflate 6": CompressionPolicy("deflate", 6),
+        "deflate 9": CompressionPolicy("deflate", 9),
+        "auto": CompressionPolicy("auto"),
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'payload':<16}{'policy':<12}{'bytes':>14}{'cpu ms':>10}")
+        for payload_name, payload in payloads(Path(directory)).items():
+            for policy_name, policy in policies.items():
+                size, cpu_time = measure(payload, policy)
+                print(
+                    f"{payload_name:<16}{policy_name:<12}{size:>14}{cpu_time * 1000:>10.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
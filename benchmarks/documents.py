@@ -0,0 +1,57 @@
+"""Synthetic bluesky documents for the benchmarks."""
+
+import random
+from collections.abc import Iterator
+from typing import Any
+
+import event_model
+
+
+def generate_run(
+    events: int, payload_bytes: int = 0
+) -> Iterator[tuple[str, dict[str, Any]]]:
+    """The `(name, document)` pairs of a run with `events` events in its primary stream.
+
+    Each event reads a scalar `det` and, if `payload_bytes` is given, a `payload`
+    array of that many bytes of float64 values.
+    """
+
+    payload_length = payload_bytes // 8
+    data_keys: dict[str, Any] = {
+        "det": {"source": "benchmark", "dtype": "number", "shape": []}
+    }
+    if payload_length:
+        data_keys["payload"] = {
+            "source": "benchmark",
+            "dtype": "array",
+            "shape": [payload_length],
+        }
+    # Shared by every event, only its serialized size matters.
+    payload = [random.random() for _ in range(payload_length)]
+
+    run = event_model.compose_run(metadata={"plan_name": "benchmark"})
+    yield "start", dict(run.start_doc)
+    descriptor = run.compose_descriptor(name="primary", data_keys=data_keys)
+    yield "descriptor", dict(descriptor.descriptor_doc)
+    for seq_num in range(1, events + 1):
+        data: dict[str, Any] = {"det": random.random()}
+        if payload_length:
+            data["payload"] = payload
+        event = descriptor.compose_event(
+            data=data,
+            timestamps={key: 0.0 for key in data},
+            seq_num=seq_num,
+            validate=False,
+        )
+        yield "event", dict(event)
+    yield "stop", dict(run.compose_stop())
+
+
+def generate_runs(
+    runs: int, events: int, payload_bytes: int = 0
+) -> list[tuple[str, dict[str, Any]]]:
+    return [
+        document
+        for _ in range(runs)
+        for document in generate_run(events, payload_bytes)
+    ]
@@ -0,0 +1,64 @@
+"""Time to serialize documents with each json backend, including numpy data.
+
+Run with `python benchmarks/json_encoding.py`.
+"""
+
+import time
+
+import numpy as np
+
+from nomad_bluesky.json_encoder import JsonEncoder, orjson
+
+REPEATS = 2000
+
+
+def documents() -> dict[str, dict]:
+    event = {
+        "uid": "7d0c5a2e-8a4b-4b0b-9f3a-1f2c3d4e5f60",
+        "time": 1700000000.0,
+        "descriptor": "0a1b2c3d-4e5f-6071-8293-a4b5c6d7e8f9",
+        "seq_num": 1,
+        "data": {"det": 1.5, "motor": 0.25},
+        "timestamps": {"det": 1700000000.0, "motor": 1700000000.0},
+        "filled": {},
+    }
+    return {
+        "event": event,
+        # As from an ophyd-async detector reading.
+        "numpy scalars": {
+            **event,
+            "data": {"det": np.float64(1.5), "motor": np.int32(3)},
+        },
+        "numpy 1k array": {**event, "data": {"spectrum": np.random.rand(1024)}},
+        "numpy 256x256": {
+            **event,
+            "data": {"image": np.random.randint(0, 4096, (256, 256), np.uint16)},
+        },
+    }
+
+
+def measure(document: dict, encoder: JsonEncoder) -> tuple[int, float]:
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        size = len(encoder.dumps(document))
+    return size, (time.perf_counter() - start) / REPEATS
+
+
+def main():
+    encoders = {"json": JsonEncoder("json")}
+    if orjson is not None:
+        encoders["orjson"] = JsonEncoder("orjson")
+    else:
+        print("orjson isn't installed, only measuring the standard library.")
+
+    print(f"{'document':<18}{'backend':<10}{'bytes':>10}{'us':>12}")
+    for document_name, document in documents().items():
+        for encoder_name, encoder in encoders.items():
+            size, seconds = measure(document, encoder)
+            print(
+                f"{document_name:<18}{encoder_name:<10}{size:>10}{seconds * 1e6:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
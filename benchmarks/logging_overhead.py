@@ -0,0 +1,90 @@
+"""Per-event cost of logging in the upload path, eager against lazy formatting.
+
+Run with `python -m benchmarks.logging_overhead`. At INFO, debug messages are
+dropped, so the eager f-string and `pprint.pformat` are pure overhead. With DEBUG
+enabled, writing to a slow stream is compared with handing records to a queue.
+"""
+
+import argparse
+import io
+import logging
+import pprint
+import time
+from collections.abc import Callable
+
+from nomad_bluesky.logger import logger, pretty, use_queue_handler
+
+from .documents import generate_run
+
+
+class _SlowStream(io.StringIO):
+    """A stream whose writes take `delay` seconds, like a busy terminal or a pipe."""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text: str) -> int:
+        time.sleep(self.delay)
+        return len(text)
+
+
+def _eager(document, response_json):
+    logger.debug(f"Batched `event` document `{document['uid']}`.")
+    logger.debug(f"upload_event: {pprint.pformat(response_json)}")
+
+
+def _lazy(document, response_json):
+    logger.debug("Batched `event` document `%s`.", document["uid"])
+    logger.debug("upload_event: %s", pretty(response_json))
+
+
+def _per_event(log: Callable, events: list, response_json) -> float:
+    """Microseconds per event of calling `log`."""
+
+    start = time.perf_counter()
+    for document in events:
+        log(document, response_json)
+    return (time.perf_counter() - start) / len(events) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument(
+        "--write-delay",
+        type=float,
+        default=0.0001,
+        help="Seconds each write to the slow stream takes",
+    )
+    args = parser.parse_args()
+
+    events = [
+        document for name, document in generate_run(args.events) if name == "event"
+    ]
+    # The size of a typical response from the NOMAD API.
+    response_json = {
+        "upload_id": "f" * 22,
+        "data": {"process_running": False, "entries": 1, "files": ["a", "b"]},
+    }
+
+    logger.setLevel(logging.INFO)
+    print("At INFO, debug messages dropped:")
+    for label, log in [("eager", _eager), ("lazy", _lazy)]:
+        print(f"  {label:>8}: {_per_event(log, events, response_json):.2f} µs/event")
+
+    # Only a slice of the events, as every one of them is written.
+    events = events[: max(1, len(events) // 10)]
+    logger.setLevel(logging.DEBUG)
+    logger.handlers[0].setStream(_SlowStream(args.write_delay))
+    print(
+        f"At DEBUG, writing to a stream taking {args.write_delay * 1e6:.0f} µs a line:"
+    )
+    print(f"  {'blocking':>8}: {_per_event(_lazy, events, response_json):.2f} µs/event")
+    # The records still queued are written by the listener as the interpreter exits.
+    use_queue_handler()
+    print(f"  {'queued':>8}: {_per_event(_lazy, events, response_json):.2f} µs/event")
+
+
+if __name__ == "__main__":
+    main()
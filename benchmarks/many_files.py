@@ -0,0 +1,60 @@
+"""Time to add a directory of many small files, one request each against packed zips.
+
+Run with `python -m benchmarks.many_files`, e.g. `--files 2000 --file-bytes 65536
+--latency 0.005` for a detector writing a frame per file to a NOMAD 5 ms away.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from nomad_bluesky.nomad_api import NomadClient
+
+from .mock_nomad import MockNomad
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--file-bytes", type=int, default=64 * 1024)
+    parser.add_argument(
+        "--latency", type=float, default=0.005, help="Seconds added to every request"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory, MockNomad(args.latency) as nomad:
+        files = []
+        for index in range(args.files):
+            path = Path(directory) / f"frame_{index:06d}.tiff"
+            # Half random, half zeros, so it's worth compressing.
+            path.write_bytes(
+                os.urandom(args.file_bytes // 2) + bytes(args.file_bytes // 2)
+            )
+            files.append((path, path.name))
+        total_bytes = args.files * args.file_bytes
+        client = NomadClient(nomad.url, "token")
+
+        start = time.perf_counter()
+        for path, _ in files:
+            client.add_file_to_upload(path.name, path, "upload")
+        one_by_one = time.perf_counter() - start
+
+        start = time.perf_counter()
+        client.add_files_to_upload("frames", files, "upload")
+        packed = time.perf_counter() - start
+
+        client.close()
+
+    print(
+        f"{args.files} files of {args.file_bytes} bytes, {args.latency * 1000} ms latency:"
+    )
+    for label, elapsed in [("one by one", one_by_one), ("packed", packed)]:
+        print(
+            f"  {label:>10}: {elapsed:.2f} s, {total_bytes / elapsed / 1024**2:.1f} MiB/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""A local stand-in for the parts of the NOMAD API used by nomad_bluesky.
+
+Run it on its own with `python -m benchmarks.mock_nomad --port 8000`. Benchmarks
+use `MockNomad`, which serves from a separate process so that the server's memory
+and CPU aren't counted against the client being measured.
+
+Every request waits `latency` seconds and fails with a 503 at `error_rate`. Bodies
+are read and counted but not kept. `GET /_stats` returns the counts.
+"""
+
+import argparse
+import http.server
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from multiprocessing.connection import Connection
+from typing import Any
+
+import requests
+
+# Matched against the end of the path, so that any API prefix works.
+_ROUTES = [
+    ("POST", re.compile(r"/uploads$"), "create_upload"),
+    ("GET", re.compile(r"/uploads$"), "list_uploads"),
+    ("GET", re.compile(r"/uploads/(?P<upload_id>[^/]+)$"), "upload_status"),
+    ("PUT", re.compile(r"/uploads/(?P<upload_id>[^/]+)/raw/.*$"), "raw"),
+    ("POST", re.compile(r"/uploads/(?P<upload_id>[^/]+)/edit$"), "edit"),
+    (
+        "POST",
+        re.compile(r"/uploads/(?P<upload_id>[^/]+)/action/process$"),
+        "process",
+    ),
+    ("POST", re.compile(r"/entries/query$"), "query"),
+    ("POST", re.compile(r"/entries/edit$"), "edit_entries"),
+    ("POST", re.compile(r"datasets/?$"), "create_dataset"),
+]
+
+
+def _upload(upload_id: str) -> dict[str, Any]:
+    return {
+        "upload_id": upload_id,
+        "process_running": False,
+        "process_status": "SUCCESS",
+    }
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: dict[str, int] = {}
+        self.errors = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def record(self, route: str, received: int, sent: int, error: bool):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.errors += error
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+    def as_dict(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "errors": self.errors,
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+            }
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, latency: float, error_rate: float):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = _Stats()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Otherwise the body waits on the client's delayed ack of the headers.
+    disable_nagle_algorithm = True
+    server: _Server
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes | None:
+        """The body if it's json, it's otherwise only read for its length.
+
+        `None` if a chunked body ends early, as when the client is cut off mid-request.
+        """
+
+        body = bytearray()
+        keep = self.headers.get("Content-Type", "").startswith("application/json")
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            length = 0
+            while True:
+                line = self.rfile.readline()
+                try:
+                    size = int(line.split(b";")[0], 16)
+                except ValueError:
+                    self._body_length = length
+                    return None
+                if not size:
+                    break
+                chunk = self.rfile.read(size)
+                if len(chunk) < size:
+                    self._body_length = length + len(chunk)
+                    return None
+                self.rfile.readline()
+                length += size
+                if keep:
+                    body += chunk
+            self.rfile.readline()
+            self._body_length = length
+        else:
+            self._body_length = int(self.headers.get("Content-Length", 0))
+            chunk = self.rfile.read(self._body_length)
+            if keep:
+                body += chunk
+        return bytes(body)
+
+    def _respond(self, status: int, body: dict[str, Any], headers=()) -> int:
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(content)
+        return len(content)
+
+    def _handle(self):
+        url = urllib.parse.urlparse(self.path)
+        path = re.sub("/+", "/", url.path)
+        parameters = urllib.parse.parse_qs(url.query)
+        body = self._read_body()
+        received = len(self.requestline) + len(str(self.headers)) + self._body_length
+        if body is None:
+            self.close_connection = True
+            sent = self._respond(400, {"detail": "Incomplete chunked body"})
+            self.server.stats.record("incomplete", received, sent, True)
+            return
+
+        if path.endswith("/_stats"):
+            self._respond(200, self.server.stats.as_dict())
+            return
+
+        for method, pattern, route in _ROUTES:
+            match = pattern.search(path)
+            if method == self.command and match:
+                break
+        else:
+            sent = self._respond(404, {"detail": f"Not found: {path}"})
+            self.server.stats.record("unknown", received, sent, True)
+            return
+
+        time.sleep(self.server.latency)
+        if random.random() < self.server.error_rate:
+            sent = self._respond(
+                503, {"detail": "Injected error"}, [("Retry-After", "0")]
+            )
+            self.server.stats.record(route, received, sent, True)
+            return
+
+        upload_id = match.groupdict().get("upload_id")
+        match route:
+            case "create_upload":
+                upload_id = uuid.uuid4().hex
+                response = {"upload_id": upload_id, "data": _upload(upload_id)}
+            case "list_uploads":
+                response = {
+                    "data": [_upload(u) for u in parameters.get("upload_id", [])]
+                }
+            case "query":
+                query = json.loads(body or b"{}")
+                response = {
+                    "pagination": {
+                        "page_size": query.get("pagination", {}).get("page_size", 10),
+                        "total": 0,
+                    },
+                    "data": [],
+                }
+            case "edit_entries":
+                response = json.loads(body or b"{}")
+            case "create_dataset":
+                response = {"dataset_id": uuid.uuid4().hex}
+            case _:
+                response = {"upload_id": upload_id, "data": _upload(str(upload_id))}
+        sent = self._respond(200, response)
+        self.server.stats.record(route, received, sent, False)
+
+    do_GET = do_POST = do_PUT = _handle
+
+
+def _serve(port: int, latency: float, error_rate: float, ready: Connection | None):
+    server = _Server(port, latency, error_rate)
+    if ready is not None:
+        ready.send(server.server_address[1])
+    server.serve_forever()
+
+
+class MockNomad:
+    """A mock NOMAD server in a separate process, for use as a context manager."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.url = ""
+        self._process: multiprocessing.Process | None = None
+
+    def __enter__(self) -> "MockNomad":
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.Process(
+            target=_serve,
+            args=(0, self.latency, self.error_rate, sender),
+            daemon=True,
+        )
+        self._process.start()
+        self.url = f"http://127.0.0.1:{receiver.recv()}/api/v1"
+        return self
+
+    def stats(self) -> dict[str, Any]:
+        return requests.get(f"{self.url}/_stats").json()
+
+    def __exit__(self, *exc_info):
+        assert self._process
+        self._process.terminate()
+        self._process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    print(f"Serving a mock NOMAD at http://127.0.0.1:{args.port}/api/v1")
+    _serve(args.port, args.latency, args.error_rate, None)
+
+
+if __name__ == "__main__":
+    main()
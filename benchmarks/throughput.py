@@ -0,0 +1,188 @@
+"""Throughput, latency and memory of `NomadCallback` uploading to a mock NOMAD.
+
+Run every scenario with `python -m benchmarks.throughput`, or a single one with
+e.g. `python -m benchmarks.throughput --runs 10 --events 1000 --payload-bytes 1024`.
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from typing import Any, NamedTuple
+
+import psutil
+import requests
+
+from nomad_bluesky.callback import NomadCallback
+from nomad_bluesky.nomad_api import NomadClient
+from nomad_bluesky.retry import RetryPolicy
+
+from .documents import generate_runs
+from .mock_nomad import MockNomad
+
+
+class Scenario(NamedTuple):
+    runs: int
+    events: int
+    payload_bytes: int
+
+
+SCENARIOS = [
+    Scenario(1, 1000, 0),
+    Scenario(10, 1000, 0),
+    Scenario(10, 1000, 4096),
+    Scenario(1, 50000, 0),
+]
+
+
+class _TimedClient(NomadClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies: list[float] = []
+
+    def _request(self, *args, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        try:
+            return super()._request(*args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+class _TimedCallback(NomadCallback):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies: list[float] = []
+
+    def send_document(self, name, document, seq=None):
+        start = time.perf_counter()
+        try:
+            super().send_document(name, document, seq)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+class _PeakMemory:
+    """Samples the resident memory of this process in a thread, keeping the highest."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "_PeakMemory":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def _percentiles(latencies: list[float]) -> tuple[float, float]:
+    """The p50 and p99 of `latencies`, in milliseconds."""
+
+    if len(latencies) < 2:
+        latency = latencies[0] * 1000 if latencies else 0.0
+        return latency, latency
+    quantiles = statistics.quantiles(latencies, n=100)
+    return quantiles[49] * 1000, quantiles[98] * 1000
+
+
+def run_scenario(
+    scenario: Scenario,
+    workers: int = 1,
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+    aggregate: bool = False,
+) -> dict[str, Any]:
+    documents = generate_runs(*scenario)
+
+    with MockNomad(latency, error_rate) as nomad:
+        client = _TimedClient(
+            nomad.url,
+            "token",
+            pool_size=max(10, workers),
+            retry=RetryPolicy(max_attempts=10, base_delay=0.01),
+        )
+        callback = _TimedCallback(
+            nomad.url, "token", client=client, workers=workers, aggregate=aggregate
+        )
+
+        baseline = psutil.Process().memory_info().rss
+        with _PeakMemory() as memory:
+            callback.serve()
+            start = time.perf_counter()
+            for name, document in documents:
+                callback(name, document)
+            callback.join()
+            elapsed = time.perf_counter() - start
+
+        stats = nomad.stats()
+        client.close()
+
+    return {
+        "documents": len(documents),
+        "documents_per_second": len(documents) / elapsed,
+        "document_latency": _percentiles(callback.latencies),
+        "request_latency": _percentiles(client.latencies),
+        "requests": sum(stats["requests"].values()),
+        "errors": stats["errors"],
+        "peak_memory": memory.peak,
+        "memory_above_baseline": max(0, memory.peak - baseline),
+        "bytes_on_wire": stats["bytes_received"] + stats["bytes_sent"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int)
+    parser.add_argument("--events", type=int)
+    parser.add_argument("--payload-bytes", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to every request"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Fraction of requests failed"
+    )
+    parser.add_argument("--aggregate", action="store_true")
+    args = parser.parse_args()
+
+    scenarios = (
+        [Scenario(args.runs or 1, args.events or 1000, args.payload_bytes)]
+        if args.runs or args.events
+        else SCENARIOS
+    )
+
+    print(
+        f"{'runs':>5}{'events':>8}{'payload':>9}{'docs':>9}{'docs/s':>10}"
+        f"{'doc p50/p99 ms':>18}{'req p50/p99 ms':>18}{'requests':>10}"
+        f"{'errors':>8}{'peak MiB':>10}{'+MiB':>8}{'wire MiB':>10}"
+    )
+    for scenario in scenarios:
+        result = run_scenario(
+            scenario, args.workers, args.latency, args.error_rate, args.aggregate
+        )
+        document_p50, document_p99 = result["document_latency"]
+        request_p50, request_p99 = result["request_latency"]
+        print(
+            f"{scenario.runs:>5}{scenario.events:>8}{scenario.payload_bytes:>9}"
+            f"{result['documents']:>9}{result['documents_per_second']:>10.0f}"
+            f"{f'{document_p50:.2f}/{document_p99:.2f}':>18}"
+            f"{f'{request_p50:.2f}/{request_p99:.2f}':>18}"
+            f"{result['requests']:>10}{result['errors']:>8}"
+            f"{result['peak_memory'] / 1024**2:>10.1f}"
+            f"{result['memory_above_baseline'] / 1024**2:>8.1f}"
+            f"{result['bytes_on_wire'] / 1024**2:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
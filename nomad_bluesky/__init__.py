@@ -1,21 +1,52 @@
 from ._version import __version__ as __version__
-
 from .callback import NomadCallback as NomadCallback
+from .compression import CompressionPolicy as CompressionPolicy
+from .nomad_api import NomadClient as NomadClient
+from .nomad_api import (
+    add_archive_to_upload as add_archive_to_upload,
+)
 from .nomad_api import (
     add_dictionary_to_upload as add_dictionary_to_upload,
 )
 from .nomad_api import (
     add_file_to_upload as add_file_to_upload,
 )
+from .nomad_api import (
+    add_files_to_upload as add_files_to_upload,
+)
+from .nomad_api import (
+    add_json_lines_to_upload as add_json_lines_to_upload,
+)
 from .nomad_api import (
     add_upload_metadata as add_upload_metadata,
 )
+from .nomad_api import (
+    add_uploads_to_dataset as add_uploads_to_dataset,
+)
 from .nomad_api import (
     check_upload_status as check_upload_status,
 )
 from .nomad_api import (
     create_dataset as create_dataset,
 )
+from .nomad_api import (
+    create_datasets as create_datasets,
+)
 from .nomad_api import (
     create_upload as create_upload,
 )
+from .nomad_api import (
+    edit_entries as edit_entries,
+)
+from .nomad_api import (
+    edit_uploads as edit_uploads,
+)
+from .nomad_api import (
+    get_uploads as get_uploads,
+)
+from .nomad_api import (
+    iter_entries as iter_entries,
+)
+from .supervisor import NomadSupervisor as NomadSupervisor
+from .upload_cache import UploadCache as UploadCache
+from .upload_watcher import UploadWatcher as UploadWatcher
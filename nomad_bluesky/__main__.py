@@ -1,9 +1,44 @@
 import argparse
+import itertools
+import json
 import os
+from pathlib import Path
 
-from nomad_bluesky.callback import NomadCallback
-from nomad_bluesky.callback import logger
-from nomad_bluesky.tiled_listener import DEFAULT_POLL_PERIOD, NomadTiledListener
+from nomad_bluesky.async_callback import (
+    DEFAULT_MAX_CONCURRENT_UPLOADS,
+    AsyncNomadCallback,
+)
+from nomad_bluesky.async_nomad_api import AsyncNomadClient
+from nomad_bluesky.backfill import (
+    DEFAULT_PARALLEL_RUNS,
+    Backfill,
+    file_runs,
+    tiled_runs,
+)
+from nomad_bluesky.callback import DEFAULT_WORKERS, NomadCallback, logger
+from nomad_bluesky.columnar import FORMATS as COLUMNAR_FORMATS
+from nomad_bluesky.columnar import ColumnarSerializer
+from nomad_bluesky.compression import METHODS, CompressionPolicy
+from nomad_bluesky.document_queue import DEFAULT_MAX_IN_MEMORY, DEFAULT_MAX_SPILL_BYTES
+from nomad_bluesky.json_encoder import BACKENDS, JsonEncoder
+from nomad_bluesky.logger import use_key_value_format, use_queue_handler
+from nomad_bluesky.metrics import serve_metrics
+from nomad_bluesky.nomad_api import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_POOL_SIZE,
+    NomadClient,
+)
+from nomad_bluesky.retry import DEFAULT_MAX_ATTEMPTS, RetryPolicy
+from nomad_bluesky.run_archive import DEFAULT_CHECKPOINT_BYTES
+from nomad_bluesky.run_index import DEFAULT_RUN_TIMEOUT
+from nomad_bluesky.supervisor import DEFAULT_PROCESSES, NomadSupervisor
+from nomad_bluesky.tiled_listener import (
+    DEFAULT_PAGE_SIZE,
+    DEFAULT_POLL_PERIOD,
+    NomadTiledListener,
+    connect,
+)
+from nomad_bluesky.upload_cache import UploadCache
 
 
 def main():
@@ -17,6 +52,12 @@ def main():
         default=os.environ.get("NOMAD_BLUESKY_LOG_LEVEL", "INFO"),
         help="Log level (default: from NOMAD_BLUESKY_LOG_LEVEL env var or INFO)",
     )
+    parser.add_argument(
+        "--log-format",
+        choices=["text", "key-value"],
+        default=os.environ.get("NOMAD_BLUESKY_LOG_FORMAT", "text"),
+        help="Format of log lines, key-value includes the fields of structured records (default: from NOMAD_BLUESKY_LOG_FORMAT env var or text)",
+    )
 
     parser.add_argument(
         "--nomad-api-token",
@@ -31,6 +72,136 @@ def main():
         help="Nomad API URL (default: from NOMAD_API_URL env var)",
     )
 
+    parser.add_argument(
+        "--nomad-pool-size",
+        type=int,
+        default=int(os.environ.get("NOMAD_POOL_SIZE", DEFAULT_POOL_SIZE)),
+        help=f"Number of connections kept open to nomad (default: from NOMAD_POOL_SIZE env var or {DEFAULT_POOL_SIZE})",
+    )
+
+    parser.add_argument(
+        "--upload-chunk-size",
+        type=int,
+        default=int(os.environ.get("NOMAD_UPLOAD_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)),
+        help=f"Size in bytes of the chunks files are zipped and sent in (default: from NOMAD_UPLOAD_CHUNK_SIZE env var or {DEFAULT_CHUNK_SIZE})",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=METHODS,
+        default=os.environ.get("NOMAD_COMPRESSION", "auto"),
+        help="How uploads are compressed, `auto` stores payloads which won't compress well (default: from NOMAD_COMPRESSION env var or auto)",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=os.environ.get("NOMAD_COMPRESSION_LEVEL"),
+        help="Compression level passed to zip (default: from NOMAD_COMPRESSION_LEVEL env var or the zip default)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("NOMAD_BLUESKY_WORKERS", DEFAULT_WORKERS)),
+        help=f"Number of runs uploaded in parallel (default: from NOMAD_BLUESKY_WORKERS env var or {DEFAULT_WORKERS})",
+    )
+
+    parser.add_argument(
+        "--max-queued-documents",
+        type=int,
+        default=int(os.environ.get("MAX_QUEUED_DOCUMENTS", DEFAULT_MAX_IN_MEMORY)),
+        help=f"Documents held in memory waiting to be uploaded before they are spilled to disk (default: from MAX_QUEUED_DOCUMENTS env var or {DEFAULT_MAX_IN_MEMORY})",
+    )
+    parser.add_argument(
+        "--spill-path",
+        type=Path,
+        default=os.environ.get("SPILL_PATH"),
+        help="File documents are spilled to (default: from SPILL_PATH env var or a temporary file)",
+    )
+    parser.add_argument(
+        "--max-spill-bytes",
+        type=int,
+        default=int(os.environ.get("MAX_SPILL_BYTES", DEFAULT_MAX_SPILL_BYTES)),
+        help=f"Size of the spill file after which receiving documents blocks (default: from MAX_SPILL_BYTES env var or {DEFAULT_MAX_SPILL_BYTES})",
+    )
+
+    parser.add_argument(
+        "--state-path",
+        type=Path,
+        default=os.environ.get("STATE_PATH"),
+        help="SQLite database runs in progress are recorded in, so uploading can resume after a restart (default: from STATE_PATH env var or not persisted)",
+    )
+
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=int(os.environ.get("NOMAD_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)),
+        help=f"Times a request to nomad is tried before its document is given up on (default: from NOMAD_MAX_ATTEMPTS env var or {DEFAULT_MAX_ATTEMPTS})",
+    )
+    parser.add_argument(
+        "--json-encoder",
+        choices=BACKENDS,
+        default=os.environ.get("NOMAD_JSON_ENCODER", "auto"),
+        help="How documents are serialized to json, auto uses orjson if it's installed (default: from NOMAD_JSON_ENCODER env var or auto)",
+    )
+    parser.add_argument(
+        "--columnar",
+        choices=COLUMNAR_FORMATS,
+        default=os.environ.get("NOMAD_COLUMNAR"),
+        help="Write the events of each stream as one columnar file per run in this format instead of json lines (default: from NOMAD_COLUMNAR env var or json lines)",
+    )
+    parser.add_argument(
+        "--aggregate",
+        action="store_true",
+        help="Stage the documents of each run and upload them as a single archive at stop, instead of a file per document, so NOMAD processes the upload once per run",
+    )
+    parser.add_argument(
+        "--upload-metadata",
+        type=json.loads,
+        default=os.environ.get("UPLOAD_METADATA"),
+        help="Json of the metadata set on each upload once it's processed after its run stopped, e.g. its datasets or references (default: from UPLOAD_METADATA env var or none)",
+    )
+    parser.add_argument(
+        "--watch-uploads",
+        action="store_true",
+        help="Poll the processing status of the uploads of all runs in progress together, logging each as it's processed or fails",
+    )
+    parser.add_argument(
+        "--staging-path",
+        type=Path,
+        default=os.environ.get("STAGING_PATH"),
+        help="Directory runs are staged in with --aggregate (default: from STAGING_PATH env var or a temporary directory)",
+    )
+    parser.add_argument(
+        "--checkpoint-bytes",
+        type=int,
+        default=int(os.environ.get("CHECKPOINT_BYTES", DEFAULT_CHECKPOINT_BYTES)),
+        help=f"With --aggregate, upload a run in checkpoints of this many bytes of documents (default: from CHECKPOINT_BYTES env var or {DEFAULT_CHECKPOINT_BYTES})",
+    )
+    parser.add_argument(
+        "--dedup-cache-entries",
+        type=int,
+        default=int(os.environ.get("DEDUP_CACHE_ENTRIES", "0")),
+        help="Remember the hashes of this many documents and files uploaded, so unchanged ones aren't sent again and large files already in another upload are referenced (default: from DEDUP_CACHE_ENTRIES env var or 0, disabled)",
+    )
+    parser.add_argument(
+        "--run-timeout",
+        type=float,
+        default=float(os.environ.get("RUN_TIMEOUT", DEFAULT_RUN_TIMEOUT)),
+        help=f"Seconds without documents after which a run is finished without its stop, 0 to wait forever (default: from RUN_TIMEOUT env var or {DEFAULT_RUN_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=os.environ.get("METRICS_PORT"),
+        help="Serve Prometheus metrics at /metrics on this port, with --processes each worker process serves its own on the ports following it (default: from METRICS_PORT env var or not served)",
+    )
+    parser.add_argument(
+        "--dead-letter-path",
+        type=Path,
+        default=os.environ.get("DEAD_LETTER_PATH"),
+        help="File documents which couldn't be uploaded are written to (default: from DEAD_LETTER_PATH env var or only logged)",
+    )
+
     subparsers = parser.add_subparsers(dest="mode", required=True)
 
     zmq_parser = subparsers.add_parser("zmq")
@@ -41,6 +212,25 @@ def main():
         default=os.environ.get("ZMQ_URL"),
         help="ZMQ address (default: from ZMQ_URL env var)",
     )
+    zmq_parser.add_argument(
+        "--asyncio",
+        action="store_true",
+        help="Upload documents concurrently from a single asyncio event loop instead of worker threads, only start, descriptor, event and stop documents are uploaded and options beyond those of the client aren't supported",
+    )
+    zmq_parser.add_argument(
+        "--max-concurrent-uploads",
+        type=int,
+        default=int(
+            os.environ.get("MAX_CONCURRENT_UPLOADS", DEFAULT_MAX_CONCURRENT_UPLOADS)
+        ),
+        help=f"Requests in flight at once with --asyncio (default: from MAX_CONCURRENT_UPLOADS env var or {DEFAULT_MAX_CONCURRENT_UPLOADS})",
+    )
+    zmq_parser.add_argument(
+        "--processes",
+        type=int,
+        default=int(os.environ.get("NOMAD_BLUESKY_PROCESSES", DEFAULT_PROCESSES)),
+        help=f"Worker processes runs are sharded across, each with --workers threads, restarted if they die (default: from NOMAD_BLUESKY_PROCESSES env var or {DEFAULT_PROCESSES})",
+    )
 
     tiled_parser = subparsers.add_parser("tiled")
 
@@ -63,9 +253,76 @@ def main():
         default=float(os.environ.get("TILED_POLL_PERIOD", DEFAULT_POLL_PERIOD)),
         help=f"Polling period in seconds (default: from TILED_POLL_PERIOD env var or {DEFAULT_POLL_PERIOD})",
     )
+    tiled_parser.add_argument(
+        "--tiled-page-size",
+        type=int,
+        default=int(os.environ.get("TILED_PAGE_SIZE", DEFAULT_PAGE_SIZE)),
+        help=f"Runs fetched from tiled per request (default: from TILED_PAGE_SIZE env var or {DEFAULT_PAGE_SIZE})",
+    )
+
+    backfill_parser = subparsers.add_parser(
+        "backfill",
+        help="Upload past runs, from tiled or document files, as fast as NOMAD allows",
+    )
+
+    backfill_parser.add_argument(
+        "paths",
+        type=Path,
+        nargs="*",
+        help="Document files of a run each, .jsonl or .msgpack, or directories of them",
+    )
+    backfill_parser.add_argument(
+        "--tiled-url",
+        type=str,
+        default=os.environ.get("TILED_URL"),
+        help="Tiled catalog to read runs from (default: from TILED_URL env var or only the paths)",
+    )
+    backfill_parser.add_argument(
+        "--tiled-api-key",
+        type=str,
+        default=os.environ.get("TILED_API_KEY"),
+        help="Tiled API key (default: from TILED_API_KEY env var)",
+    )
+    backfill_parser.add_argument(
+        "--tiled-page-size",
+        type=int,
+        default=int(os.environ.get("TILED_PAGE_SIZE", DEFAULT_PAGE_SIZE)),
+        help=f"Runs fetched from tiled per request (default: from TILED_PAGE_SIZE env var or {DEFAULT_PAGE_SIZE})",
+    )
+    backfill_parser.add_argument(
+        "--since",
+        type=float,
+        help="Only runs from tiled started at or after this unix time",
+    )
+    backfill_parser.add_argument(
+        "--until",
+        type=float,
+        help="Only runs from tiled started before this unix time",
+    )
+    backfill_parser.add_argument(
+        "--checkpoint-path",
+        type=Path,
+        default=os.environ.get("BACKFILL_CHECKPOINT_PATH"),
+        help="File recording the runs read, skipped when the backfill is run again (default: from BACKFILL_CHECKPOINT_PATH env var or none)",
+    )
+    backfill_parser.add_argument(
+        "--parallel-runs",
+        type=int,
+        default=int(os.environ.get("BACKFILL_PARALLEL_RUNS", DEFAULT_PARALLEL_RUNS)),
+        help=f"Runs read at once (default: from BACKFILL_PARALLEL_RUNS env var or {DEFAULT_PARALLEL_RUNS})",
+    )
+    backfill_parser.add_argument(
+        "--max-documents-per-second",
+        type=float,
+        default=float(os.environ.get("BACKFILL_MAX_DOCUMENTS_PER_SECOND", "0")),
+        help="Limit on the rate documents are read at, to leave NOMAD capacity for live runs (default: from BACKFILL_MAX_DOCUMENTS_PER_SECOND env var or 0, unlimited)",
+    )
 
     args = parser.parse_args()
     logger.setLevel(args.log_level)
+    if args.log_format == "key-value":
+        use_key_value_format()
+    use_queue_handler()
     if args.nomad_api_token is None:
         print(
             "nomad_bluesky: error: the following arguments are required: --nomad-api-token, "
@@ -79,6 +336,40 @@ def main():
         )
         exit(1)
 
+    if args.metrics_port is not None:
+        serve_metrics(args.metrics_port)
+
+    compression = CompressionPolicy(args.compression, args.compression_level)
+    columnar = ColumnarSerializer(args.columnar) if args.columnar else None
+
+    client_options = {
+        # Every worker should be able to hold a connection open.
+        "pool_size": max(args.nomad_pool_size, args.workers),
+        "chunk_size": args.upload_chunk_size,
+        "compression": compression,
+        "retry": RetryPolicy(args.max_attempts),
+        "encoder": JsonEncoder(args.json_encoder),
+        "cache": UploadCache(args.dedup_cache_entries)
+        if args.dedup_cache_entries
+        else None,
+    }
+    callback_options = {
+        "workers": args.workers,
+        "max_queued_documents": args.max_queued_documents,
+        "spill_path": args.spill_path,
+        "max_spill_bytes": args.max_spill_bytes,
+        "state_path": args.state_path,
+        "dead_letter_path": args.dead_letter_path,
+        "columnar": columnar,
+        "aggregate": args.aggregate,
+        "staging_path": args.staging_path,
+        "checkpoint_bytes": args.checkpoint_bytes,
+        "run_timeout": args.run_timeout or None,
+        "upload_metadata": args.upload_metadata,
+        "watch_uploads": args.watch_uploads,
+    }
+    client = NomadClient(args.nomad_api_url, args.nomad_api_token, **client_options)
+
     if args.mode == "zmq":
         if args.zmq_url is None:
             print(
@@ -86,12 +377,106 @@ def main():
                 "alternatively set the environment variable ZMQ_URL"
             )
             exit(1)
-        callback = NomadCallback(args.nomad_api_url, args.nomad_api_token, args.zmq_url)
+        if args.asyncio:
+            # Only the options of the client carry over to the event loop, the
+            # rest configure the worker threads and what they do with each run.
+            unsupported = {
+                "--workers": args.workers != DEFAULT_WORKERS,
+                "--max-queued-documents": args.max_queued_documents
+                != DEFAULT_MAX_IN_MEMORY,
+                "--spill-path": args.spill_path is not None,
+                "--max-spill-bytes": args.max_spill_bytes != DEFAULT_MAX_SPILL_BYTES,
+                "--state-path": args.state_path is not None,
+                "--max-attempts": args.max_attempts != DEFAULT_MAX_ATTEMPTS,
+                "--columnar": args.columnar is not None,
+                "--aggregate": args.aggregate,
+                "--upload-metadata": args.upload_metadata is not None,
+                "--watch-uploads": args.watch_uploads,
+                "--staging-path": args.staging_path is not None,
+                "--checkpoint-bytes": args.checkpoint_bytes != DEFAULT_CHECKPOINT_BYTES,
+                "--dedup-cache-entries": args.dedup_cache_entries != 0,
+                "--run-timeout": args.run_timeout != DEFAULT_RUN_TIMEOUT,
+                "--dead-letter-path": args.dead_letter_path is not None,
+                "--processes": args.processes != DEFAULT_PROCESSES,
+            }
+            if any(unsupported.values()):
+                zmq_parser.error(
+                    "argument --asyncio: not allowed with "
+                    + ", ".join(flag for flag, given in unsupported.items() if given)
+                    + " (set from the command line or the environment)"
+                )
+            callback = AsyncNomadCallback(
+                args.nomad_api_url,
+                args.nomad_api_token,
+                args.zmq_url,
+                max_concurrent_uploads=args.max_concurrent_uploads,
+                client=AsyncNomadClient(
+                    args.nomad_api_url,
+                    args.nomad_api_token,
+                    pool_size=max(args.nomad_pool_size, args.max_concurrent_uploads),
+                    chunk_size=args.upload_chunk_size,
+                    compression=compression,
+                    encoder=client_options["encoder"],
+                ),
+                compression=compression,
+            )
+        elif args.processes > 1:
+            callback = NomadSupervisor(
+                args.nomad_api_url,
+                args.nomad_api_token,
+                args.zmq_url,
+                processes=args.processes,
+                client_options=client_options,
+                callback_options=callback_options,
+                run_timeout=args.run_timeout or None,
+                metrics_port=args.metrics_port,
+            )
+        else:
+            callback = NomadCallback(
+                args.nomad_api_url,
+                args.nomad_api_token,
+                args.zmq_url,
+                client=client,
+                **callback_options,
+            )
         logger.info(
             f"Listening on zmq `{args.zmq_url}` and will send data to nomad at `{args.nomad_api_url}`."
         )
 
         callback.serve()
+    elif args.mode == "backfill":
+        if not args.paths and args.tiled_url is None:
+            print(
+                "nomad_bluesky backfill: error: give document files or --tiled-url, "
+                "alternatively set the environment variable TILED_URL"
+            )
+            exit(1)
+
+        # Each run is uploaded as one archive, the fewest requests for a complete run.
+        callback = NomadCallback(
+            args.nomad_api_url,
+            args.nomad_api_token,
+            client=client,
+            **{**callback_options, "aggregate": True},
+        )
+        runs = file_runs(args.paths)
+        if args.tiled_url is not None:
+            runs = itertools.chain(
+                runs,
+                tiled_runs(
+                    connect(args.tiled_url, args.tiled_api_key),
+                    since=args.since,
+                    until=args.until,
+                    page_size=args.tiled_page_size,
+                ),
+            )
+        logger.info(f"Backfilling runs into nomad at `{args.nomad_api_url}`.")
+        Backfill(
+            callback,
+            checkpoint_path=args.checkpoint_path,
+            parallel_runs=args.parallel_runs,
+            max_documents_per_second=args.max_documents_per_second or None,
+        ).run(runs)
     else:
         if args.tiled_url is None:
             print(
@@ -106,12 +491,18 @@ def main():
             )
             exit(1)
 
+        callback = NomadCallback(
+            args.nomad_api_url, args.nomad_api_token, client=client, **callback_options
+        )
         listener = NomadTiledListener(
-            args.nomad_api_token,
             args.nomad_api_url,
+            args.nomad_api_token,
             args.tiled_url,
             args.tiled_api_key,
             poll_period=args.tiled_poll_period,
+            client=client,
+            callback=callback,
+            page_size=args.tiled_page_size,
         )
         logger.info(
             f"Listening on tiled `{args.tiled_url}` and will send data to nomad at `{args.nomad_api_url}`."
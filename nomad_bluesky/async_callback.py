@@ -0,0 +1,303 @@
+import asyncio
+import threading
+import typing
+from collections.abc import Coroutine
+
+from bluesky.callbacks.zmq import RemoteDispatcher
+from event_model.documents import Event, EventDescriptor, RunStart, RunStop
+
+from .async_nomad_api import AsyncNomadClient
+from .callback import (
+    DEFAULT_BATCH_MAX_BYTES,
+    DEFAULT_BATCH_MAX_EVENTS,
+    DEFAULT_BATCH_MAX_SECONDS,
+    Document,
+    _EventBatch,
+)
+from .compression import CompressionPolicy
+from .logger import logger
+
+DEFAULT_MAX_CONCURRENT_UPLOADS = 100
+
+
+class _AsyncRun:
+    """The uploads in flight for a single run."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        # Resolved once the upload is created and the start document is in it.
+        self.upload_id: asyncio.Future[str] = loop.create_future()
+        self.descriptors: dict[str, asyncio.Task] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+
+class AsyncNomadCallback:
+    """An asyncio version of `NomadCallback`.
+
+    Rather than handing documents to upload threads, every upload is a task on a
+    single event loop so that up to `max_concurrent_uploads` requests can be in
+    flight at once. Within a run the upload is created before anything is added to
+    it, descriptors are added before their events and the stop is added last.
+
+    Only start, descriptor, event and stop documents are uploaded. Unlike
+    `NomadCallback`, event pages, resources and datums are logged and dropped, and
+    runs aren't journaled, spilled, aggregated or watched.
+    """
+
+    def __init__(
+        self,
+        nomad_api_url: str,
+        nomad_api_token: str,
+        zmq_url: str | None = None,
+        batch_max_events: int = DEFAULT_BATCH_MAX_EVENTS,
+        batch_max_bytes: int = DEFAULT_BATCH_MAX_BYTES,
+        batch_max_seconds: float = DEFAULT_BATCH_MAX_SECONDS,
+        max_concurrent_uploads: int = DEFAULT_MAX_CONCURRENT_UPLOADS,
+        client: AsyncNomadClient | None = None,
+        compression: CompressionPolicy | None = None,
+    ):
+        self.NOMAD_API_URL: str = nomad_api_url
+        self.NOMAD_API_TOKEN: str = nomad_api_token
+        self.ZMQ_URL: str | None = zmq_url
+
+        self._client = client or AsyncNomadClient(
+            nomad_api_url, nomad_api_token, pool_size=max_concurrent_uploads
+        )
+        self._max_concurrent_uploads = max_concurrent_uploads
+
+        # Falls back to the policy of the client if `None`.
+        self._compression = compression
+
+        self._batch_max_events = batch_max_events
+        self._batch_max_bytes = batch_max_bytes
+        self._batch_max_seconds = batch_max_seconds
+
+        # Created on the event loop by `serve`.
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._upload_slots: asyncio.Semaphore | None = None
+        self._loop_thread: threading.Thread | None = None
+
+        self._runs: dict[str, _AsyncRun] = {}
+        self._descriptor_to_run_start: dict[str, str] = {}
+        self._event_batches: dict[str, _EventBatch] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def __call__(self, name: str, document: Document):
+        """Thread safe, for subscribing directly to a `RunEngine`."""
+
+        if self._loop is None:
+            raise RuntimeError("`serve` must be called before documents are sent.")
+        self._loop.call_soon_threadsafe(self.send_document, name, document)
+
+    def _start_loop(self) -> asyncio.AbstractEventLoop:
+        self._loop = asyncio.new_event_loop()
+        self._upload_slots = asyncio.Semaphore(self._max_concurrent_uploads)
+        return self._loop
+
+    def serve(self):
+        """If provided, listen on `zmq_url` and upload documents on the same event loop.
+
+        This is blocking. If no `zmq_url` is provided the loop is run in a different
+        thread and documents can be sent from this thread with `__call__`.
+        """
+
+        loop = self._start_loop()
+        if self.ZMQ_URL:
+            dispatcher = RemoteDispatcher(self.ZMQ_URL, loop=loop)
+            dispatcher.subscribe(self.send_document)
+            dispatcher.start()
+        else:
+            self._loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+            self._loop_thread.start()
+
+    def join(self):
+        """Wait for every document sent so far to be uploaded, then stop the loop."""
+
+        if self._loop is None or self._loop_thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.drain(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+
+    async def drain(self):
+        """Upload all batched events and wait for every upload in flight."""
+
+        self.flush_event_batches()
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _spawn(self, run: _AsyncRun, coroutine: Coroutine) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(coroutine)
+        run.tasks.add(task)
+        self._tasks.add(task)
+
+        def done(task: asyncio.Task):
+            run.tasks.discard(task)
+            self._tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(
+                    "Upload failed", exc_info=typing.cast(Exception, task.exception())
+                )
+
+        task.add_done_callback(done)
+        return task
+
+    def send_document(self, name: str, document: Document):
+        """Schedule the upload of `document`, must be called on the event loop."""
+
+        match name:
+            case "start":
+                self.upload_run_start(typing.cast(RunStart, document))
+            case "stop":
+                self.upload_run_stop(typing.cast(RunStop, document))
+            case "descriptor":
+                self.upload_descriptor(typing.cast(EventDescriptor, document))
+            case "event":
+                self.upload_event(typing.cast(Event, document))
+            case _:
+                logger.error(
+                    f"Receieved unsupported document `{name}`. Other documents are in progress."
+                )
+
+    def upload_run_start(self, document: RunStart):
+        run = _AsyncRun(asyncio.get_running_loop())
+        self._runs[document["uid"]] = run
+        self._spawn(run, self._upload_run_start(run, document))
+
+    async def _upload_run_start(self, run: _AsyncRun, document: RunStart):
+        assert self._upload_slots
+        upload_name = f"run_{document['time']}"
+        try:
+            async with self._upload_slots:
+                upload_id = (await self._client.create_upload(upload_name))["upload_id"]
+            logger.info(
+                f"Created upload with name `{upload_name}` and ID `{upload_id}`"
+            )
+
+            async with self._upload_slots:
+                await self._client.add_dictionary_to_upload(
+                    f"{document['time']}_start",
+                    typing.cast(dict, document),
+                    upload_id,
+                    compression=self._compression,
+                )
+        except Exception as exception:
+            run.upload_id.set_exception(exception)
+            raise
+        run.upload_id.set_result(upload_id)
+        logger.info(
+            f"Added `start` document `{document['uid']}` to upload `{upload_id}`."
+        )
+
+    def upload_run_stop(self, document: RunStop):
+        self.flush_event_batches(run_start=document["run_start"])
+
+        run = self._runs.pop(document["run_start"])
+        for descriptor_uid in run.descriptors:
+            self._descriptor_to_run_start.pop(descriptor_uid, None)
+        self._spawn(run, self._upload_run_stop(run, document))
+
+    async def _upload_run_stop(self, run: _AsyncRun, document: RunStop):
+        assert self._upload_slots
+        current = asyncio.current_task()
+        await asyncio.gather(
+            *(task for task in run.tasks if task is not current),
+            return_exceptions=True,
+        )
+        upload_id = await run.upload_id
+
+        async with self._upload_slots:
+            await self._client.add_dictionary_to_upload(
+                f"{document['time']}_stop",
+                typing.cast(dict, document),
+                upload_id,
+                compression=self._compression,
+            )
+        logger.debug(
+            "Added `stop` document `%s` to upload `%s`.", document["uid"], upload_id
+        )
+
+    def upload_descriptor(self, document: EventDescriptor):
+        self._descriptor_to_run_start[document["uid"]] = document["run_start"]
+        run = self._runs[document["run_start"]]
+        run.descriptors[document["uid"]] = self._spawn(
+            run, self._upload_descriptor(run, document)
+        )
+
+    async def _upload_descriptor(self, run: _AsyncRun, document: EventDescriptor):
+        assert self._upload_slots
+        upload_id = await run.upload_id
+
+        async with self._upload_slots:
+            await self._client.add_dictionary_to_upload(
+                f"{document['time']}_descriptor",
+                typing.cast(dict, document),
+                upload_id,
+                compression=self._compression,
+            )
+        logger.debug(
+            "Added `descriptor` document `%s` to upload `%s`.",
+            document["uid"],
+            upload_id,
+        )
+
+    def upload_event(self, document: Event):
+        descriptor_uid = document["descriptor"]
+        batch = self._event_batches.get(descriptor_uid)
+        if batch is None:
+            # The upload id isn't known until the upload is created,
+            # it's filled in from the run when the batch is uploaded.
+            batch = _EventBatch(
+                self._descriptor_to_run_start[descriptor_uid],
+                "",
+                encoder=self._client.encoder,
+            )
+            self._event_batches[descriptor_uid] = batch
+            asyncio.get_running_loop().call_later(
+                self._batch_max_seconds, self._flush_expired_event_batch, batch
+            )
+
+        batch.add(document)
+        if (
+            len(batch.lines) >= self._batch_max_events
+            or batch.number_of_bytes >= self._batch_max_bytes
+        ):
+            self._flush_event_batch(descriptor_uid)
+
+    def _flush_expired_event_batch(self, batch: _EventBatch):
+        # The batch may already have been flushed by size or by its run stopping.
+        for descriptor_uid, current_batch in list(self._event_batches.items()):
+            if current_batch is batch:
+                self._flush_event_batch(descriptor_uid)
+
+    def _flush_event_batch(self, descriptor_uid: str):
+        batch = self._event_batches.pop(descriptor_uid)
+        run = self._runs[batch.run_start]
+        self._spawn(run, self._upload_event_batch(run, descriptor_uid, batch))
+
+    async def _upload_event_batch(
+        self, run: _AsyncRun, descriptor_uid: str, batch: _EventBatch
+    ):
+        assert self._upload_slots
+        await run.descriptors[descriptor_uid]
+        upload_id = await run.upload_id
+
+        async with self._upload_slots:
+            await self._client.add_json_lines_to_upload(
+                f"{batch.first_event_time}_events_{descriptor_uid}",
+                batch.lines,
+                upload_id,
+                compression=self._compression,
+            )
+        logger.debug(
+            "Added %d `event` documents from descriptor `%s` to upload `%s`.",
+            len(batch.lines),
+            descriptor_uid,
+            upload_id,
+        )
+
+    def flush_event_batches(self, run_start: str | None = None):
+        """Schedule the upload of all batched events, or only those belonging to `run_start` if given."""
+
+        for descriptor_uid, batch in list(self._event_batches.items()):
+            if run_start is None or batch.run_start == run_start:
+                self._flush_event_batch(descriptor_uid)
@@ -0,0 +1,219 @@
+import asyncio
+from collections.abc import AsyncIterator
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+from .compression import CompressionPolicy
+from .json_encoder import DEFAULT_ENCODER, JsonEncoder
+from .logger import logger, pretty
+from .nomad_api import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+    _zip_dictionary,
+    _zip_json_lines,
+    _ZipStream,
+)
+
+
+async def _aiter_chunks(zip_stream: _ZipStream) -> AsyncIterator[bytes]:
+    chunks = iter(zip_stream)
+    sentinel = object()
+    while (chunk := await asyncio.to_thread(next, chunks, sentinel)) is not sentinel:
+        yield chunk
+
+
+class AsyncNomadClient:
+    """An asyncio version of `NomadClient`.
+
+    Many requests can be in flight at once on a single thread, up to `pool_size`
+    connections are kept open to the NOMAD API.
+    """
+
+    def __init__(
+        self,
+        nomad_url: str,
+        nomad_token: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        compression: CompressionPolicy | None = None,
+        encoder: JsonEncoder | None = None,
+    ):
+        self.nomad_url = nomad_url
+        self.nomad_token = nomad_token
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.compression = compression or CompressionPolicy()
+        self.encoder = encoder or DEFAULT_ENCODER
+
+        self._client = httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {nomad_token}",
+                "Accept": "application/json",
+            },
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            timeout=timeout,
+        )
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def create_dataset(
+        self, dataset_name: str, timeout: float | None = None
+    ) -> dict[str, Any]:
+        response = await self._client.post(
+            f"{self.nomad_url}datasets/",
+            json={"dataset_name": dataset_name},
+            timeout=timeout or self.timeout,
+        )
+        response.raise_for_status()
+
+        response_json = response.json()
+        logger.debug("create_dataset: %s", pretty(response_json))
+        return response_json
+
+    async def create_upload(self, upload_name: str, timeout: float | None = None):
+        response = await self._client.post(
+            f"{self.nomad_url}/uploads?upload_name={upload_name}",
+            timeout=timeout or self.timeout,
+        )
+        response.raise_for_status()
+
+        response_json = response.json()
+        logger.debug("create_upload: %s", pretty(response_json))
+        return response_json
+
+    async def add_dictionary_to_upload(
+        self,
+        name: str,
+        data: dict[Any, Any],
+        upload_uid: str,
+        timeout: float | None = None,
+        compression: CompressionPolicy | None = None,
+    ):
+        """Add the python dictionary `data`, as a .json, to the upload."""
+
+        response = await self._client.put(
+            f"{self.nomad_url}/uploads/{upload_uid}/raw/{name}",
+            content=_zip_dictionary(
+                name, data, compression or self.compression, self.encoder
+            ).getvalue(),
+            timeout=timeout or self.timeout,
+        )
+        response.raise_for_status()
+
+        response_json = response.json()
+        logger.debug("add_dictionary_to_upload: %s", pretty(response_json))
+        return response_json
+
+    async def add_json_lines_to_upload(
+        self,
+        name: str,
+        lines: list[bytes],
+        upload_uid: str,
+        timeout: float | None = None,
+        compression: CompressionPolicy | None = None,
+    ):
+        """Add the already serialized json `lines`, as a newline-delimited .jsonl, to the upload."""
+
+        # Batches can be large enough that compressing them would stall the event loop.
+        zip_buffer = await asyncio.to_thread(
+            _zip_json_lines, name, lines, compression or self.compression
+        )
+        response = await self._client.put(
+            f"{self.nomad_url}/uploads/{upload_uid}/raw/{name}",
+            content=zip_buffer.getvalue(),
+            timeout=timeout or self.timeout,
+        )
+        response.raise_for_status()
+
+        response_json = response.json()
+        logger.debug("add_json_lines_to_upload: %s", pretty(response_json))
+        return response_json
+
+    async def add_file_to_upload(
+        self,
+        name: str,
+        upload_path: Path,
+        upload_uid: str,
+        timeout: float | None = None,
+        compression: CompressionPolicy | None = None,
+    ):
+        """Upload a single file under the `parent_upload_name` upload."""
+
+        zip_stream = _ZipStream(
+            [(upload_path, upload_path.name)],
+            compression or self.compression,
+            self.chunk_size,
+        )
+        try:
+            response = await self._client.put(
+                f"{self.nomad_url}/uploads/{upload_uid}/raw/{name}",
+                content=_aiter_chunks(zip_stream),
+                timeout=timeout or self.timeout,
+            )
+            response.raise_for_status()
+
+            response_json = response.json()
+            logger.debug("add_file_to_upload: %s", pretty(response_json))
+            return response_json
+
+        finally:
+            zip_stream.close()
+
+    async def check_upload_status(
+        self, upload_id: str, timeout: float | None = None
+    ) -> dict[str, Any]:
+        response = await self._client.get(
+            f"{self.nomad_url}/uploads/{upload_id}",
+            timeout=timeout or self.timeout,
+        )
+        response.raise_for_status()
+
+        response_json = response.json()
+        logger.debug("check_upload_status: %s", pretty(response_json))
+        return response_json
+
+    async def add_upload_metadata(
+        self, upload_id: str, metadata: dict, timeout: float | None = None
+    ) -> dict[str, Any]:
+        response = await self._client.post(
+            f"{self.nomad_url}/uploads/{upload_id}/edit",
+            json={"metadata": metadata} if metadata else None,
+            timeout=timeout or self.timeout,
+        )
+        response.raise_for_status()
+
+        response_json = response.json()
+        logger.debug("add_upload_metadata: %s", pretty(response_json))
+        return response_json
+
+    async def query(
+        self,
+        query_fields: list[str],
+        page_size=1,
+        required: list[str] | None = None,
+        timeout: float | None = None,
+    ) -> dict[str, Any]:
+        query = {
+            "query": {"all": query_fields},
+            "pagination": {"page_size": page_size},
+        }
+        if required:
+            query.update({"required": {"include": required}})
+
+        response = await self._client.post(
+            f"{self.nomad_url}/entries/query",
+            json=query,
+            timeout=timeout or self.timeout,
+        )
+        response.raise_for_status()
+
+        response_json = response.json()
+        logger.debug("query: %s", pretty(response_json))
+        return response_json
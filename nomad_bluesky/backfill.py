@@ -0,0 +1,219 @@
+import concurrent.futures
+import json
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+
+from tiled.client.container import Container
+from tiled.queries import Key
+
+from .callback import Document, NomadCallback
+from .logger import logger
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+DEFAULT_PARALLEL_RUNS = 4
+DEFAULT_TILED_PAGE_SIZE = 100
+
+# The suffixes of the document files read, as written by suitcase-jsonl and suitcase-msgpack.
+JSONL_SUFFIXES = (".jsonl",)
+MSGPACK_SUFFIXES = (".msgpack",)
+
+# A run to backfill, its ID in the checkpoint and a function reading its documents.
+Run = tuple[str, Callable[[], Iterable[tuple[str, Document]]]]
+
+
+def _read_jsonl(path: Path) -> Iterator[tuple[str, Document]]:
+    with path.open("rb") as file:
+        for line in file:
+            if line.strip():
+                name, document = json.loads(line)
+                yield name, document
+
+
+def _read_msgpack(path: Path) -> Iterator[tuple[str, Document]]:
+    assert msgpack is not None
+    with path.open("rb") as file:
+        yield from msgpack.Unpacker(file, raw=False)
+
+
+def file_runs(paths: Iterable[Path]) -> Iterator[Run]:
+    """A run for each document file in `paths`, or in the directories in `paths`, in name order.
+
+    Each file holds the `(name, document)` pairs of one run, as json lines or msgpack.
+    """
+
+    for path in paths:
+        files = sorted(path.rglob("*")) if path.is_dir() else [path]
+        for file in files:
+            if file.suffix in JSONL_SUFFIXES:
+                yield str(file), lambda file=file: _read_jsonl(file)
+            elif file.suffix in MSGPACK_SUFFIXES:
+                if msgpack is None:
+                    raise ValueError(
+                        f"Reading `{file}` requires msgpack to be installed"
+                    )
+                yield str(file), lambda file=file: _read_msgpack(file)
+            elif not file.is_dir():
+                logger.warning("Skipping `%s`, it isn't a document file.", file)
+
+
+def tiled_runs(
+    catalog: Container,
+    since: float | None = None,
+    until: float | None = None,
+    page_size: int = DEFAULT_TILED_PAGE_SIZE,
+) -> Iterator[Run]:
+    """Each stopped run in the tiled `catalog` started between `since` and `until`."""
+
+    runs = catalog
+    if since is not None:
+        runs = runs.search(Key("start.time") >= since)
+    if until is not None:
+        runs = runs.search(Key("start.time") < until)
+
+    offset = 0
+    while True:
+        page = runs.items()[offset : offset + page_size]
+        for uid, run in page:
+            if not run.metadata.get("stop"):
+                logger.warning("Skipping run `%s`, it hasn't stopped.", uid)
+                continue
+            yield uid, run.documents
+        if len(page) < page_size:
+            break
+        offset += page_size
+
+
+class _RateLimiter:
+    """Blocks callers of `acquire` so that together they don't pass `rate` a second."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + 1 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Backfill:
+    """Replays past runs into NOMAD through `callback`, for bulk ingestion of old data.
+
+    `parallel_runs` runs are read at once, their documents interleaved in the
+    callback's queue, whose workers upload them. The IDs of the runs are appended to
+    `checkpoint_path` once NOMAD has accepted their stop, so that a backfill which was
+    stopped skips them when started again and replays the others. Give the callback a
+    `state_path` for the runs read but not yet uploaded to resume into their uploads,
+    rather than being uploaded again. `max_documents_per_second` limits the rate
+    documents are read at, so that a backfill alongside live ingestion doesn't starve it.
+    """
+
+    def __init__(
+        self,
+        callback: NomadCallback,
+        checkpoint_path: Path | None = None,
+        parallel_runs: int = DEFAULT_PARALLEL_RUNS,
+        max_documents_per_second: float | None = None,
+    ):
+        self._callback = callback
+        self._checkpoint_path = checkpoint_path
+        self._parallel_runs = parallel_runs
+        self._rate_limiter = (
+            _RateLimiter(max_documents_per_second) if max_documents_per_second else None
+        )
+
+        self._done: set[str] = set()
+        if checkpoint_path and checkpoint_path.exists():
+            self._done = set(checkpoint_path.read_text().splitlines())
+        self._checkpoint_lock = threading.Lock()
+
+        # The run ID of each run start read whose stop hasn't been uploaded yet.
+        self._unfinished: dict[str, str] = {}
+        on_run_uploaded = callback.on_run_uploaded
+
+        def uploaded(run_start: str, upload_id: str):
+            self._uploaded(run_start)
+            if on_run_uploaded:
+                on_run_uploaded(run_start, upload_id)
+
+        callback.on_run_uploaded = uploaded
+
+        self.runs = 0
+        self.documents = 0
+
+    def _replay(self, run_id: str, read: Callable[[], Iterable[tuple[str, Document]]]):
+        # Read in full before any of it is sent, so a run which can't be read isn't
+        # left part way through an upload.
+        try:
+            documents = list(read())
+        except Exception as exception:
+            # Left out of the checkpoint, so it's tried again by the next backfill.
+            logger.error(f"Failed to read run `{run_id}`: {exception!r}")
+            return
+
+        for name, document in documents:
+            if self._rate_limiter:
+                self._rate_limiter.acquire()
+            if name == "start":
+                with self._checkpoint_lock:
+                    self._unfinished[document["uid"]] = run_id
+            self._callback(name, document)
+
+        with self._checkpoint_lock:
+            self.documents += len(documents)
+        logger.info("Read run `%s` of %d documents.", run_id, len(documents))
+
+    def _uploaded(self, run_start: str):
+        with self._checkpoint_lock:
+            run_id = self._unfinished.pop(run_start, None)
+            if run_id is None:
+                return
+            self.runs += 1
+            if self._checkpoint_path:
+                with self._checkpoint_path.open("a") as checkpoint:
+                    checkpoint.write(run_id + "\n")
+
+    def run(self, runs: Iterable[Run]):
+        """Replay `runs`, skipping those already in the checkpoint, and wait for them to be uploaded."""
+
+        self._callback.serve()
+        with concurrent.futures.ThreadPoolExecutor(
+            self._parallel_runs, thread_name_prefix="nomad-backfill"
+        ) as executor:
+            # Only a few runs ahead are submitted, so that the catalog is read lazily.
+            pending: set[concurrent.futures.Future] = set()
+            for run_id, read in runs:
+                if run_id in self._done:
+                    continue
+                if len(pending) >= 2 * self._parallel_runs:
+                    finished, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in finished:
+                        future.result()
+                pending.add(executor.submit(self._replay, run_id, read))
+            for future in concurrent.futures.as_completed(pending):
+                future.result()
+        self._callback.join()
+        if self._unfinished:
+            logger.error(
+                "%d runs weren't uploaded, they're replayed by the next backfill: %s",
+                len(self._unfinished),
+                ", ".join(sorted(self._unfinished.values())),
+            )
+        logger.info(
+            "Backfilled %d runs of %d documents, skipping %d already done.",
+            self.runs,
+            self.documents,
+            len(self._done),
+        )
@@ -1,6 +1,15 @@
+import json
 import queue
-import typing
+import tempfile
 import threading
+import time
+import typing
+import urllib.parse
+import weakref
+import zlib
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
 
 from bluesky.callbacks.zmq import RemoteDispatcher
 from event_model.documents import (
@@ -16,8 +25,22 @@ from event_model.documents import (
     StreamResource,
 )
 
+from . import metrics
+from .columnar import ColumnarSerializer, _StreamColumns
+from .compression import CompressionPolicy
+from .dead_letter import DeadLetterStore
+from .document_queue import (
+    DEFAULT_MAX_IN_MEMORY,
+    DEFAULT_MAX_SPILL_BYTES,
+    SpillQueue,
+)
+from .json_encoder import DEFAULT_ENCODER, JsonEncoder
 from .logger import logger
-from .nomad_api import add_dictionary_to_upload, create_upload
+from .nomad_api import NomadClient
+from .run_archive import DEFAULT_CHECKPOINT_BYTES, RunArchive
+from .run_index import DEFAULT_RUN_TIMEOUT, RunIndex
+from .state_store import StateStore
+from .upload_watcher import UploadCallback, UploadWatcher
 
 Document = (
     Datum
@@ -32,50 +55,375 @@ Document = (
     | StreamResource
 )
 
+# An event batch is written to the upload once any of these are reached.
+DEFAULT_BATCH_MAX_EVENTS = 1000
+DEFAULT_BATCH_MAX_BYTES = 4 * 1024 * 1024
+DEFAULT_BATCH_MAX_SECONDS = 1.0
+
+DEFAULT_WORKERS = 1
+
+# Documents routed to a worker but not yet uploaded, beyond this routing blocks
+# and documents back up in the (spilling) document queue instead.
+WORKER_QUEUE_SIZE = 1000
+
+# Seconds between checks of a worker for runs which have timed out.
+RUN_TIMEOUT_CHECK_PERIOD = 60.0
+
+# Every callback in the process, their gauges are summed over when the metrics are
+# collected, so they cost nothing in between, without keeping the callbacks alive.
+_callbacks: "weakref.WeakSet[NomadCallback]" = weakref.WeakSet()
+
+
+def _total(value: "Callable[[NomadCallback], float]") -> Callable[[], float]:
+    return lambda: sum(value(callback) for callback in list(_callbacks))
+
+
+metrics.QUEUE_DEPTH.set_function(
+    _total(lambda callback: callback._document_queue.qsize()), ("documents",)
+)
+metrics.QUEUE_DEPTH.set_function(
+    _total(lambda callback: sum(q.qsize() for q in callback._worker_queues)),
+    ("workers",),
+)
+metrics.SPILLED_DOCUMENTS.set_function(
+    _total(lambda callback: callback._document_queue.metrics()["spilled"])
+)
+metrics.SPILL_BYTES.set_function(
+    _total(lambda callback: callback._document_queue.metrics()["spill_bytes"])
+)
+metrics.DRAIN_RATE.set_function(
+    _total(lambda callback: callback._document_queue.metrics()["drain_rate"])
+)
+metrics.IN_FLIGHT_RUNS.set_function(
+    _total(lambda callback: len(callback._run_start_to_upload))
+)
+
+
+class _EventBatch:
+    """Serialized events from a single descriptor waiting to be written to the upload together.
+
+    Also used for the other high-rate documents, event pages of a descriptor and
+    datums, datum pages and stream datums of a resource, with `name` set to theirs.
+    Pages are kept as they are, one columnar line per page.
+    """
+
+    def __init__(
+        self,
+        run_start: str,
+        upload_id: str,
+        name: str = "event",
+        encoder: JsonEncoder = DEFAULT_ENCODER,
+    ):
+        self.run_start = run_start
+        self.upload_id = upload_id
+        self.name = name
+        self.encoder = encoder
+        self.lines: list[bytes] = []
+        # Journal sequence numbers of the documents, acknowledged once the batch is uploaded.
+        self.seqs: list[int] = []
+        # Events or datums in the batch, pages hold several.
+        self.number_of_events = 0
+        self.number_of_bytes = 0
+        self.first_event_time: float | None = None
+        self.created = time.monotonic()
+
+    def add(
+        self, document: Document, seq: int | None = None, number_of_events: int = 1
+    ):
+        if seq is not None:
+            self.seqs.append(seq)
+        if self.first_event_time is None:
+            # Pages have a column of times and datums have no time at all.
+            event_time = document.get("time", time.time())
+            self.first_event_time = (
+                event_time[0] if isinstance(event_time, list) else event_time
+            )
+        line = self.encoder.dumps(document)
+        self.lines.append(line)
+        self.number_of_events += number_of_events
+        self.number_of_bytes += len(line)
+
 
 class NomadCallback:
     def __init__(
-        self, nomad_api_url: str, nomad_api_token: str, zmq_url: str | None = None
+        self,
+        nomad_api_url: str,
+        nomad_api_token: str,
+        zmq_url: str | None = None,
+        batch_max_events: int = DEFAULT_BATCH_MAX_EVENTS,
+        batch_max_bytes: int = DEFAULT_BATCH_MAX_BYTES,
+        batch_max_seconds: float = DEFAULT_BATCH_MAX_SECONDS,
+        client: NomadClient | None = None,
+        workers: int = DEFAULT_WORKERS,
+        compression: CompressionPolicy | None = None,
+        max_queued_documents: int = DEFAULT_MAX_IN_MEMORY,
+        spill_path: Path | None = None,
+        max_spill_bytes: int = DEFAULT_MAX_SPILL_BYTES,
+        state_path: Path | None = None,
+        dead_letter_path: Path | None = None,
+        columnar: ColumnarSerializer | None = None,
+        aggregate: bool = False,
+        staging_path: Path | None = None,
+        checkpoint_bytes: int = DEFAULT_CHECKPOINT_BYTES,
+        run_timeout: float | None = DEFAULT_RUN_TIMEOUT,
+        upload_metadata: dict[str, Any] | None = None,
+        watch_uploads: bool = False,
+        on_upload_processed: UploadCallback | None = None,
+        on_upload_failed: UploadCallback | None = None,
+        on_run_uploaded: Callable[[str, str], None] | None = None,
     ):
         self.NOMAD_API_URL: str = nomad_api_url
         self.NOMAD_API_TOKEN: str = nomad_api_token
         self.ZMQ_URL: str | None = zmq_url
 
-        self._document_queue: queue.Queue[tuple[str, Document] | None] = queue.Queue()
+        # Pass in a `client` to share its connection pool with other users of the api.
+        self._client = client or NomadClient(nomad_api_url, nomad_api_token)
+
+        # Falls back to the policy of the client if `None`.
+        self._compression = compression
+
+        self._batch_max_events = batch_max_events
+        self._batch_max_bytes = batch_max_bytes
+        self._batch_max_seconds = batch_max_seconds
+
+        # If given, received documents and the runs in progress are persisted to
+        # `state_path` so that `serve` can resume from where a previous process stopped.
+        self._state = StateStore(state_path) if state_path else None
+
+        # Documents which still failed after retrying are written to `dead_letter_path`,
+        # or only logged if it isn't given.
+        self._dead_letters = (
+            DeadLetterStore(dead_letter_path) if dead_letter_path else None
+        )
+
+        # Documents received but not yet routed to a worker. Past `max_queued_documents`
+        # they're spilled to disk, so that an outage of NOMAD can't exhaust memory.
+        self._document_queue = SpillQueue(
+            max_queued_documents, spill_path=spill_path, max_spill_bytes=max_spill_bytes
+        )
+
+        # Documents are sharded onto a worker by the uid of their run start, so that
+        # runs are uploaded in parallel while the documents of a run stay in order.
+        self._worker_queues: list[
+            queue.Queue[tuple[str, Document, int | None] | None]
+        ] = [queue.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(workers)]
+        self._worker_threads: list[threading.Thread] = []
 
         # The uid of the run to the upload
         self._run_start_to_upload: dict[str, str] = {}
 
-        # The uid of the event descriptor to the uid of the run start.
-        # Seperate so that we know to remove from cache after run stop comes in.
-        self._descriptor_to_run_start: dict[str, str] = {}
+        # The uid of the run start of each event descriptor, resource and stream
+        # resource, so that events and datums can be routed to the upload of their run.
+        # Runs which have no documents for `run_timeout` seconds are assumed to have lost
+        # their stop, and are finished without it.
+        self._runs = RunIndex()
+        self._run_timeout = run_timeout
+
+        # The uid of the run start to the external files its resources refer to,
+        # attached to the upload when the run stops.
+        self._run_files: dict[str, dict[Path, None]] = {}
+
+        # If given, the events of each descriptor are accumulated into columns for the
+        # whole run and written as a single file per stream when it stops, instead of
+        # being batched into json lines.
+        self._columnar = columnar
+        self._columns: dict[str, _StreamColumns] = {}
+
+        # If `aggregate`, instead of a file per document the documents of each run are
+        # staged in `staging_path` (a temporary directory if `None`) and uploaded as a
+        # single archive when it stops, or in checkpoints of `checkpoint_bytes` for long runs.
+        # NOMAD reprocesses an upload after every file added to it, and there's no way to
+        # add one without, so this is also how it's processed once per run rather than
+        # once per document.
+        self._aggregate = aggregate
+        self._staging_path = staging_path
+        self._checkpoint_bytes = checkpoint_bytes
+        self._archives: dict[str, RunArchive] = {}
+
+        self._upload_metadata = upload_metadata
+
+        # If `watch_uploads`, the uploads of the runs in progress are polled together by
+        # a single watcher, which calls `on_upload_processed` once an upload has been
+        # processed after its run stopped, or `on_upload_failed` if its processing failed.
+        # `upload_metadata` is applied to the upload once it's processed, off the workers.
+        self._upload_watcher = (
+            UploadWatcher(self._client, on_upload_processed, on_upload_failed)
+            if watch_uploads
+            or upload_metadata
+            or on_upload_processed
+            or on_upload_failed
+            else None
+        )
+        if self._upload_watcher:
+            self._upload_watcher.start()
+
+        # Called from the workers with the uid of the run start and the ID of the upload
+        # once NOMAD has accepted the stop of a run, or the archive it's in.
+        self.on_run_uploaded = on_run_uploaded
+
+        # The name of the documents and the uid of the descriptor or resource they
+        # belong to, to those of them which haven't been uploaded yet.
+        self._event_batches: dict[tuple[str, str], _EventBatch] = {}
 
         self._serve_thread: threading.Thread | None = None
 
+        _callbacks.add(self)
+
+    def queue_metrics(self) -> dict[str, float]:
+        """Depth of the document queue, how much of it is spilled to disk and the rate it's drained at."""
+
+        return self._document_queue.metrics()
+
     def __call__(self, name: str, document: Document):
         if self._serve_thread is None:
             # If there is no serve thread then put the document manually.
+            self._run_start_of(name, document)
             self.send_document(name, document)
         else:
-            self._document_queue.put((name, document))
+            self._receive(name, document)
+
+    def _receive(self, name: str, document: Document):
+        seq = self._state.journal(name, document) if self._state else None
+        self._document_queue.put((name, document, seq))
+
+    def _acknowledge(self, seqs: list[int]):
+        if self._state and seqs:
+            self._state.acknowledge(seqs)
+
+    def _dead_letter(self, name: str, document: Document, exception: Exception):
+        metrics.FAILED_DOCUMENTS.inc(1, (name,))
+        logger.error(
+            f"Failed to upload `{name}` document `{document.get('uid')}`: {exception!r}"
+        )
+        if self._dead_letters:
+            self._dead_letters.add(name, document, exception)
 
     def _listen_over_zmq(self, zmq_url: str):
         dispatcher = RemoteDispatcher(zmq_url)
-        dispatcher.subscribe(
-            lambda name, document: self._document_queue.put((name, document))
-        )
+        dispatcher.subscribe(self._receive)
         dispatcher.start()
 
+    def _resume(self):
+        """Pick up the runs in progress and the documents not yet uploaded by a previous process."""
+
+        assert self._state
+        self._run_start_to_upload.update(self._state.runs())
+        for run_start in self._run_start_to_upload:
+            self._runs.add_run(run_start)
+        for descriptor, run_start in self._state.descriptors().items():
+            self._runs.add_descriptor(descriptor, run_start)
+        for resource, run_start in self._state.resources().items():
+            self._runs.add_resource(resource, run_start)
+        for run_start, paths in self._state.run_files().items():
+            self._run_files[run_start] = dict.fromkeys(paths)
+
+        pending = self._state.pending()
+        for seq, name, document in pending:
+            self._document_queue.put((name, document, seq))
+        if pending or self._run_start_to_upload:
+            logger.info(
+                f"Resuming {len(self._run_start_to_upload)} runs with {len(pending)} "
+                f"documents left to upload from `{self._state.path}`."
+            )
+
+    def _run_start_of(self, name: str, document: Document) -> str | None:
+        """The uid of the run start which `document` belongs to, if it's known."""
+
+        run_start: str | None
+        match name:
+            case "start":
+                run_start = typing.cast(RunStart, document)["uid"]
+                self._runs.add_run(run_start)
+            case "stop":
+                run_start = typing.cast(RunStop, document)["run_start"]
+            case "descriptor":
+                descriptor = typing.cast(EventDescriptor, document)
+                # Recorded here rather than in the worker, events from this descriptor
+                # may be routed before the worker has uploaded it.
+                run_start = descriptor["run_start"]
+                self._runs.add_descriptor(descriptor["uid"], run_start)
+            case "event" | "event_page":
+                run_start = self._runs.descriptors.get(
+                    typing.cast(Event | EventPage, document)["descriptor"]
+                )
+            case "resource" | "stream_resource":
+                resource = typing.cast(Resource | StreamResource, document)
+                run_start = resource.get("run_start")
+                if run_start is not None:
+                    self._runs.add_resource(resource["uid"], run_start)
+            case "datum" | "datum_page":
+                run_start = self._runs.resources.get(
+                    typing.cast(Datum | DatumPage, document)["resource"]
+                )
+            case "stream_datum":
+                run_start = self._runs.descriptors.get(
+                    typing.cast(StreamDatum, document)["descriptor"]
+                )
+            case _:
+                return None
+        if run_start is not None:
+            self._runs.touch(run_start)
+        return run_start
+
+    def _shard(self, run_start: str | None) -> int:
+        if run_start is None:
+            return 0
+        return zlib.crc32(run_start.encode()) % len(self._worker_queues)
+
     def _serve(self):
         while True:
             popped = self._document_queue.get()
             if popped is None:  # None is used as the kill signal
+                for worker_queue in self._worker_queues:
+                    worker_queue.put(None)
                 break
-            name, document = popped
-            self.send_document(name, document)
+            name, document, _ = popped
+            self._worker_queues[self._shard(self._run_start_of(name, document))].put(
+                popped
+            )
+
+    def _work(self, shard: int):
+        worker_queue = self._worker_queues[shard]
+        next_timeout_check = time.monotonic() + RUN_TIMEOUT_CHECK_PERIOD
+        while True:
+            if time.monotonic() >= next_timeout_check:
+                self.finish_expired_runs(shard=shard)
+                next_timeout_check = time.monotonic() + RUN_TIMEOUT_CHECK_PERIOD
+            try:
+                # Wake up periodically so that batches of a stalled run are still written.
+                popped = worker_queue.get(timeout=self._batch_max_seconds)
+            except queue.Empty:
+                self.flush_expired_event_batches(shard=shard)
+                continue
+            if popped is None:  # None is used as the kill signal
+                self.flush_event_batches(shard=shard)
+                break
+            name, document, seq = popped
+            try:
+                self.send_document(name, document, seq)
+            except Exception as exception:
+                # Keep the worker alive for the other documents.
+                self._dead_letter(name, document, exception)
+                if seq is not None:
+                    self._acknowledge([seq])
 
     def serve(self):
-        """Starts `_serve` in a different thread and if provided will listen on `zmq_url` for new documents to send."""
+        """Starts `_serve` and the upload workers in different threads and if provided will listen on `zmq_url` for new documents to send."""
+
+        if self._state:
+            self._resume()
+
+        self._worker_threads = [
+            threading.Thread(
+                target=self._work,
+                args=(shard,),
+                name=f"nomad-worker-{shard}",
+                daemon=True,
+            )
+            for shard in range(len(self._worker_queues))
+        ]
+        for worker_thread in self._worker_threads:
+            worker_thread.start()
 
         self._serve_thread = threading.Thread(target=self._serve, daemon=True)
         self._serve_thread.start()
@@ -89,16 +437,34 @@ class NomadCallback:
     def join(self):
         """If using directly subscribed to the `RunEngine` instead of as a service, then it may finish while the queue has elements.
 
-        We use a kill signal and a join to keep the thread alive until it's finished processing all documents.
+        We use a kill signal and a join to keep the threads alive until they've finished processing all documents.
         """
         if self._serve_thread:
             self._document_queue.put(None)
             self._serve_thread.join()
+            for worker_thread in self._worker_threads:
+                worker_thread.join()
+        else:
+            self.flush_event_batches()
+
+        if self._upload_watcher:
+            self._upload_watcher.join()
+
+        if self._state:
+            self._state.close()
+
+    def send_document(self, name: str, document: Document, seq: int | None = None):
+        """Upload `document`, `seq` is its sequence number in the state journal, if there is one."""
 
-    def send_document(self, name: str, document: Document):
         # TODO: convert the document from dictionary to subclasses of event-model basemodels containing
         # our experiment metadata. Then we'd match here by those classes.
 
+        metrics.DOCUMENTS.inc(1, (name,))
+        if self._aggregate:
+            # Acknowledged when the part of the archive it's in is uploaded.
+            self.stage_document(name, document, seq)
+            return
+
         match name:
             case "start":
                 self.upload_run_start(typing.cast(RunStart, document))
@@ -106,77 +472,605 @@ class NomadCallback:
                 self.upload_run_stop(typing.cast(RunStop, document))
             case "descriptor":
                 self.upload_descriptor(typing.cast(EventDescriptor, document))
+            case "resource":
+                self.upload_resource(typing.cast(Resource, document))
+            case "stream_resource":
+                self.upload_stream_resource(typing.cast(StreamResource, document))
+            # The high-rate documents are acknowledged when their batch is uploaded.
             case "event":
-                self.upload_event(typing.cast(Event, document))
+                self.upload_event(typing.cast(Event, document), seq)
+                return
+            case "event_page":
+                self.upload_event_page(typing.cast(EventPage, document), seq)
+                return
+            case "datum":
+                self.upload_datum(typing.cast(Datum, document), seq)
+                return
+            case "datum_page":
+                self.upload_datum_page(typing.cast(DatumPage, document), seq)
+                return
+            case "stream_datum":
+                self.upload_stream_datum(typing.cast(StreamDatum, document), seq)
+                return
             case _:
                 raise RuntimeError(
                     f"Receieved unsupported document `{name}`. Other documents are in progress."
                 )
 
+        if seq is not None:
+            self._acknowledge([seq])
+
+    def _create_upload(self, document: RunStart) -> str:
+        """The ID of the upload for the run, created unless it was before a restart."""
+
+        upload_id = self._run_start_to_upload.get(document["uid"])
+        if upload_id is None:
+            upload_name = f"run_{document['time']}"
+            upload_id = self._client.create_upload(upload_name)["upload_id"]
+            logger.info(
+                f"Created upload with name `{upload_name}` and ID `{upload_id}`"
+            )
+            self._run_start_to_upload[document["uid"]] = upload_id
+            if self._state:
+                self._state.add_run(document["uid"], upload_id)
+        else:
+            # The upload was created before a restart, but the start document wasn't added.
+            logger.info(f"Resuming upload with ID `{upload_id}`")
+        if self._upload_watcher:
+            self._upload_watcher.watch(
+                upload_id,
+                on_processed=self._add_upload_metadata
+                if self._upload_metadata
+                else None,
+            )
+        return upload_id
+
     def upload_run_start(self, document: RunStart):
-        upload_name = f"run_{document['time']}"
-        upload_id = create_upload(
-            upload_name, self.NOMAD_API_URL, self.NOMAD_API_TOKEN
-        )["upload_id"]
-        logger.info(f"Created upload with name `{upload_name}` and ID `{upload_id}`")
-        self._run_start_to_upload[document["uid"]] = upload_id
-
-        add_dictionary_to_upload(
+        upload_id = self._create_upload(document)
+
+        self._client.add_dictionary_to_upload(
             f"{document['time']}_start",
             typing.cast(dict, document),
             upload_id,
-            self.NOMAD_API_URL,
-            self.NOMAD_API_TOKEN,
+            compression=self._compression,
         )
         logger.info(
             f"Added `start` document `{document['uid']}` to upload `{upload_id}`."
         )
 
+    def _finish_run(self, run_start: str) -> str:
+        """Upload everything left of the run and forget it, returns the ID of its upload."""
+
+        self.flush_event_batches(run_start=run_start)
+
+        upload_id = self._run_start_to_upload.pop(run_start)
+        self._forget_run(run_start)
+
+        if self._columnar:
+            self._write_columns(run_start, upload_id)
+
+        # Attached before the stop document, so the run is complete once it's there.
+        for path in self._run_files.pop(run_start, {}):
+            self._attach_file(path, upload_id)
+        return upload_id
+
     def upload_run_stop(self, document: RunStop):
-        upload_id = self._run_start_to_upload.pop(document["run_start"])
-        for descriptor_uid in [
-            d for d, s in self._descriptor_to_run_start.items() if s == upload_id
-        ]:
-            del self._descriptor_to_run_start[descriptor_uid]
+        upload_id = self._finish_run(document["run_start"])
 
-        add_dictionary_to_upload(
+        self._client.add_dictionary_to_upload(
             f"{document['time']}_stop",
             typing.cast(dict, document),
             upload_id,
-            self.NOMAD_API_URL,
-            self.NOMAD_API_TOKEN,
+            compression=self._compression,
         )
         logger.debug(
-            f"Added `stop` document `{document['uid']}` to upload `{upload_id}`."
+            "Added `stop` document `%s` to upload `%s`.", document["uid"], upload_id
         )
+        if self._upload_watcher:
+            self._upload_watcher.stopped(upload_id)
+        if self.on_run_uploaded:
+            self.on_run_uploaded(document["run_start"], upload_id)
+
+    def _forget_run(self, run_start: str):
+        """Remove the descriptors and resources of a stopped run from the caches."""
+
+        self._runs.forget(run_start)
+        if self._state:
+            self._state.remove_run(run_start)
 
     def upload_descriptor(self, document: EventDescriptor):
-        self._descriptor_to_run_start[document["uid"]] = document["run_start"]
+        self._runs.add_descriptor(document["uid"], document["run_start"])
+        if self._state:
+            self._state.add_descriptor(document["uid"], document["run_start"])
         upload_id = self._run_start_to_upload[document["run_start"]]
 
-        add_dictionary_to_upload(
+        self._client.add_dictionary_to_upload(
             f"{document['time']}_descriptor",
             typing.cast(dict, document),
             upload_id,
-            self.NOMAD_API_URL,
-            self.NOMAD_API_TOKEN,
+            compression=self._compression,
         )
+        if self._columnar:
+            self._columns[document["uid"]] = _StreamColumns(
+                document["uid"],
+                document.get("name", document["uid"]),
+                document["run_start"],
+                document.get("data_keys", {}),
+            )
         logger.debug(
-            f"Added `event` document `{document['uid']}` to upload `{upload_id}`."
+            "Added `descriptor` document `%s` to upload `%s`.",
+            document["uid"],
+            upload_id,
         )
 
-    def upload_event(self, document: Event):
-        upload_id = self._run_start_to_upload[
-            self._descriptor_to_run_start[document["descriptor"]]
+    def _add_to_batch(
+        self,
+        name: str,
+        uid: str,
+        run_start: str,
+        document: Document,
+        seq: int | None = None,
+        number_of_events: int = 1,
+    ):
+        """Add `document` to the batch of `name` documents from the descriptor or resource `uid`."""
+
+        key = (name, uid)
+        batch = self._event_batches.get(key)
+        if batch is None:
+            batch = _EventBatch(
+                run_start,
+                self._run_start_to_upload[run_start],
+                name,
+                self._client.encoder,
+            )
+            self._event_batches[key] = batch
+
+        batch.add(document, seq, number_of_events)
+
+        if (
+            batch.number_of_events >= self._batch_max_events
+            or batch.number_of_bytes >= self._batch_max_bytes
+            or time.monotonic() - batch.created >= self._batch_max_seconds
+        ):
+            self._flush_event_batch(key)
+
+    def _columns_of(self, descriptor_uid: str) -> _StreamColumns:
+        columns = self._columns.get(descriptor_uid)
+        if columns is None:
+            # The descriptor was uploaded before a restart, so its stream name isn't known.
+            columns = _StreamColumns(
+                descriptor_uid,
+                descriptor_uid,
+                self._runs.descriptors[descriptor_uid],
+            )
+            self._columns[descriptor_uid] = columns
+        return columns
+
+    def _write_columns(self, run_start: str, upload_id: str):
+        """Upload a columnar file for each stream of the run, and an index of them."""
+
+        assert self._columnar
+        streams = [
+            self._columns.pop(descriptor_uid)
+            for descriptor_uid, columns in list(self._columns.items())
+            if columns.run_start == run_start
         ]
+        index = []
+        with tempfile.TemporaryDirectory() as directory:
+            for stream in streams:
+                if not len(stream):
+                    continue
+                path = (
+                    Path(directory)
+                    / f"{stream.stream_name}_{stream.descriptor_uid}.{self._columnar.extension}"
+                )
+                try:
+                    entry = self._columnar.write(stream, path)
+                    self._client.add_file_to_upload(
+                        path.name, path, upload_id, compression=self._compression
+                    )
+                except Exception as exception:
+                    self._dead_letter("event_page", stream.as_event_page(), exception)
+                else:
+                    index.append(entry)
+                    logger.debug(
+                        "Added %d events of stream `%s` as `%s` to upload `%s`.",
+                        len(stream),
+                        stream.stream_name,
+                        path.name,
+                        upload_id,
+                    )
+                finally:
+                    self._acknowledge(stream.seqs)
+
+        if index:
+            self._client.add_dictionary_to_upload(
+                "columnar_index",
+                {"streams": index},
+                upload_id,
+                compression=self._compression,
+            )
 
-        add_dictionary_to_upload(
-            f"{document['time']}_event",
+    def upload_event(self, document: Event, seq: int | None = None):
+        descriptor_uid = document["descriptor"]
+        if self._columnar:
+            self._columns_of(descriptor_uid).add_event(document, seq)
+            return
+        self._add_to_batch(
+            "event",
+            descriptor_uid,
+            self._runs.descriptors[descriptor_uid],
+            document,
+            seq,
+        )
+        logger.debug("Batched `event` document `%s`.", document["uid"])
+
+    def upload_event_page(self, document: EventPage, seq: int | None = None):
+        descriptor_uid = document["descriptor"]
+        if self._columnar:
+            self._columns_of(descriptor_uid).add_event_page(document, seq)
+            return
+        self._add_to_batch(
+            "event_page",
+            descriptor_uid,
+            self._runs.descriptors[descriptor_uid],
+            document,
+            seq,
+            len(document["seq_num"]),
+        )
+        logger.debug(
+            "Batched `event_page` document of %d events from descriptor `%s`.",
+            len(document["seq_num"]),
+            descriptor_uid,
+        )
+
+    def _record_file(self, run_start: str, name: str, document: Document):
+        """Record the external file referenced by a `resource` or `stream_resource`."""
+
+        if name == "resource":
+            resource = typing.cast(Resource, document)
+            path = Path(resource.get("root", "")) / resource["resource_path"]
+        else:
+            uri = urllib.parse.urlparse(typing.cast(StreamResource, document)["uri"])
+            if uri.scheme not in ("", "file"):
+                return
+            path = Path(urllib.parse.unquote(uri.path))
+        self._run_files.setdefault(run_start, {})[path] = None
+        if self._state:
+            self._state.add_run_file(run_start, path)
+
+    @staticmethod
+    def _files_at(path: Path) -> list[Path]:
+        """The file at `path`, or every file in the directory at `path`."""
+
+        if path.is_dir():
+            return sorted(p for p in path.rglob("*") if p.is_file())
+        if path.is_file():
+            return [path]
+        logger.warning(f"External file `{path}` isn't accessible, not uploading it.")
+        return []
+
+    def _attach_file(self, path: Path, upload_id: str):
+        """Add the external file, or every file in the directory, at `path` to the upload."""
+
+        if path.is_dir():
+            # e.g. a frame per file, packed into a few large zips rather than a request each.
+            files = [
+                (file_path, str(file_path.relative_to(path)))
+                for file_path in self._files_at(path)
+            ]
+            try:
+                self._client.add_files_to_upload(
+                    path.name, files, upload_id, compression=self._compression
+                )
+            except Exception as exception:
+                logger.error(
+                    f"Failed to add external directory `{path}` to upload `{upload_id}`: {exception!r}"
+                )
+                return
+            logger.debug(
+                "Added %d files of external directory `%s` to upload `%s`.",
+                len(files),
+                path,
+                upload_id,
+            )
+            return
+
+        for file_path in self._files_at(path):
+            try:
+                self._client.add_file_to_upload(
+                    file_path.name, file_path, upload_id, compression=self._compression
+                )
+            except Exception as exception:
+                logger.error(
+                    f"Failed to add external file `{file_path}` to upload `{upload_id}`: {exception!r}"
+                )
+                continue
+            logger.debug(
+                "Added external file `%s` to upload `%s`.", file_path, upload_id
+            )
+
+    def upload_resource(self, document: Resource):
+        if "run_start" not in document:
+            raise RuntimeError(
+                f"Resource `{document['uid']}` has no `run_start`, so can't be added to an upload."
+            )
+        run_start = document["run_start"]
+        self._runs.add_resource(document["uid"], run_start)
+        if self._state:
+            self._state.add_resource(document["uid"], run_start)
+        upload_id = self._run_start_to_upload[run_start]
+
+        self._client.add_dictionary_to_upload(
+            f"resource_{document['uid']}",
             typing.cast(dict, document),
             upload_id,
-            self.NOMAD_API_URL,
-            self.NOMAD_API_TOKEN,
+            compression=self._compression,
         )
+        self._record_file(run_start, "resource", document)
         logger.debug(
-            f"Added `event` document `{document['uid']}` to upload `{upload_id}`."
+            "Added `resource` document `%s` to upload `%s`.", document["uid"], upload_id
         )
+
+    def upload_stream_resource(self, document: StreamResource):
+        if "run_start" not in document:
+            raise RuntimeError(
+                f"Stream resource `{document['uid']}` has no `run_start`, so can't be added to an upload."
+            )
+        run_start = document["run_start"]
+        self._runs.add_resource(document["uid"], run_start)
+        if self._state:
+            self._state.add_resource(document["uid"], run_start)
+        upload_id = self._run_start_to_upload[run_start]
+
+        self._client.add_dictionary_to_upload(
+            f"stream_resource_{document['uid']}",
+            typing.cast(dict, document),
+            upload_id,
+            compression=self._compression,
+        )
+        self._record_file(run_start, "stream_resource", document)
+        logger.debug(
+            "Added `stream_resource` document `%s` to upload `%s`.",
+            document["uid"],
+            upload_id,
+        )
+
+    def upload_datum(self, document: Datum, seq: int | None = None):
+        self._add_to_batch(
+            "datum",
+            document["resource"],
+            self._runs.resources[document["resource"]],
+            document,
+            seq,
+        )
+
+    def upload_datum_page(self, document: DatumPage, seq: int | None = None):
+        self._add_to_batch(
+            "datum_page",
+            document["resource"],
+            self._runs.resources[document["resource"]],
+            document,
+            seq,
+            len(document["datum_id"]),
+        )
+
+    def upload_stream_datum(self, document: StreamDatum, seq: int | None = None):
+        self._add_to_batch(
+            "stream_datum",
+            document["stream_resource"],
+            self._runs.descriptors[document["descriptor"]],
+            document,
+            seq,
+        )
+
+    def stage_document(self, name: str, document: Document, seq: int | None = None):
+        """Add `document` to the archive of its run, uploading the archive at stop or once it's large enough."""
+
+        run_start = self._run_start_of(name, document)
+        if run_start is None:
+            raise RuntimeError(
+                f"Couldn't find the run of `{name}` document `{document.get('uid')}`."
+            )
+        if name == "start":
+            upload_id = self._create_upload(typing.cast(RunStart, document))
+        else:
+            upload_id = self._run_start_to_upload[run_start]
+
+        if name == "descriptor" and self._state:
+            self._state.add_descriptor(
+                typing.cast(EventDescriptor, document)["uid"], run_start
+            )
+        elif name in ("resource", "stream_resource"):
+            if self._state:
+                self._state.add_resource(
+                    typing.cast(Resource | StreamResource, document)["uid"], run_start
+                )
+            self._record_file(run_start, name, document)
+
+        archive = self._archives.get(run_start)
+        if archive is None:
+            # The parts uploaded before a restart stay in the manifest.
+            archive = RunArchive(
+                run_start,
+                upload_id,
+                self._staging_path,
+                self._client.encoder,
+                self._state.archive_parts(run_start) if self._state else None,
+            )
+            self._archives[run_start] = archive
+        archive.add(name, document, seq)
+
+        if name == "stop":
+            self._upload_archive(archive, complete=True)
+        elif archive.number_of_bytes >= self._checkpoint_bytes:
+            self._upload_archive(archive)
+
+    def _upload_archive(self, archive: RunArchive, complete: bool = False) -> bool:
+        """Upload the current part of the archive, returns whether NOMAD accepted it."""
+
+        files = archive.checkpoint(complete)
+        if complete:
+            for path in self._run_files.pop(archive.run_start, {}):
+                files += [
+                    (file_path, f"files/{file_path.relative_to(path.parent)}")
+                    for file_path in self._files_at(path)
+                ]
+
+        try:
+            self._client.add_archive_to_upload(
+                "run", files, archive.upload_id, compression=self._compression
+            )
+        except Exception as exception:
+            if not complete:
+                # Carry on staging, the part is tried again with the next checkpoint.
+                archive.retry_part()
+                logger.error(
+                    f"Failed to upload a checkpoint of run `{archive.run_start}`: {exception!r}"
+                )
+                return False
+            logger.error(
+                f"Failed to upload the archive of run `{archive.run_start}`, its documents "
+                + (
+                    "are uploaded again from the state journal after a restart"
+                    if self._state
+                    else f"are left in `{archive.directory}`"
+                )
+                + f": {exception!r}"
+            )
+            if self._upload_watcher:
+                self._upload_watcher.unwatch(archive.upload_id)
+            uploaded = False
+        else:
+            uploaded = True
+            self._acknowledge(archive.seqs)
+            logger.info(
+                f"Added {'archive' if complete else 'checkpoint'} of run `{archive.run_start}` "
+                f"with {archive.number_of_bytes} bytes of documents to upload `{archive.upload_id}`."
+            )
+            if complete:
+                archive.close()
+                if self._upload_watcher:
+                    self._upload_watcher.stopped(archive.upload_id)
+                if self.on_run_uploaded:
+                    self.on_run_uploaded(archive.run_start, archive.upload_id)
+            else:
+                archive.next_part()
+                if self._state:
+                    self._state.set_archive_parts(archive.run_start, archive.parts)
+
+        if complete:
+            del self._archives[archive.run_start]
+            self._run_start_to_upload.pop(archive.run_start)
+            if uploaded or not self._state:
+                self._forget_run(archive.run_start)
+            else:
+                # Its upload, descriptors, resources and parts stay in the state store
+                # with its unacknowledged documents, so on restart they're staged into
+                # a new archive after the parts already uploaded and sent again.
+                self._runs.forget(archive.run_start)
+        return uploaded
+
+    def _add_upload_metadata(self, upload_id: str, upload: dict[str, Any] | None):
+        """Apply `upload_metadata` to an upload once NOMAD has processed it."""
+
+        try:
+            self._client.add_upload_metadata(upload_id, self._upload_metadata)
+        except Exception as exception:
+            logger.error(
+                f"Failed to add metadata to upload `{upload_id}`: {exception!r}"
+            )
+
+    def _flush_event_batch(self, key: tuple[str, str]):
+        batch = self._event_batches.pop(key)
+        name, uid = key
+
+        try:
+            self._client.add_json_lines_to_upload(
+                f"{batch.first_event_time}_{name}s_{uid}",
+                batch.lines,
+                batch.upload_id,
+                compression=self._compression,
+            )
+        except Exception as exception:
+            for line in batch.lines:
+                self._dead_letter(name, json.loads(line), exception)
+            return
+        finally:
+            self._acknowledge(batch.seqs)
+        logger.debug(
+            "Added %d `%s` documents from `%s` to upload `%s`.",
+            len(batch.lines),
+            name,
+            uid,
+            batch.upload_id,
+            extra={"upload_id": batch.upload_id, "documents": len(batch.lines)},
+        )
+
+    def flush_event_batches(
+        self, run_start: str | None = None, shard: int | None = None
+    ):
+        """Upload all batched events, or only those belonging to `run_start` or the worker `shard` if given."""
+
+        for key, batch in list(self._event_batches.items()):
+            if (run_start is None or batch.run_start == run_start) and (
+                shard is None or self._shard(batch.run_start) == shard
+            ):
+                self._flush_event_batch(key)
+
+    def flush_expired_event_batches(self, shard: int | None = None):
+        """Upload the batches which have been waiting longer than `batch_max_seconds`."""
+
+        now = time.monotonic()
+        for key, batch in list(self._event_batches.items()):
+            if now - batch.created >= self._batch_max_seconds and (
+                shard is None or self._shard(batch.run_start) == shard
+            ):
+                self._flush_event_batch(key)
+
+    def finish_expired_runs(self, shard: int | None = None):
+        """Finish the runs which have had no documents for `run_timeout` seconds, as their stop was lost.
+
+        Everything received of the run is uploaded, but without a stop document.
+        """
+
+        if self._run_timeout is None:
+            return
+        for run_start in self._runs.expired(self._run_timeout):
+            if shard is not None and self._shard(run_start) != shard:
+                continue
+            metrics.EXPIRED_RUNS.inc()
+            upload_id = self._run_start_to_upload.get(run_start)
+            logger.warning(
+                "Run `%s` has had no documents for %g seconds, finishing upload `%s` without its stop.",
+                run_start,
+                self._run_timeout,
+                upload_id,
+            )
+            if upload_id is None:
+                # Its start was never uploaded.
+                self._forget_run(run_start)
+                continue
+            try:
+                archive = self._archives.pop(run_start, None)
+                if archive is not None:
+                    uploaded = self._upload_archive(archive)
+                    archive.close()
+                else:
+                    self._finish_run(run_start)
+                    uploaded = True
+                if self._upload_watcher:
+                    if uploaded:
+                        self._upload_watcher.stopped(upload_id)
+                    else:
+                        self._upload_watcher.unwatch(upload_id)
+            except Exception as exception:
+                logger.error(
+                    f"Failed to finish run `{run_start}` which timed out: {exception!r}"
+                )
+                if self._upload_watcher:
+                    self._upload_watcher.unwatch(upload_id)
+            # Forgotten even if it failed, so that it isn't tried again at every check.
+            self._run_start_to_upload.pop(run_start, None)
+            self._run_files.pop(run_start, None)
+            self._forget_run(run_start)
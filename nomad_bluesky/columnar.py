@@ -0,0 +1,211 @@
+from collections.abc import Iterable, Mapping
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from event_model.documents import Event, EventPage
+
+from .json_encoder import DEFAULT_ENCODER
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ("auto", "parquet", "npz")
+
+
+def _extend(
+    columns: dict[str, list[Any]],
+    values: Mapping[str, list[Any]],
+    rows_before: int,
+    rows: int,
+):
+    """Add `rows` rows of `values` to `columns`, as `None` for the fields they're missing."""
+
+    for key, column_values in values.items():
+        column = columns.get(key)
+        if column is None:
+            column = columns[key] = [None] * rows_before
+        column.extend(column_values)
+    for key, column in columns.items():
+        if key not in values:
+            column.extend([None] * rows)
+
+
+class _StreamColumns:
+    """The events of a single descriptor, accumulated into a column per field.
+
+    Every field of `data_keys`, or of any event, has a value for every event, `None`
+    for the events which don't have the field.
+    """
+
+    def __init__(
+        self,
+        descriptor_uid: str,
+        stream_name: str,
+        run_start: str,
+        data_keys: Iterable[str] = (),
+    ):
+        self.descriptor_uid = descriptor_uid
+        self.stream_name = stream_name
+        self.run_start = run_start
+        self.uid: list[str] = []
+        self.seq_num: list[int] = []
+        self.time: list[float] = []
+        self.data: dict[str, list[Any]] = {key: [] for key in data_keys}
+        self.timestamps: dict[str, list[float]] = {key: [] for key in data_keys}
+        # Journal sequence numbers of the events, acknowledged once the file is uploaded.
+        self.seqs: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self.seq_num)
+
+    def add_event(self, document: Event, seq: int | None = None):
+        if seq is not None:
+            self.seqs.append(seq)
+        rows_before = len(self)
+        self.uid.append(document["uid"])
+        self.seq_num.append(document["seq_num"])
+        self.time.append(document["time"])
+        _extend(
+            self.data,
+            {key: [value] for key, value in document["data"].items()},
+            rows_before,
+            1,
+        )
+        _extend(
+            self.timestamps,
+            {key: [value] for key, value in document["timestamps"].items()},
+            rows_before,
+            1,
+        )
+
+    def add_event_page(self, document: EventPage, seq: int | None = None):
+        if seq is not None:
+            self.seqs.append(seq)
+        rows_before = len(self)
+        self.uid.extend(document["uid"])
+        self.seq_num.extend(document["seq_num"])
+        self.time.extend(document["time"])
+        rows = len(document["seq_num"])
+        _extend(self.data, document["data"], rows_before, rows)
+        _extend(self.timestamps, document["timestamps"], rows_before, rows)
+
+    def as_event_page(self) -> EventPage:
+        """The accumulated events as a single event page, for when they can't be written."""
+
+        return {
+            "descriptor": self.descriptor_uid,
+            "uid": self.uid,
+            "seq_num": self.seq_num,
+            "time": self.time,
+            "data": self.data,
+            "timestamps": self.timestamps,
+            "filled": {},
+        }
+
+    def columns(self) -> dict[str, list[Any]]:
+        return {
+            "uid": self.uid,
+            "seq_num": self.seq_num,
+            "time": self.time,
+            **{f"data/{key}": values for key, values in self.data.items()},
+            **{f"timestamps/{key}": values for key, values in self.timestamps.items()},
+        }
+
+
+class ColumnarSerializer:
+    """Writes the events of a stream as one columnar file instead of a json document per event.
+
+    Each field of the events' `data` and `timestamps` becomes a typed column, alongside
+    the `uid`, `seq_num` and `time` of every event. With `format="auto"` parquet is
+    used if pyarrow is installed, otherwise numpy's npz. Values which don't form a
+    regular array (e.g. ragged lists or dictionaries) are kept as a column of json strings.
+
+    Fields missing from some events are filled with zeros of the field's type, with a
+    boolean `missing/{column}` column marking those events. In parquet, missing values
+    of scalar columns are also null.
+    """
+
+    def __init__(self, format: str = "auto"):
+        if format not in FORMATS:
+            raise ValueError(
+                f"Unknown columnar format `{format}`, use one of {FORMATS}"
+            )
+        if format == "parquet" and pyarrow is None:
+            raise ValueError("parquet requires pyarrow to be installed")
+        if format == "auto":
+            format = "parquet" if pyarrow is not None else "npz"
+        self.format = format
+
+    @property
+    def extension(self) -> str:
+        return "parquet" if self.format == "parquet" else "npz"
+
+    @staticmethod
+    def _array(values: list[Any]) -> tuple[np.ndarray, str | None]:
+        """`values` as a numpy array and the encoding used if they had to be serialized."""
+
+        present = next((value for value in values if value is not None), None)
+        if present is not None and any(v is None for v in values):
+            fill = np.zeros_like(np.asarray(present))
+            values = [fill if value is None else value for value in values]
+        try:
+            array = np.asarray(values)
+        except ValueError:
+            array = None
+        if array is None or array.dtype == object:
+            return np.asarray(
+                [DEFAULT_ENCODER.dumps(value).decode() for value in values]
+            ), "json"
+        return array, None
+
+    def write(self, stream: _StreamColumns, path: Path) -> dict[str, Any]:
+        """Write `stream` to `path`, returns its entry in the index."""
+
+        arrays: dict[str, np.ndarray] = {}
+        masks: dict[str, np.ndarray] = {}
+        index_columns: dict[str, dict[str, Any]] = {}
+        for name, values in stream.columns().items():
+            array, encoding = self._array(values)
+            arrays[name] = array
+            index_columns[name] = {
+                "dtype": array.dtype.str,
+                "shape": list(array.shape[1:]),
+            }
+            if encoding:
+                index_columns[name]["encoding"] = encoding
+            missing = np.fromiter((value is None for value in values), bool)
+            if missing.any():
+                masks[name] = missing
+                index_columns[name]["missing"] = f"missing/{name}"
+        for name, missing in masks.items():
+            arrays[f"missing/{name}"] = missing
+
+        if self.format == "parquet":
+            assert pyarrow is not None
+            table = pyarrow.table(
+                {
+                    name: pyarrow.FixedShapeTensorArray.from_numpy_ndarray(
+                        np.ascontiguousarray(array)
+                    )
+                    if array.ndim > 1
+                    else pyarrow.array(array, mask=masks.get(name))
+                    for name, array in arrays.items()
+                }
+            )
+            pyarrow.parquet.write_table(table, path)
+        else:
+            with path.open("wb") as file:
+                np.savez(file, **arrays)
+
+        return {
+            "descriptor": stream.descriptor_uid,
+            "stream": stream.stream_name,
+            "file": path.name,
+            "format": self.format,
+            "rows": len(stream),
+            "columns": index_columns,
+        }
@@ -0,0 +1,107 @@
+import zipfile
+import zlib
+from pathlib import Path
+
+# Formats which are already compressed, zipping them again only costs CPU.
+COMPRESSED_EXTENSIONS = frozenset(
+    {
+        ".gz",
+        ".bz2",
+        ".xz",
+        ".zst",
+        ".zip",
+        ".png",
+        ".jpg",
+        ".jpeg",
+        ".parquet",
+    }
+)
+
+# Below this size the zip headers outweigh anything compression would save.
+DEFAULT_MIN_SIZE = 1024
+
+# Bytes compressed to estimate how well a payload will compress.
+DEFAULT_SAMPLE_SIZE = 64 * 1024
+
+# Payloads whose sample shrinks by less than this fraction are stored.
+DEFAULT_MIN_SAVING = 0.1
+
+METHODS = ("auto", "store", "deflate", "zstd")
+
+
+class CompressionPolicy:
+    """Chooses how each payload is compressed in the zips sent to NOMAD.
+
+    With `method="auto"` small payloads, files with a compressed extension and
+    payloads whose sample doesn't compress well (e.g. HDF5 written with a filter)
+    are stored, everything else is deflated at `level`. Any other method is used
+    for every payload.
+    """
+
+    def __init__(
+        self,
+        method: str = "auto",
+        level: int | None = None,
+        min_size: int = DEFAULT_MIN_SIZE,
+        sample_size: int = DEFAULT_SAMPLE_SIZE,
+        min_saving: float = DEFAULT_MIN_SAVING,
+    ):
+        if method not in METHODS:
+            raise ValueError(
+                f"Unknown compression method `{method}`, use one of {METHODS}"
+            )
+        if method == "zstd" and not hasattr(zipfile, "ZIP_ZSTANDARD"):
+            raise ValueError(
+                "zstd compression in zip files requires python 3.14 or later"
+            )
+
+        self.method = method
+        self.level = level
+        self.min_size = min_size
+        self.sample_size = sample_size
+        self.min_saving = min_saving
+
+    @property
+    def _compressed(self) -> tuple[int, int | None]:
+        if self.method == "zstd":
+            return getattr(zipfile, "ZIP_ZSTANDARD"), self.level
+        return zipfile.ZIP_DEFLATED, self.level
+
+    def _compresses_well(self, sample: bytes) -> bool:
+        return len(zlib.compress(sample, 1)) <= len(sample) * (1 - self.min_saving)
+
+    def for_bytes(self, data: bytes) -> tuple[int, int | None]:
+        """The zip `compress_type` and `compresslevel` to use for `data`."""
+
+        if self.method == "store":
+            return zipfile.ZIP_STORED, None
+        if self.method != "auto":
+            return self._compressed
+        if len(data) < self.min_size or not self._compresses_well(
+            data[: self.sample_size]
+        ):
+            return zipfile.ZIP_STORED, None
+        return self._compressed
+
+    def for_file(self, path: Path) -> tuple[int, int | None]:
+        """The zip `compress_type` and `compresslevel` to use for the file at `path`."""
+
+        if self.method == "store":
+            return zipfile.ZIP_STORED, None
+        if self.method != "auto":
+            return self._compressed
+        if path.suffix.lower() in COMPRESSED_EXTENSIONS:
+            return zipfile.ZIP_STORED, None
+
+        size = path.stat().st_size
+        if size < self.min_size:
+            return zipfile.ZIP_STORED, None
+
+        # Headers are often padding, so sample from the middle of the file as well.
+        with path.open("rb") as file:
+            sample = file.read(self.sample_size // 2)
+            file.seek(size // 2)
+            sample += file.read(self.sample_size // 2)
+        if not self._compresses_well(sample):
+            return zipfile.ZIP_STORED, None
+        return self._compressed
@@ -0,0 +1,38 @@
+import json
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+
+class DeadLetterStore:
+    """Documents which couldn't be uploaded, so they can be inspected and sent again later.
+
+    Each is appended to `path` as a line of json with the error which stopped it.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def add(self, name: str, document: Any, exception: BaseException):
+        record = {
+            "time": time.time(),
+            "error": repr(exception),
+            "name": name,
+            "document": document,
+        }
+        line = json.dumps(record, default=repr) + "\n"
+        with self._lock, self.path.open("a") as file:
+            file.write(line)
+
+    def documents(self) -> Iterator[tuple[str, Any]]:
+        """The `(name, document)` pairs in the store, in the order they failed."""
+
+        if not self.path.exists():
+            return
+        with self.path.open() as file:
+            for line in file:
+                record = json.loads(line)
+                yield record["name"], record["document"]
@@ -0,0 +1,141 @@
+import collections
+import pickle
+import queue
+import struct
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import IO, Any
+
+DEFAULT_MAX_IN_MEMORY = 10000
+DEFAULT_MAX_SPILL_BYTES = 1024**3
+
+# Each record in the journal is its length followed by the pickled item.
+_LENGTH = struct.Struct("<Q")
+
+# The drain rate is averaged over windows of at least this many seconds.
+_DRAIN_RATE_WINDOW = 1.0
+
+
+class SpillQueue:
+    """A FIFO queue which holds at most `max_in_memory` items in memory.
+
+    Once full, further items are appended to a journal at `spill_path` (an anonymous
+    temporary file if `None`) and read back in order as the queue drains. The
+    journal is truncated whenever it's emptied. When it reaches `max_spill_bytes`,
+    `put` blocks until the consumer catches up.
+    """
+
+    def __init__(
+        self,
+        max_in_memory: int = DEFAULT_MAX_IN_MEMORY,
+        spill_path: Path | None = None,
+        max_spill_bytes: int = DEFAULT_MAX_SPILL_BYTES,
+    ):
+        self.max_in_memory = max_in_memory
+        self.max_spill_bytes = max_spill_bytes
+
+        self._journal: IO[bytes] = (
+            spill_path.open("w+b") if spill_path else tempfile.TemporaryFile()
+        )
+        self._write_offset = 0
+        self._read_offset = 0
+        self._spilled = 0
+
+        self._memory: collections.deque[Any] = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        self._drained = 0
+        self._drained_since = time.monotonic()
+        self._drain_rate = 0.0
+
+    def put(self, item: Any):
+        with self._not_full:
+            # Once anything is spilled, later items have to be spilled behind it to stay in order.
+            if not self._spilled and len(self._memory) < self.max_in_memory:
+                self._memory.append(item)
+            else:
+                record = pickle.dumps(item)
+                while (
+                    self._spilled
+                    and self._write_offset + _LENGTH.size + len(record)
+                    > self.max_spill_bytes
+                ):
+                    self._not_full.wait()
+                if not self._spilled and len(self._memory) < self.max_in_memory:
+                    self._memory.append(item)
+                else:
+                    self._spill(record)
+            self._not_empty.notify()
+
+    def _spill(self, record: bytes):
+        self._journal.seek(self._write_offset)
+        self._journal.write(_LENGTH.pack(len(record)))
+        self._journal.write(record)
+        self._write_offset = self._journal.tell()
+        self._spilled += 1
+
+    def _unspill(self):
+        """Move as many spilled items into memory as there is room for."""
+
+        self._journal.flush()
+        self._journal.seek(self._read_offset)
+        while self._spilled and len(self._memory) < self.max_in_memory:
+            (length,) = _LENGTH.unpack(self._journal.read(_LENGTH.size))
+            self._memory.append(pickle.loads(self._journal.read(length)))
+            self._spilled -= 1
+        self._read_offset = self._journal.tell()
+
+        if not self._spilled:
+            self._journal.seek(0)
+            self._journal.truncate()
+            self._write_offset = self._read_offset = 0
+
+    def get(self, timeout: float | None = None) -> Any:
+        """Remove and return the next item, raises `queue.Empty` after `timeout` seconds."""
+
+        with self._not_empty:
+            if not self._not_empty.wait_for(
+                lambda: self._memory or self._spilled, timeout
+            ):
+                raise queue.Empty()
+            if not self._memory:
+                self._unspill()
+            item = self._memory.popleft()
+            if self._spilled and len(self._memory) < self.max_in_memory // 2:
+                self._unspill()
+            self._not_full.notify_all()
+
+            self._drained += 1
+            now = time.monotonic()
+            if now - self._drained_since >= _DRAIN_RATE_WINDOW:
+                self._drain_rate = self._drained / (now - self._drained_since)
+                self._drained = 0
+                self._drained_since = now
+            return item
+
+    def qsize(self) -> int:
+        with self._lock:
+            return len(self._memory) + self._spilled
+
+    def metrics(self) -> dict[str, float]:
+        """Queue depth in memory and on disk, the size of the journal and documents taken per second."""
+
+        with self._lock:
+            # Don't report a stale rate if nothing has been taken for a while.
+            elapsed = time.monotonic() - self._drained_since
+            return {
+                "depth": len(self._memory) + self._spilled,
+                "in_memory": len(self._memory),
+                "spilled": self._spilled,
+                "spill_bytes": self._write_offset - self._read_offset,
+                "drain_rate": self._drained / elapsed
+                if elapsed >= _DRAIN_RATE_WINDOW
+                else self._drain_rate,
+            }
+
+    def close(self):
+        self._journal.close()
@@ -0,0 +1,52 @@
+import json
+from typing import Any
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ("auto", "orjson", "json")
+
+
+def _default(obj: Any) -> Any:
+    """Serialize the numpy types the backend can't natively."""
+
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class JsonEncoder:
+    """Serializes documents to json bytes.
+
+    With `backend="auto"` orjson is used if it's installed, writing numpy arrays and
+    scalars directly from their buffers, otherwise the standard library is used and
+    numpy values are converted to python ones first.
+    """
+
+    def __init__(self, backend: str = "auto"):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown json backend `{backend}`, use one of {BACKENDS}")
+        if backend == "orjson" and orjson is None:
+            raise ValueError("the orjson backend requires orjson to be installed")
+        if backend == "auto":
+            backend = "orjson" if orjson is not None else "json"
+        self.backend = backend
+
+    def dumps(self, obj: Any) -> bytes:
+        if self.backend == "orjson":
+            assert orjson is not None
+            return orjson.dumps(
+                obj,
+                default=_default,
+                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+            )
+        return json.dumps(obj, default=_default).encode("utf-8")
+
+
+DEFAULT_ENCODER = JsonEncoder()
@@ -1,4 +1,9 @@
+import atexit
 import logging
+import logging.handlers
+import pprint
+import queue
+from typing import Any
 
 logger = logging.getLogger(__name__)
 formatter = logging.Formatter("%(asctime)s (%(levelname)s): %(message)s")
@@ -6,3 +11,70 @@ handler = logging.StreamHandler()
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.propagate = False
+
+# Attributes every `LogRecord` has, anything else on a record was given in `extra`.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class pretty:
+    """Pretty prints `obj` only if the message it's an argument of is emitted.
+
+    Use as a lazy argument, `logger.debug("response: %s", pretty(response_json))`.
+    """
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj: Any):
+        self.obj = obj
+
+    def __str__(self) -> str:
+        return pprint.pformat(self.obj)
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Formats records as `key=value` pairs, including the fields given with `extra`.
+
+    e.g. `logger.debug("Batched event", extra={"upload_id": upload_id})`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields: dict[str, Any] = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        fields.update(
+            (key, value)
+            for key, value in vars(record).items()
+            if key not in _RECORD_ATTRIBUTES
+        )
+        line = " ".join(f"{key}={_quote(value)}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def _quote(value: Any) -> str:
+    text = str(value)
+    if not text or any(c in text for c in ' "='):
+        return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return text
+
+
+def use_key_value_format():
+    handler.setFormatter(KeyValueFormatter())
+
+
+def use_queue_handler() -> logging.handlers.QueueListener:
+    """Hand records to a thread which writes them, so that logging never blocks on I/O.
+
+    The listener is stopped, flushing the remaining records, when the interpreter exits.
+    """
+
+    records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
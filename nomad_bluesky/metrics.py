@@ -0,0 +1,248 @@
+import bisect
+import http.server
+import math
+import threading
+from collections.abc import Callable, Iterator
+
+# Seconds, covering small document PUTs up to large streamed files.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = tuple[str, ...]
+
+
+def _format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Labels = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *self._samples(),
+        ]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Labels = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, labels: Labels = ()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: Labels = ()) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge(_Metric):
+    """A value set as it changes, or read from a function when the metrics are collected."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Labels = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[Labels, float] = {}
+        self._functions: dict[Labels, Callable[[], float]] = {}
+
+    def set(self, value: float, labels: Labels = ()):
+        with self._lock:
+            self._values[labels] = value
+
+    def set_function(self, function: Callable[[], float], labels: Labels = ()):
+        with self._lock:
+            self._functions[labels] = function
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for labels, function in functions:
+            values[labels] = function()
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Labels = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # The count in each bucket (the last for above every bound), the sum and the count.
+        self._values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, labels: Labels = ()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = entry
+            counts[index] += 1
+            total[0] += value
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            values = [
+                (labels, list(counts), total[0])
+                for labels, (counts, total) in self._values.items()
+            ]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts, strict=True):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else str(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def expose(self) -> str:
+        """Every metric in the Prometheus text format."""
+
+        return "\n".join(metric.expose() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+DOCUMENTS = Counter(
+    "nomad_bluesky_documents_total", "Documents processed, by name.", ("name",)
+)
+FAILED_DOCUMENTS = Counter(
+    "nomad_bluesky_failed_documents_total",
+    "Documents which couldn't be uploaded, by name.",
+    ("name",),
+)
+QUEUE_DEPTH = Gauge(
+    "nomad_bluesky_queue_depth",
+    "Documents waiting to be uploaded, by queue.",
+    ("queue",),
+)
+SPILLED_DOCUMENTS = Gauge(
+    "nomad_bluesky_spilled_documents",
+    "Documents in the document queue which are spilled to disk.",
+)
+SPILL_BYTES = Gauge(
+    "nomad_bluesky_spill_bytes", "Bytes of spilled documents not yet read back."
+)
+DRAIN_RATE = Gauge(
+    "nomad_bluesky_queue_drain_rate",
+    "Documents taken off the document queue per second.",
+)
+IN_FLIGHT_RUNS = Gauge(
+    "nomad_bluesky_in_flight_runs", "Runs started which haven't stopped yet."
+)
+EXPIRED_RUNS = Counter(
+    "nomad_bluesky_expired_runs_total",
+    "Runs finished without a stop document, after having no documents for the run timeout.",
+)
+LIVE_WORKERS = Gauge(
+    "nomad_bluesky_live_workers", "Worker processes running, in supervisor mode."
+)
+WORKER_RESTARTS = Counter(
+    "nomad_bluesky_worker_restarts_total",
+    "Worker processes restarted after exiting or hanging, in supervisor mode.",
+)
+WATCHED_UPLOADS = Gauge(
+    "nomad_bluesky_watched_uploads", "Uploads whose processing status is polled."
+)
+UPLOAD_POLLS = Counter(
+    "nomad_bluesky_upload_polls_total",
+    "Requests polling the processing status of uploads, each for a batch of them.",
+)
+REQUEST_SECONDS = Histogram(
+    "nomad_bluesky_request_duration_seconds",
+    "Duration of each attempt at a request to NOMAD, by API call.",
+    ("call",),
+)
+RETRIES = Counter(
+    "nomad_bluesky_retries_total", "Requests to NOMAD retried, by API call.", ("call",)
+)
+SENT_BYTES = Counter(
+    "nomad_bluesky_sent_bytes_total",
+    "Bytes of request bodies sent to NOMAD, by API call.",
+    ("call",),
+)
+UNCOMPRESSED_BYTES = Counter(
+    "nomad_bluesky_uncompressed_bytes_total", "Bytes of payloads before zipping."
+)
+COMPRESSED_BYTES = Counter(
+    "nomad_bluesky_compressed_bytes_total", "Bytes of payloads once zipped."
+)
+DEDUPLICATED_BYTES = Counter(
+    "nomad_bluesky_deduplicated_bytes_total",
+    "Bytes not uploaded as the same content was already in NOMAD.",
+)
+COMPRESSION_RATIO = Gauge(
+    "nomad_bluesky_compression_ratio",
+    "Uncompressed over compressed bytes of every payload so far.",
+)
+COMPRESSION_RATIO.set_function(
+    lambda: UNCOMPRESSED_BYTES.value() / (COMPRESSED_BYTES.value() or 1.0)
+)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        content = REGISTRY.expose().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> http.server.ThreadingHTTPServer:
+    """Serve the metrics at `/metrics` on `port` from a daemon thread."""
+
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,17 +1,771 @@
+import concurrent.futures
+import functools
 import io
-import json
-import pprint
-import tempfile
+import queue
+import threading
+import time
 import zipfile
+from collections.abc import Callable, Iterator
 from pathlib import Path
 from typing import Any
 
-import psutil
 import requests
+from requests.adapters import HTTPAdapter
 
-from .logger import logger
+from . import metrics
+from .compression import CompressionPolicy
+from .json_encoder import DEFAULT_ENCODER, JsonEncoder
+from .logger import logger, pretty
+from .retry import CircuitBreaker, RetryPolicy, is_retryable, retry_after
+from .upload_cache import UploadCache
 
 DEFAULT_TIMEOUT = 10.0
+DEFAULT_POOL_SIZE = 10
+
+# Files are zipped and sent in chunks of this size, only a couple are held in memory at once.
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Many files added at once are packed into zips of up to this many bytes, this many
+# of which are zipped and sent at the same time.
+DEFAULT_MAX_ARCHIVE_BYTES = 64 * 1024 * 1024
+DEFAULT_CONCURRENT_ARCHIVES = 4
+
+# Entries requested a page when iterating over a query, and uploads edited a request.
+DEFAULT_QUERY_PAGE_SIZE = 1000
+DEFAULT_EDIT_BATCH_SIZE = 1000
+
+# Seconds an upload is given to be processed once its run has stopped.
+DEFAULT_PROCESSING_TIMEOUT = 60 * 60.0
+
+
+def _zip_bytes(
+    file_name: str, content: bytes, compression: CompressionPolicy
+) -> io.BytesIO:
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
+        compress_type, compresslevel = compression.for_bytes(content)
+        zip_file.writestr(
+            file_name,
+            content,
+            compress_type=compress_type,
+            compresslevel=compresslevel,
+        )
+
+    metrics.UNCOMPRESSED_BYTES.inc(len(content))
+    metrics.COMPRESSED_BYTES.inc(zip_buffer.tell())
+    zip_buffer.seek(0)
+    return zip_buffer
+
+
+def _zip_dictionary(
+    name: str,
+    data: dict[Any, Any],
+    compression: CompressionPolicy,
+    encoder: JsonEncoder = DEFAULT_ENCODER,
+) -> io.BytesIO:
+    return _zip_bytes(f"{name}.json", encoder.dumps(data), compression)
+
+
+def _zip_json_lines(
+    name: str, lines: list[bytes], compression: CompressionPolicy
+) -> io.BytesIO:
+    return _zip_bytes(f"{name}.jsonl", b"\n".join(lines) + b"\n", compression)
+
+
+def _counted(chunks: Iterator[bytes], call: str) -> Iterator[bytes]:
+    """Count the bytes of a streamed request body as they're sent."""
+
+    for chunk in chunks:
+        metrics.SENT_BYTES.inc(len(chunk), (call,))
+        yield chunk
+
+
+class _Cancelled(Exception): ...
+
+
+class _ChunkWriter(io.RawIOBase):
+    """An unseekable file which hands everything written to it on in `chunk_size` pieces."""
+
+    def __init__(self, stream: "_ZipStream"):
+        self._stream = stream
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        metrics.COMPRESSED_BYTES.inc(len(b))
+        self._buffer += b
+        while len(self._buffer) >= self._stream.chunk_size:
+            self._stream._put(bytes(self._buffer[: self._stream.chunk_size]))
+            del self._buffer[: self._stream.chunk_size]
+        return len(b)
+
+    def close(self):
+        if not self.closed and self._buffer:
+            self._stream._put(bytes(self._buffer))
+            self._buffer.clear()
+        super().close()
+
+
+class _ZipStream:
+    """A zip of `files`, produced on a background thread while it is being iterated over.
+
+    Only `max_chunks_in_memory` chunks of `chunk_size` bytes are held at once, so
+    the memory used doesn't depend on the size of the files and compression of the
+    next chunk overlaps with sending the previous one. Iterating gives the zip as
+    chunks, as used for a chunked transfer encoded request body.
+    """
+
+    def __init__(
+        self,
+        files: list[tuple[Path, str]],
+        compression: CompressionPolicy,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_chunks_in_memory: int = 2,
+    ):
+        self.files = files
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self._chunks: queue.Queue[bytes | None] = queue.Queue(
+            maxsize=max_chunks_in_memory
+        )
+        self._cancelled = threading.Event()
+        # Why zipping failed, e.g. a file which was removed, as requests only passes it
+        # on wrapped in a `ConnectionError`.
+        self.exception: BaseException | None = None
+        self._thread: threading.Thread | None = None
+
+    def _put(self, chunk: bytes | None):
+        while True:
+            if self._cancelled.is_set():
+                raise _Cancelled()
+            try:
+                self._chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _zip(self):
+        try:
+            with (
+                _ChunkWriter(self) as writer,
+                zipfile.ZipFile(writer, "w") as zip_file,
+            ):
+                for path, arcname in self.files:
+                    metrics.UNCOMPRESSED_BYTES.inc(path.stat().st_size)
+                    compress_type, compresslevel = self.compression.for_file(path)
+                    zip_file.write(
+                        str(path),
+                        arcname=arcname,
+                        compress_type=compress_type,
+                        compresslevel=compresslevel,
+                    )
+        except _Cancelled:
+            return
+        except Exception as exception:
+            self.exception = exception
+        try:
+            self._put(None)
+        except _Cancelled:
+            pass
+
+    def __iter__(self) -> Iterator[bytes]:
+        self._thread = threading.Thread(target=self._zip, daemon=True)
+        self._thread.start()
+        while (chunk := self._chunks.get()) is not None:
+            yield chunk
+        if self.exception is not None:
+            raise self.exception
+
+    def close(self):
+        """Stop zipping, if the request ended before the whole zip was sent."""
+
+        self._cancelled.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class NomadClient:
+    """A connection to a NOMAD API.
+
+    Owns a `requests.Session` so that TCP/TLS connections are kept alive and reused
+    between calls, and the auth headers are only built once. Up to `pool_size`
+    connections are kept open so the client can be shared between threads.
+
+    `compression` is used for uploads which aren't given their own policy.
+
+    Failed requests are retried according to `retry`, and every request made
+    through the client waits on `circuit_breaker` while NOMAD is failing.
+
+    With a `cache`, dictionaries and files already added to an upload under the same
+    name aren't sent again, and large files already in another upload are added as a
+    `{name}.reference.json` pointing at it instead. Those calls then return `None`,
+    or the response to adding the reference.
+    """
+
+    def __init__(
+        self,
+        nomad_url: str,
+        nomad_token: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        compression: CompressionPolicy | None = None,
+        retry: RetryPolicy | None = None,
+        circuit_breaker: CircuitBreaker | None = None,
+        encoder: JsonEncoder | None = None,
+        cache: UploadCache | None = None,
+    ):
+        self.nomad_url = nomad_url
+        self.nomad_token = nomad_token
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.compression = compression or CompressionPolicy()
+        self.retry = retry or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.encoder = encoder or DEFAULT_ENCODER
+        self.cache = cache
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers.update(
+            {
+                "Authorization": f"Bearer {nomad_token}",
+                "Accept": "application/json",
+            }
+        )
+
+    def close(self):
+        self._session.close()
+
+    def _request(
+        self,
+        call: str,
+        method: str,
+        url: str,
+        timeout: float | None = None,
+        data: Callable[[], Any] | None = None,
+        **kwargs,
+    ) -> requests.Response:
+        """Make a request, retrying if it fails in a way which might not happen again.
+
+        `data` is called for a fresh request body on every attempt. `call` is the
+        name of the API call the request is made for, to label its metrics.
+
+        A zip whose files fail to be read while it's streamed raises their error
+        instead, without retrying or counting against NOMAD.
+        """
+
+        attempt = 0
+        while True:
+            attempt += 1
+            self.circuit_breaker.before_call()
+            try:
+                body = data() if data else None
+                zip_stream = body if isinstance(body, _ZipStream) else None
+                if isinstance(body, io.BytesIO):
+                    metrics.SENT_BYTES.inc(body.getbuffer().nbytes, (call,))
+                elif body is not None:
+                    body = _counted(iter(body), call)
+                start = time.perf_counter()
+                try:
+                    response = self._session.request(
+                        method,
+                        url,
+                        data=body,
+                        timeout=timeout or self.timeout,
+                        **kwargs,
+                    )
+                    response.raise_for_status()
+                except requests.RequestException as exception:
+                    metrics.REQUEST_SECONDS.observe(
+                        time.perf_counter() - start, (call,)
+                    )
+                    if zip_stream is not None and zip_stream.exception is not None:
+                        raise zip_stream.exception from exception
+                    if not is_retryable(exception):
+                        # NOMAD answered, so it isn't struggling even if the request was bad.
+                        if exception.response is not None:
+                            self.circuit_breaker.record_success()
+                        raise
+                    self.circuit_breaker.record_failure()
+                    if attempt >= self.retry.max_attempts:
+                        raise
+                    metrics.RETRIES.inc(1, (call,))
+                    delay = self.retry.delay(attempt, retry_after(exception.response))
+                    logger.warning(
+                        f"{method} {url} failed on attempt {attempt} with `{exception}`, "
+                        f"retrying in {delay:.2f} seconds."
+                    )
+                    time.sleep(delay)
+                    continue
+
+                metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, (call,))
+                self.circuit_breaker.record_success()
+                return response
+            finally:
+                # A trial call which failed without blaming NOMAD lets the next one through.
+                self.circuit_breaker.end_call()
+
+    def create_dataset(
+        self, dataset_name: str, timeout: float | None = None
+    ) -> dict[str, Any]:
+        """
+        Create a new "dataset".
+
+        The dataset contains upload.
+        """
+        response = self._request(
+            "create_dataset",
+            "POST",
+            f"{self.nomad_url}datasets/",
+            json={"dataset_name": dataset_name},
+            timeout=timeout,
+        )
+
+        response_json = response.json()
+        logger.debug("create_dataset: %s", pretty(response_json))
+        return response_json
+
+    def create_upload(self, upload_name: str, timeout: float | None = None):
+        """
+        Create a new "upload".
+
+        The upload created in this class is a directory containing other uploads.
+        """
+
+        response = self._request(
+            "create_upload",
+            "POST",
+            f"{self.nomad_url}/uploads?upload_name={upload_name}",
+            timeout=timeout,
+        )
+
+        response_json = response.json()
+        logger.debug("create_upload: %s", pretty(response_json))
+        return response_json
+
+    def add_dictionary_to_upload(
+        self,
+        name: str,
+        data: dict[Any, Any],
+        upload_uid: str,
+        timeout: float | None = None,
+        compression: CompressionPolicy | None = None,
+    ):
+        """Add the python dictionary `data`, as a .json, to the upload."""
+
+        json_bytes = self.encoder.dumps(data)
+        digest = self.cache.digest(json_bytes) if self.cache else ""
+        if self.cache and self.cache.get(digest) == (upload_uid, name):
+            metrics.DEDUPLICATED_BYTES.inc(len(json_bytes))
+            logger.debug("Skipped `%s`, it's already in upload `%s`.", name, upload_uid)
+            return None
+
+        response = self._request(
+            "add_dictionary_to_upload",
+            "PUT",
+            f"{self.nomad_url}/uploads/{upload_uid}/raw/{name}",
+            data=lambda: _zip_bytes(
+                f"{name}.json", json_bytes, compression or self.compression
+            ),
+            timeout=timeout,
+        )
+        if self.cache:
+            self.cache.add(digest, upload_uid, name)
+
+        response_json = response.json()
+        logger.debug("add_dictionary_to_upload: %s", pretty(response_json))
+        return response_json
+
+    def add_json_lines_to_upload(
+        self,
+        name: str,
+        lines: list[bytes],
+        upload_uid: str,
+        timeout: float | None = None,
+        compression: CompressionPolicy | None = None,
+    ):
+        """Add the already serialized json `lines`, as a newline-delimited .jsonl, to the upload."""
+
+        response = self._request(
+            "add_json_lines_to_upload",
+            "PUT",
+            f"{self.nomad_url}/uploads/{upload_uid}/raw/{name}",
+            data=lambda: _zip_json_lines(name, lines, compression or self.compression),
+            timeout=timeout,
+        )
+
+        response_json = response.json()
+        logger.debug("add_json_lines_to_upload: %s", pretty(response_json))
+        return response_json
+
+    def add_file_to_upload(
+        self,
+        name: str,
+        upload_path: Path,
+        upload_uid: str,
+        timeout: float | None = None,
+        compression: CompressionPolicy | None = None,
+    ):
+        """Upload a single file under the `parent_upload_name` upload.
+
+        If parent_upload_name is `None` then the root directory will be used.
+
+        The file is zipped while it's sent, so it's never held in memory or copied to disk.
+        """
+
+        if self.cache is None:
+            return self.add_archive_to_upload(
+                name,
+                [(upload_path, upload_path.name)],
+                upload_uid,
+                timeout=timeout,
+                compression=compression,
+            )
+
+        digest = self.cache.file_digest(upload_path)
+        size = upload_path.stat().st_size
+        location = self.cache.get(digest)
+        if location == (upload_uid, name):
+            metrics.DEDUPLICATED_BYTES.inc(size)
+            logger.debug("Skipped `%s`, it's already in upload `%s`.", name, upload_uid)
+            return None
+        if location is not None and size >= self.cache.min_reference_bytes:
+            metrics.DEDUPLICATED_BYTES.inc(size)
+            uploaded_id, uploaded_name = location
+            return self.add_dictionary_to_upload(
+                f"{name}.reference",
+                {
+                    "sha256": digest,
+                    "size": size,
+                    "upload_id": uploaded_id,
+                    "name": uploaded_name,
+                    "file_name": upload_path.name,
+                },
+                upload_uid,
+                timeout=timeout,
+            )
+
+        response_json = self.add_archive_to_upload(
+            name,
+            [(upload_path, upload_path.name)],
+            upload_uid,
+            timeout=timeout,
+            compression=compression,
+        )
+        self.cache.add(digest, upload_uid, name)
+        return response_json
+
+    def add_archive_to_upload(
+        self,
+        name: str,
+        files: list[tuple[Path, str]],
+        upload_uid: str,
+        timeout: float | None = None,
+        compression: CompressionPolicy | None = None,
+    ):
+        """Upload `files`, given as `(path, name in the archive)`, together in a single zip.
+
+        As with `add_file_to_upload` the zip is streamed while it's written.
+        """
+
+        # A failed attempt leaves its stream part way through, so every attempt gets a new
+        # one and the last is closed first, so its thread and open file don't linger.
+        zip_streams: list[_ZipStream] = []
+
+        def zip_stream() -> _ZipStream:
+            if zip_streams:
+                zip_streams.pop().close()
+            zip_streams.append(
+                _ZipStream(files, compression or self.compression, self.chunk_size)
+            )
+            return zip_streams[-1]
+
+        try:
+            response = self._request(
+                "add_archive_to_upload",
+                "PUT",
+                f"{self.nomad_url}/uploads/{upload_uid}/raw/{name}",
+                data=zip_stream,
+                timeout=timeout,
+            )
+
+            response_json = response.json()
+            logger.debug("add_archive_to_upload: %s", pretty(response_json))
+            return response_json
+
+        finally:
+            for stream in zip_streams:
+                stream.close()
+
+    def add_files_to_upload(
+        self,
+        name: str,
+        files: list[tuple[Path, str]],
+        upload_uid: str,
+        max_archive_bytes: int = DEFAULT_MAX_ARCHIVE_BYTES,
+        concurrency: int = DEFAULT_CONCURRENT_ARCHIVES,
+        progress: Callable[[int, int], None] | None = None,
+        timeout: float | None = None,
+        compression: CompressionPolicy | None = None,
+    ) -> list[dict[str, Any]]:
+        """Upload many `files`, given as `(path, name in the archive)`, into the directory `name`.
+
+        The files are packed in order into zips of up to `max_archive_bytes` (a larger
+        file gets a zip of its own), and `concurrency` zips are read, compressed and sent
+        at once, so the time taken depends on the bytes rather than the number of files.
+        `progress` is called with the bytes uploaded so far and the total as each zip
+        is done. Returns the responses, raising the first failure once the zips
+        already being sent have finished.
+        """
+
+        archives: list[list[tuple[Path, str]]] = []
+        archive_sizes: list[int] = []
+        for path, arcname in files:
+            size = path.stat().st_size
+            if not archives or archive_sizes[-1] + size > max_archive_bytes:
+                archives.append([])
+                archive_sizes.append(0)
+            archives[-1].append((path, arcname))
+            archive_sizes[-1] += size
+
+        total = sum(archive_sizes)
+        done = 0
+        responses: list[dict[str, Any]] = []
+        with concurrent.futures.ThreadPoolExecutor(
+            concurrency, thread_name_prefix="nomad-archive"
+        ) as executor:
+            futures = {
+                executor.submit(
+                    self.add_archive_to_upload,
+                    name,
+                    archive,
+                    upload_uid,
+                    timeout=timeout,
+                    compression=compression,
+                ): size
+                for archive, size in zip(archives, archive_sizes, strict=True)
+            }
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    responses.append(future.result())
+                    done += futures[future]
+                    if progress:
+                        progress(done, total)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        logger.debug(
+            "Added %d files in %d archives to upload `%s`.",
+            len(files),
+            len(archives),
+            upload_uid,
+        )
+        return responses
+
+    def check_upload_status(
+        self, upload_id: str, timeout: float | None = None
+    ) -> dict[str, Any]:
+        response = self._request(
+            "check_upload_status",
+            "GET",
+            f"{self.nomad_url}/uploads/{upload_id}",
+            timeout=timeout,
+        )
+
+        response_json = response.json()
+        logger.debug("check_upload_status: %s", pretty(response_json))
+        return response_json
+
+    def get_uploads(
+        self, upload_ids: list[str], timeout: float | None = None
+    ) -> list[dict[str, Any]]:
+        """The status of each of the uploads in `upload_ids` in a single request."""
+
+        response = self._request(
+            "get_uploads",
+            "GET",
+            f"{self.nomad_url}/uploads",
+            params={"upload_id": upload_ids, "page_size": len(upload_ids)},
+            timeout=timeout,
+        )
+
+        response_json = response.json()
+        logger.debug("get_uploads: %s", pretty(response_json))
+        return response_json["data"]
+
+    def add_upload_metadata(
+        self, upload_id: str, metadata: dict, timeout: float | None = None
+    ) -> dict[str, Any]:
+        response = self._request(
+            "add_upload_metadata",
+            "POST",
+            f"{self.nomad_url}/uploads/{upload_id}/edit",
+            json={"metadata": metadata} if metadata else None,
+            timeout=timeout,
+        )
+
+        response_json = response.json()
+        logger.debug("add_upload_metadata: %s", pretty(response_json))
+        return response_json
+
+    def query(
+        self,
+        query_fields: list[str],
+        page_size=1,
+        required: list[str] | None = None,
+        timeout: float | None = None,
+        page_after_value: str | None = None,
+    ) -> dict[str, Any]:
+        """A page of the entries matching all of `query_fields`.
+
+        The next page starts after the `next_page_after_value` of its pagination.
+        """
+
+        query: dict[str, Any] = {
+            "query": {"all": query_fields},
+            "pagination": {"page_size": page_size},
+        }
+        if page_after_value is not None:
+            query["pagination"]["page_after_value"] = page_after_value
+        if required:
+            query.update({"required": {"include": required}})
+
+        response = self._request(
+            "query",
+            "POST",
+            f"{self.nomad_url}/entries/query",
+            json=query,
+            timeout=timeout,
+        )
+
+        response_json = response.json()
+        logger.debug("query: %s", pretty(response_json))
+        return response_json
+
+    def iter_entries(
+        self,
+        query_fields: list[str],
+        page_size: int = DEFAULT_QUERY_PAGE_SIZE,
+        required: list[str] | None = None,
+        timeout: float | None = None,
+    ) -> Iterator[dict[str, Any]]:
+        """Every entry matching all of `query_fields`, following the pages of the query.
+
+        The next page is requested while the entries of the current one are consumed.
+        Only the fields in `required` are returned if it's given, which keeps large
+        pages small.
+        """
+
+        with concurrent.futures.ThreadPoolExecutor(
+            1, thread_name_prefix="nomad-query"
+        ) as executor:
+            page = executor.submit(
+                self.query, query_fields, page_size, required, timeout
+            )
+            while page is not None:
+                response_json = page.result()
+                page_after_value = response_json["pagination"].get(
+                    "next_page_after_value"
+                )
+                page = (
+                    executor.submit(
+                        self.query,
+                        query_fields,
+                        page_size,
+                        required,
+                        timeout,
+                        page_after_value,
+                    )
+                    if page_after_value is not None and response_json["data"]
+                    else None
+                )
+                yield from response_json["data"]
+
+    def edit_entries(
+        self,
+        query: dict[str, Any],
+        metadata: dict[str, Any],
+        timeout: float | None = None,
+    ) -> dict[str, Any]:
+        """Edit the `metadata` of every entry matching `query` in a single request.
+
+        List fields such as `datasets` take `{"add": [...]}` or `{"remove": [...]}`.
+        """
+
+        response = self._request(
+            "edit_entries",
+            "POST",
+            f"{self.nomad_url}/entries/edit",
+            json={"query": query, "metadata": metadata},
+            timeout=timeout,
+        )
+
+        response_json = response.json()
+        logger.debug("edit_entries: %s", pretty(response_json))
+        return response_json
+
+    def edit_uploads(
+        self,
+        upload_ids: list[str],
+        metadata: dict[str, Any],
+        batch_size: int = DEFAULT_EDIT_BATCH_SIZE,
+        timeout: float | None = None,
+    ) -> list[dict[str, Any]]:
+        """Edit the `metadata` of the entries of many uploads, `batch_size` uploads a request."""
+
+        return [
+            self.edit_entries(
+                {"upload_id:any": upload_ids[start : start + batch_size]},
+                metadata,
+                timeout,
+            )
+            for start in range(0, len(upload_ids), batch_size)
+        ]
+
+    def add_uploads_to_dataset(
+        self,
+        upload_ids: list[str],
+        dataset_id: str,
+        batch_size: int = DEFAULT_EDIT_BATCH_SIZE,
+        timeout: float | None = None,
+    ) -> list[dict[str, Any]]:
+        """Add the entries of many uploads to the dataset, `batch_size` uploads a request."""
+
+        return self.edit_uploads(
+            upload_ids, {"datasets": {"add": [dataset_id]}}, batch_size, timeout
+        )
+
+    def create_datasets(
+        self,
+        dataset_names: list[str],
+        concurrency: int = DEFAULT_CONCURRENT_ARCHIVES,
+        timeout: float | None = None,
+    ) -> dict[str, dict[str, Any]]:
+        """Create many datasets, `concurrency` at a time, returns the response for each name.
+
+        NOMAD has no endpoint creating several at once.
+        """
+
+        with concurrent.futures.ThreadPoolExecutor(
+            concurrency, thread_name_prefix="nomad-dataset"
+        ) as executor:
+            responses = executor.map(
+                lambda name: self.create_dataset(name, timeout), dataset_names
+            )
+            return dict(zip(dataset_names, responses, strict=True))
+
+
+@functools.cache
+def _client(nomad_url: str, nomad_token: str) -> NomadClient:
+    """The client shared by the free functions below, one per NOMAD url and token."""
+    return NomadClient(nomad_url, nomad_token)
 
 
 def create_dataset(
@@ -20,25 +774,7 @@ def create_dataset(
     nomad_token: str,
     timeout: float = DEFAULT_TIMEOUT,
 ) -> dict[str, Any]:
-    """
-    Create a new "dataset".
-
-    The dataset contains upload.
-    """
-    response = requests.post(
-        f"{nomad_url}datasets/",
-        headers={
-            "Authorization": f"Bearer {nomad_token}",
-            "Accept": "application/json",
-        },
-        json={"dataset_name": dataset_name},
-        timeout=timeout,
-    )
-    response.raise_for_status()
-
-    response_json = response.json()
-    logger.debug(f"create_dataset: {pprint.pformat(response_json)}")
-    return response_json
+    return _client(nomad_url, nomad_token).create_dataset(dataset_name, timeout)
 
 
 def create_upload(
@@ -47,25 +783,7 @@ def create_upload(
     nomad_token: str,
     timeout: float = DEFAULT_TIMEOUT,
 ):
-    """
-    Create a new "upload".
-
-    The upload created in this class is a directory containing other uploads.
-    """
-
-    response = requests.post(
-        f"{nomad_url}/uploads?upload_name={upload_name}",
-        headers={
-            "Authorization": f"Bearer {nomad_token}",
-            "Accept": "application/json",
-        },
-        timeout=timeout,
-    )
-    response.raise_for_status()
-
-    response_json = response.json()
-    logger.debug(f"create_upload: {pprint.pformat(response_json)}")
-    return response_json
+    return _client(nomad_url, nomad_token).create_upload(upload_name, timeout)
 
 
 def add_dictionary_to_upload(
@@ -76,29 +794,22 @@ def add_dictionary_to_upload(
     nomad_token: str,
     timeout: float = DEFAULT_TIMEOUT,
 ):
-    """Add the python dictionary `data`, as a .json, to the upload."""
+    return _client(nomad_url, nomad_token).add_dictionary_to_upload(
+        name, data, upload_uid, timeout
+    )
 
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        # Serialize the dictionary to JSON and write it to the zip in memory
-        json_bytes = json.dumps(data).encode("utf-8")
-        zip_file.writestr(f"{name}.json", json_bytes)
 
-    zip_buffer.seek(0)
-    response = requests.put(
-        f"{nomad_url}/uploads/{upload_uid}/raw/{name}",
-        headers={
-            "Authorization": f"Bearer {nomad_token}",
-            "Accept": "application/json",
-        },
-        data=zip_buffer,
-        timeout=timeout,
+def add_json_lines_to_upload(
+    name: str,
+    lines: list[bytes],
+    upload_uid: str,
+    nomad_url: str,
+    nomad_token: str,
+    timeout: float = DEFAULT_TIMEOUT,
+):
+    return _client(nomad_url, nomad_token).add_json_lines_to_upload(
+        name, lines, upload_uid, timeout
     )
-    response.raise_for_status()
-
-    response_json = response.json()
-    logger.debug(f"add_dictionary_to_upload: {pprint.pformat(response_json)}")
-    return response_json
 
 
 def add_file_to_upload(
@@ -109,41 +820,36 @@ def add_file_to_upload(
     nomad_token: str,
     timeout: float = DEFAULT_TIMEOUT,
 ):
-    """Upload a single file under the `parent_upload_name` upload.
+    return _client(nomad_url, nomad_token).add_file_to_upload(
+        name, upload_path, upload_uid, timeout
+    )
 
-    If parent_upload_name is `None` then the root directory will be used.
-    """
 
-    # Hold zip in memory if the file is small enough, else temporarily store it on disk
-    file_size = upload_path.stat().st_size
-    memory_left = psutil.virtual_memory().available
-    if memory_left >= file_size:
-        zip_buffer = io.BytesIO()
-    else:
-        zip_buffer = tempfile.NamedTemporaryFile(delete_on_close=True)
-
-    try:
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            zip_file.write(str(upload_path), arcname=upload_path.name)
-        zip_buffer.seek(0)
-
-        response = requests.put(
-            f"{nomad_url}/uploads/{upload_uid}/raw/{name}",
-            headers={
-                "Authorization": f"Bearer {nomad_token}",
-                "Accept": "application/json",
-            },
-            data=zip_buffer,
-            timeout=timeout,
-        )
-        response.raise_for_status()
+def add_archive_to_upload(
+    name: str,
+    files: list[tuple[Path, str]],
+    upload_uid: str,
+    nomad_url: str,
+    nomad_token: str,
+    timeout: float = DEFAULT_TIMEOUT,
+):
+    return _client(nomad_url, nomad_token).add_archive_to_upload(
+        name, files, upload_uid, timeout
+    )
 
-        response_json = response.json()
-        logger.debug(f"add_file_to_upload: {pprint.pformat(response_json)}")
-        return response_json
 
-    finally:
-        zip_buffer.close()
+def add_files_to_upload(
+    name: str,
+    files: list[tuple[Path, str]],
+    upload_uid: str,
+    nomad_url: str,
+    nomad_token: str,
+    progress: Callable[[int, int], None] | None = None,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> list[dict[str, Any]]:
+    return _client(nomad_url, nomad_token).add_files_to_upload(
+        name, files, upload_uid, progress=progress, timeout=timeout
+    )
 
 
 def check_upload_status(
@@ -152,16 +858,16 @@ def check_upload_status(
     nomad_token: str,
     timeout: float = DEFAULT_TIMEOUT,
 ) -> dict[str, Any]:
-    response = requests.get(
-        f"{nomad_url}/uploads/{upload_id}",
-        headers={"Authorization": f"Bearer {nomad_token}"},
-        timeout=timeout,
-    )
-    response.raise_for_status()
+    return _client(nomad_url, nomad_token).check_upload_status(upload_id, timeout)
 
-    response_json = response.json()
-    logger.debug(f"check_upload_status: {pprint.pformat(response_json)}")
-    return response_json
+
+def get_uploads(
+    upload_ids: list[str],
+    nomad_url: str,
+    nomad_token: str,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> list[dict[str, Any]]:
+    return _client(nomad_url, nomad_token).get_uploads(upload_ids, timeout)
 
 
 def add_upload_metadata(
@@ -171,20 +877,9 @@ def add_upload_metadata(
     nomad_token: str,
     timeout: float = DEFAULT_TIMEOUT,
 ) -> dict[str, Any]:
-    response = requests.post(
-        f"{nomad_url}/uploads/{upload_id}/edit",
-        headers={
-            "Authorization": f"Bearer {nomad_token}",
-            "Accept": "application/json",
-        },
-        json={"metadata": metadata} if metadata else None,
-        timeout=timeout,
+    return _client(nomad_url, nomad_token).add_upload_metadata(
+        upload_id, metadata, timeout
     )
-    response.raise_for_status()
-
-    response_json = response.json()
-    logger.debug(f"add_upload_metadata: {pprint.pformat(response_json)}")
-    return response_json
 
 
 def query(
@@ -195,27 +890,67 @@ def query(
     required: list[str] | None = None,
     timeout: float = DEFAULT_TIMEOUT,
 ) -> dict[str, Any]:
-    query = {
-        "query": {"all": query_fields},
-        "pagination": {"page_size": page_size},
-    }
-    if required:
-        query.update({"required": {"include": required}})
-
-    response = requests.post(
-        f"{nomad_url}/entries/query",
-        json=query,
-        headers={
-            "Authorization": f"Bearer {nomad_token}",
-            "Accept": "application/json",
-        },
-        timeout=timeout,
+    return _client(nomad_url, nomad_token).query(
+        query_fields, page_size, required, timeout
+    )
+
+
+def iter_entries(
+    query_fields: list[str],
+    nomad_url: str,
+    nomad_token: str,
+    page_size: int = DEFAULT_QUERY_PAGE_SIZE,
+    required: list[str] | None = None,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> Iterator[dict[str, Any]]:
+    return _client(nomad_url, nomad_token).iter_entries(
+        query_fields, page_size, required, timeout
+    )
+
+
+def edit_entries(
+    query: dict[str, Any],
+    metadata: dict[str, Any],
+    nomad_url: str,
+    nomad_token: str,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> dict[str, Any]:
+    return _client(nomad_url, nomad_token).edit_entries(query, metadata, timeout)
+
+
+def edit_uploads(
+    upload_ids: list[str],
+    metadata: dict[str, Any],
+    nomad_url: str,
+    nomad_token: str,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> list[dict[str, Any]]:
+    return _client(nomad_url, nomad_token).edit_uploads(
+        upload_ids, metadata, timeout=timeout
     )
-    response.raise_for_status()
 
-    response_json = response.json()
-    logger.debug(f"query: {pprint.pformat(response_json)}")
-    return response_json
+
+def add_uploads_to_dataset(
+    upload_ids: list[str],
+    dataset_id: str,
+    nomad_url: str,
+    nomad_token: str,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> list[dict[str, Any]]:
+    return _client(nomad_url, nomad_token).add_uploads_to_dataset(
+        upload_ids, dataset_id, timeout=timeout
+    )
+
+
+def create_datasets(
+    dataset_names: list[str],
+    nomad_url: str,
+    nomad_token: str,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> dict[str, dict[str, Any]]:
+    return _client(nomad_url, nomad_token).create_datasets(
+        dataset_names, timeout=timeout
+    )
 
 
 # TODO:
@@ -0,0 +1,142 @@
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+from .logger import logger
+
+# Responses worth trying again, anything else from NOMAD won't change by retrying.
+RETRYABLE_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 60.0
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+
+def is_retryable(exception: BaseException) -> bool:
+    """Timeouts, dropped connections, 429 and 5xx responses are retryable."""
+
+    if isinstance(exception, requests.HTTPError):
+        return (
+            exception.response is not None
+            and exception.response.status_code in RETRYABLE_STATUS_CODES
+        )
+    return isinstance(exception, (requests.Timeout, requests.ConnectionError))
+
+
+def retry_after(response: requests.Response | None) -> float | None:
+    """Seconds to wait from the `Retry-After` header of `response`, if it has one."""
+
+    if response is None or "Retry-After" not in response.headers:
+        return None
+    value = response.headers["Retry-After"]
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(
+            0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """How many times to try a request and how long to wait in between.
+
+    Waits grow exponentially from `base_delay` up to `max_delay` with full jitter, so
+    that workers which failed together don't all retry together. A `Retry-After`
+    from NOMAD is waited for at least.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = DEFAULT_BASE_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """Seconds to wait after failed attempt number `attempt` (starting from 1)."""
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class CircuitBreaker:
+    """Stops every user of a client from calling NOMAD while it's struggling.
+
+    After `failure_threshold` consecutive failures the circuit opens and callers of
+    `before_call` are paused for `reset_timeout` seconds. A single trial call is then
+    let through, closing the circuit again if it succeeds or reopening it if it fails.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._condition = threading.Condition()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_progress = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_call(self):
+        """Blocks while the circuit is open, or while another caller is making the trial call."""
+
+        with self._condition:
+            while self._opened_at is not None:
+                wait = self._opened_at + self.reset_timeout - time.monotonic()
+                if wait <= 0 and not self._trial_in_progress:
+                    self._trial_in_progress = True
+                    return
+                self._condition.wait(wait if wait > 0 else None)
+
+    def end_call(self):
+        """Called after every call let through by `before_call`, however it ended."""
+
+        with self._condition:
+            if self._trial_in_progress:
+                self._trial_in_progress = False
+                self._condition.notify_all()
+
+    def record_success(self):
+        with self._condition:
+            if self._opened_at is not None:
+                logger.info("NOMAD is responding again, closing the circuit breaker.")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+            self._condition.notify_all()
+
+    def record_failure(self):
+        with self._condition:
+            self._failures += 1
+            if self._trial_in_progress or (
+                self._opened_at is None and self._failures >= self.failure_threshold
+            ):
+                logger.warning(
+                    f"{self._failures} consecutive failures calling NOMAD, pausing "
+                    f"uploads for {self.reset_timeout} seconds."
+                )
+                self._opened_at = time.monotonic()
+            self._trial_in_progress = False
+            self._condition.notify_all()
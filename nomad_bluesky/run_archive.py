@@ -0,0 +1,116 @@
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import IO, Any
+
+from .json_encoder import DEFAULT_ENCODER, JsonEncoder
+
+# A checkpoint of a run is uploaded once this many bytes of documents are staged.
+DEFAULT_CHECKPOINT_BYTES = 256 * 1024 * 1024
+
+MANIFEST_NAME = "manifest.json"
+
+
+class RunArchive:
+    """The documents of a single run, staged on disk to be uploaded as one archive.
+
+    Documents are appended to a .jsonl per document name in a part of the run. Each
+    `checkpoint` closes the current part and returns its files for uploading, along
+    with a manifest listing every part so far, after which `next_part` removes them
+    and starts a new one. The archive of a short run is a single part uploaded at stop.
+
+    `parts` are those already uploaded for the run, by a process before a restart.
+    """
+
+    def __init__(
+        self,
+        run_start: str,
+        upload_id: str,
+        staging_path: Path | None = None,
+        encoder: JsonEncoder = DEFAULT_ENCODER,
+        parts: list[dict[str, Any]] | None = None,
+    ):
+        self.run_start = run_start
+        self.upload_id = upload_id
+        self.encoder = encoder
+        self.directory = Path(
+            tempfile.mkdtemp(prefix=f"run_{run_start}_", dir=staging_path)
+        )
+
+        self.parts: list[dict[str, Any]] = list(parts or [])
+        # Journal sequence numbers of the documents in the current part, acknowledged
+        # once it's uploaded.
+        self.seqs: list[int] = []
+        self.number_of_bytes = 0
+        self._new_part()
+
+    def _new_part(self):
+        # Named by time so that parts staged after a restart don't replace earlier ones.
+        self.part = f"part_{time.time_ns()}"
+        self._files: dict[str, IO[bytes]] = {}
+        self._counts: dict[str, int] = {}
+
+    def add(self, name: str, document: Any, seq: int | None = None):
+        file = self._files.get(name)
+        if file is None:
+            file = (self.directory / f"{name}.jsonl").open("wb")
+            self._files[name] = file
+        line = self.encoder.dumps(document) + b"\n"
+        file.write(line)
+        self._counts[name] = self._counts.get(name, 0) + 1
+        self.number_of_bytes += len(line)
+        if seq is not None:
+            self.seqs.append(seq)
+
+    def checkpoint(self, complete: bool = False) -> list[tuple[Path, str]]:
+        """Close the current part, returns `(path, name in the archive)` of its files and the manifest."""
+
+        for file in self._files.values():
+            file.close()
+        files = [
+            (self.directory / f"{name}.jsonl", f"{self.part}/{name}.jsonl")
+            for name in self._files
+        ]
+        self.parts.append({"part": self.part, "documents": dict(self._counts)})
+
+        manifest = self.directory / MANIFEST_NAME
+        manifest.write_text(
+            json.dumps(
+                {
+                    "run_start": self.run_start,
+                    "complete": complete,
+                    "parts": self.parts,
+                }
+            )
+        )
+        return [*files, (manifest, MANIFEST_NAME)]
+
+    def next_part(self):
+        """Remove the files of the uploaded part and start the next one."""
+
+        for name in self._files:
+            (self.directory / f"{name}.jsonl").unlink()
+        self.seqs = []
+        self.number_of_bytes = 0
+        self._new_part()
+
+    def retry_part(self):
+        """Reopen the files of a part which failed to upload, to carry on adding to it."""
+
+        self.parts.pop()
+        self._files = {
+            name: (self.directory / f"{name}.jsonl").open("ab") for name in self._files
+        }
+
+    def close(self):
+        """Remove the staged files once the archive is uploaded.
+
+        Along with those left by earlier attempts at the run which failed to upload.
+        """
+
+        for file in self._files.values():
+            file.close()
+        for directory in self.directory.parent.glob(f"run_{self.run_start}_*"):
+            shutil.rmtree(directory, ignore_errors=True)
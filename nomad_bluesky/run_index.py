@@ -0,0 +1,82 @@
+import time
+
+# Seconds without a document after which a run whose stop never arrived is abandoned.
+DEFAULT_RUN_TIMEOUT = 24 * 60 * 60.0
+
+
+class _Run:
+    """The descriptors and resources of a run in progress, and when it was last seen."""
+
+    __slots__ = ("descriptors", "last_seen", "resources")
+
+    def __init__(self):
+        self.descriptors: list[str] = []
+        self.resources: list[str] = []
+        self.last_seen = time.monotonic()
+
+
+class RunIndex:
+    """The run start of each descriptor and resource of the runs in progress.
+
+    Look up the run of a descriptor or resource in `descriptors` and `resources`, they're
+    indexed by run as well, so that `forget` only touches the entries of the run being
+    forgotten however many runs came before it.
+    """
+
+    def __init__(self):
+        self.descriptors: dict[str, str] = {}
+        self.resources: dict[str, str] = {}
+        self._runs: dict[str, _Run] = {}
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    def __contains__(self, run_start: str) -> bool:
+        return run_start in self._runs
+
+    def _run(self, run_start: str) -> _Run:
+        run = self._runs.get(run_start)
+        if run is None:
+            run = self._runs[run_start] = _Run()
+        return run
+
+    def add_run(self, run_start: str):
+        self._run(run_start)
+
+    def add_descriptor(self, descriptor: str, run_start: str):
+        if self.descriptors.get(descriptor) != run_start:
+            self.descriptors[descriptor] = run_start
+            self._run(run_start).descriptors.append(descriptor)
+
+    def add_resource(self, resource: str, run_start: str):
+        if self.resources.get(resource) != run_start:
+            self.resources[resource] = run_start
+            self._run(run_start).resources.append(resource)
+
+    def touch(self, run_start: str):
+        """Record that a document of the run was received, keeping it from timing out."""
+
+        run = self._runs.get(run_start)
+        if run is not None:
+            run.last_seen = time.monotonic()
+
+    def forget(self, run_start: str):
+        """Remove the run and its descriptors and resources, once it's stopped."""
+
+        run = self._runs.pop(run_start, None)
+        if run is None:
+            return
+        for descriptor in run.descriptors:
+            self.descriptors.pop(descriptor, None)
+        for resource in run.resources:
+            self.resources.pop(resource, None)
+
+    def expired(self, timeout: float) -> list[str]:
+        """The runs which haven't had a document in `timeout` seconds."""
+
+        now = time.monotonic()
+        return [
+            run_start
+            for run_start, run in list(self._runs.items())
+            if now - run.last_seen >= timeout
+        ]
@@ -0,0 +1,239 @@
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+# Writes are committed at most this often, and at least this long after they're made, a
+# crash loses documents received since the last commit.
+DEFAULT_COMMIT_INTERVAL = 0.1
+
+
+class StateStore:
+    """Everything needed to resume uploading after a restart, kept in an SQLite database at `path`.
+
+    Documents are journaled when they're received and deleted from the journal once
+    they've been acknowledged by NOMAD, so on restart only the journaled documents
+    need to be uploaded again. Alongside it are the run start to upload, descriptor
+    and resource to run start mappings of the runs which haven't stopped yet, the
+    external files their resources refer to and the parts of their archives uploaded.
+    """
+
+    def __init__(self, path: Path, commit_interval: float = DEFAULT_COMMIT_INTERVAL):
+        self.path = path
+        self.commit_interval = commit_interval
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                document BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS runs (
+                run_start TEXT PRIMARY KEY,
+                upload_id TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS descriptors (
+                descriptor TEXT PRIMARY KEY,
+                run_start TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS descriptors_by_run ON descriptors (run_start);
+            CREATE TABLE IF NOT EXISTS resources (
+                resource TEXT PRIMARY KEY,
+                run_start TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS resources_by_run ON resources (run_start);
+            CREATE TABLE IF NOT EXISTS archive_parts (
+                run_start TEXT PRIMARY KEY,
+                parts TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS run_files (
+                run_start TEXT NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (run_start, path)
+            );
+            """
+        )
+        self._connection.commit()
+        self._last_commit = time.monotonic()
+
+        # The last writes of a burst, often the stop and the acknowledgements of a run,
+        # are committed from here rather than waiting for the next write to arrive.
+        self._dirty = False
+        self._closed = threading.Event()
+        self._flush_thread = threading.Thread(
+            target=self._flush, name="nomad-state-flush", daemon=True
+        )
+        self._flush_thread.start()
+
+    def _maybe_commit(self):
+        now = time.monotonic()
+        if now - self._last_commit >= self.commit_interval:
+            self._connection.commit()
+            self._last_commit = now
+            self._dirty = False
+        else:
+            self._dirty = True
+
+    def _flush(self):
+        while not self._closed.wait(self.commit_interval):
+            with self._lock:
+                if self._dirty:
+                    self._connection.commit()
+                    self._last_commit = time.monotonic()
+                    self._dirty = False
+
+    def commit(self):
+        with self._lock:
+            self._connection.commit()
+            self._last_commit = time.monotonic()
+            self._dirty = False
+
+    def close(self):
+        self._closed.set()
+        self._flush_thread.join()
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def journal(self, name: str, document: Any) -> int:
+        """Record a received document, returns its sequence number for `acknowledge`."""
+
+        with self._lock:
+            seq = self._connection.execute(
+                "INSERT INTO journal (name, document) VALUES (?, ?)",
+                (name, pickle.dumps(document)),
+            ).lastrowid
+            self._maybe_commit()
+        assert seq is not None
+        return seq
+
+    def acknowledge(self, seqs: Iterable[int]):
+        """Remove documents from the journal once they're in NOMAD."""
+
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM journal WHERE seq = ?", ((seq,) for seq in seqs)
+            )
+            self._maybe_commit()
+
+    def pending(self) -> list[tuple[int, str, Any]]:
+        """Journaled documents which haven't been acknowledged, in the order they were received."""
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT seq, name, document FROM journal ORDER BY seq"
+            ).fetchall()
+        return [(seq, name, pickle.loads(document)) for seq, name, document in rows]
+
+    def add_run(self, run_start: str, upload_id: str):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO runs (run_start, upload_id) VALUES (?, ?)",
+                (run_start, upload_id),
+            )
+            self._maybe_commit()
+
+    def add_descriptor(self, descriptor: str, run_start: str):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO descriptors (descriptor, run_start) VALUES (?, ?)",
+                (descriptor, run_start),
+            )
+            self._maybe_commit()
+
+    def add_resource(self, resource: str, run_start: str):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO resources (resource, run_start) VALUES (?, ?)",
+                (resource, run_start),
+            )
+            self._maybe_commit()
+
+    def add_run_file(self, run_start: str, path: Path):
+        """Record an external file to attach to the upload of the run when it stops."""
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO run_files (run_start, path) VALUES (?, ?)",
+                (run_start, str(path)),
+            )
+            self._maybe_commit()
+
+    def set_archive_parts(self, run_start: str, parts: list[dict[str, Any]]):
+        """Record the parts of the archive of the run uploaded so far, for its manifest."""
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO archive_parts (run_start, parts) VALUES (?, ?)",
+                (run_start, json.dumps(parts)),
+            )
+            self._maybe_commit()
+
+    def remove_run(self, run_start: str):
+        """Forget a run and its descriptors, resources and files once it's stopped."""
+
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM runs WHERE run_start = ?", (run_start,)
+            )
+            self._connection.execute(
+                "DELETE FROM descriptors WHERE run_start = ?", (run_start,)
+            )
+            self._connection.execute(
+                "DELETE FROM resources WHERE run_start = ?", (run_start,)
+            )
+            self._connection.execute(
+                "DELETE FROM run_files WHERE run_start = ?", (run_start,)
+            )
+            self._connection.execute(
+                "DELETE FROM archive_parts WHERE run_start = ?", (run_start,)
+            )
+            self._maybe_commit()
+
+    def runs(self) -> dict[str, str]:
+        with self._lock:
+            return dict(
+                self._connection.execute("SELECT run_start, upload_id FROM runs")
+            )
+
+    def descriptors(self) -> dict[str, str]:
+        with self._lock:
+            return dict(
+                self._connection.execute(
+                    "SELECT descriptor, run_start FROM descriptors"
+                )
+            )
+
+    def resources(self) -> dict[str, str]:
+        with self._lock:
+            return dict(
+                self._connection.execute("SELECT resource, run_start FROM resources")
+            )
+
+    def run_files(self) -> dict[str, list[Path]]:
+        """The external files of each run, in the order they were recorded."""
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT run_start, path FROM run_files ORDER BY rowid"
+            ).fetchall()
+        files: dict[str, list[Path]] = {}
+        for run_start, path in rows:
+            files.setdefault(run_start, []).append(Path(path))
+        return files
+
+    def archive_parts(self, run_start: str) -> list[dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT parts FROM archive_parts WHERE run_start = ?", (run_start,)
+            ).fetchone()
+        return json.loads(row[0]) if row else []
@@ -0,0 +1,332 @@
+import multiprocessing
+import threading
+import time
+import typing
+import zlib
+from multiprocessing.connection import Connection
+from multiprocessing.sharedctypes import Synchronized
+from pathlib import Path
+from typing import Any
+
+from bluesky.callbacks.zmq import RemoteDispatcher
+from event_model.documents import (
+    Datum,
+    DatumPage,
+    Document,
+    Event,
+    EventDescriptor,
+    EventPage,
+    Resource,
+    RunStart,
+    RunStop,
+    StreamDatum,
+    StreamResource,
+)
+
+from . import metrics
+from .callback import NomadCallback
+from .logger import logger
+from .nomad_api import NomadClient
+from .run_index import DEFAULT_RUN_TIMEOUT, RunIndex
+
+DEFAULT_PROCESSES = 1
+
+# Seconds between health checks of the workers.
+DEFAULT_HEALTH_CHECK_PERIOD = 5.0
+
+# A worker which hasn't read from its pipe for this many seconds is considered hung,
+# it wakes up to beat at least every `HEARTBEAT_PERIOD` when idle.
+DEFAULT_HEARTBEAT_TIMEOUT = 60.0
+HEARTBEAT_PERIOD = 1.0
+
+# Options of the callback which are paths to files, given a suffix per worker so that
+# processes don't write to the same file.
+_PER_WORKER_PATHS = ("spill_path", "state_path", "dead_letter_path")
+
+
+def _per_worker(options: dict[str, Any], shard: int) -> dict[str, Any]:
+    options = dict(options)
+    for option in _PER_WORKER_PATHS:
+        path: Path | None = options.get(option)
+        if path is not None:
+            options[option] = path.with_name(f"{path.stem}-{shard}{path.suffix}")
+    return options
+
+
+def _work(
+    nomad_api_url: str,
+    nomad_api_token: str,
+    client_options: dict[str, Any],
+    callback_options: dict[str, Any],
+    log_level: int,
+    metrics_port: int | None,
+    connection: Connection,
+    heartbeat: Synchronized,
+):
+    """The main of a worker process, uploads the documents received on `connection`."""
+
+    logger.setLevel(log_level)
+    if metrics_port is not None:
+        try:
+            metrics.serve_metrics(metrics_port)
+        except OSError as exception:
+            logger.error(
+                f"Couldn't serve the metrics of a worker on port {metrics_port}: {exception!r}"
+            )
+    client = NomadClient(nomad_api_url, nomad_api_token, **client_options)
+    callback = NomadCallback(
+        nomad_api_url, nomad_api_token, client=client, **callback_options
+    )
+    callback.serve()
+    while True:
+        heartbeat.value = time.time()
+        if not connection.poll(HEARTBEAT_PERIOD):
+            continue
+        message = connection.recv()
+        if message is None:  # None is used as the kill signal
+            break
+        callback(*message)
+    callback.join()
+    client.close()
+
+
+class _Worker:
+    """A worker process, and the pipe documents are sent to it over."""
+
+    def __init__(
+        self,
+        shard: int,
+        context: multiprocessing.context.SpawnContext,
+        args: tuple[Any, ...],
+    ):
+        self.shard = shard
+        self._context = context
+        self._args = args
+        # Held while sending or restarting, so a document is never sent to a dead worker.
+        self.lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        receiver, self.connection = self._context.Pipe(duplex=False)
+        self.heartbeat = self._context.Value("d", time.time(), lock=False)
+        self.process = self._context.Process(
+            target=_work,
+            args=(*self._args, receiver, self.heartbeat),
+            name=f"nomad-worker-{self.shard}",
+            daemon=True,
+        )
+        self.process.start()
+        # Otherwise the pipe stays open when the worker dies, and sending blocks.
+        receiver.close()
+
+    def hung(self, timeout: float) -> bool:
+        return self.process.is_alive() and time.time() - self.heartbeat.value > timeout
+
+    def restart_if_dead(self) -> bool:
+        """Start a new process if this one has exited, call with `lock` held."""
+
+        if self.process.is_alive():
+            return False
+        logger.warning(
+            "Worker %d exited with code %s, restarting it.",
+            self.shard,
+            self.process.exitcode,
+        )
+        self.connection.close()
+        self.process.close()
+        metrics.WORKER_RESTARTS.inc()
+        self._start()
+        return True
+
+    def stop(self):
+        with self.lock:
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            self.process.join()
+            self.connection.close()
+
+
+class NomadSupervisor:
+    """Receives documents over zmq and routes them to `processes` worker processes.
+
+    Each worker runs its own `NomadCallback` and `NomadClient`, so that serializing and
+    zipping documents isn't limited to one core by the GIL. Documents are sharded by the
+    uid of their run start, the documents of a run are uploaded in order by one worker.
+
+    Workers which exit, or stop reading documents for `heartbeat_timeout` seconds, are
+    restarted. Documents already in the pipe of a worker when it dies are lost unless
+    `state_path` is in `callback_options`, in which case each worker journals to its own
+    file and the restarted worker resumes its runs from it.
+
+    Each process keeps its own metrics. With a `metrics_port`, the supervisor's (the
+    documents received and the health of the workers) are served on it by the caller,
+    and those of each worker, its requests, queues and runs, are served by the worker
+    itself on the ports following it, `metrics_port + 1 + shard`.
+    """
+
+    def __init__(
+        self,
+        nomad_api_url: str,
+        nomad_api_token: str,
+        zmq_url: str,
+        processes: int = DEFAULT_PROCESSES,
+        client_options: dict[str, Any] | None = None,
+        callback_options: dict[str, Any] | None = None,
+        health_check_period: float = DEFAULT_HEALTH_CHECK_PERIOD,
+        heartbeat_timeout: float = DEFAULT_HEARTBEAT_TIMEOUT,
+        run_timeout: float | None = DEFAULT_RUN_TIMEOUT,
+        metrics_port: int | None = None,
+    ):
+        self.NOMAD_API_URL = nomad_api_url
+        self.NOMAD_API_TOKEN = nomad_api_token
+        self.ZMQ_URL = zmq_url
+
+        self._processes = processes
+        # Passed to the `NomadClient` and `NomadCallback` of every worker, so must be picklable.
+        self._client_options = client_options or {}
+        self._callback_options = callback_options or {}
+        self._health_check_period = health_check_period
+        self._heartbeat_timeout = heartbeat_timeout
+        self._metrics_port = metrics_port
+
+        # Spawned rather than forked, the zmq context and threads of this process
+        # aren't safe to fork.
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: list[_Worker] = []
+
+        # The uid of the run start of each event descriptor, resource and stream
+        # resource, forgotten when the run stops or after `run_timeout` without documents.
+        self._runs = RunIndex()
+        self._run_timeout = run_timeout
+
+        self._stopped = threading.Event()
+        self._health_thread: threading.Thread | None = None
+
+    def _run_start_of(self, name: str, document: Document) -> str | None:
+        """The uid of the run start which `document` belongs to, if it's known."""
+
+        run_start: str | None
+        match name:
+            case "start":
+                run_start = typing.cast(RunStart, document)["uid"]
+                self._runs.add_run(run_start)
+            case "stop":
+                run_start = typing.cast(RunStop, document)["run_start"]
+            case "descriptor":
+                descriptor = typing.cast(EventDescriptor, document)
+                run_start = descriptor["run_start"]
+                self._runs.add_descriptor(descriptor["uid"], run_start)
+            case "resource" | "stream_resource":
+                resource = typing.cast(Resource | StreamResource, document)
+                run_start = resource.get("run_start")
+                if run_start is not None:
+                    self._runs.add_resource(resource["uid"], run_start)
+            case "event" | "event_page" | "stream_datum":
+                run_start = self._runs.descriptors.get(
+                    typing.cast(Event | EventPage | StreamDatum, document)["descriptor"]
+                )
+            case "datum" | "datum_page":
+                run_start = self._runs.resources.get(
+                    typing.cast(Datum | DatumPage, document)["resource"]
+                )
+            case _:
+                return None
+        if run_start is not None:
+            self._runs.touch(run_start)
+        return run_start
+
+    def _shard(self, run_start: str | None) -> int:
+        if run_start is None:
+            return 0
+        return zlib.crc32(run_start.encode()) % len(self._workers)
+
+    def _send(self, worker: _Worker, message: tuple[str, Document]):
+        with worker.lock:
+            try:
+                worker.connection.send(message)
+                return
+            except OSError:
+                # The worker died, or was killed by a health check, while sending.
+                worker.process.join(self._health_check_period)
+                if worker.process.is_alive():
+                    worker.process.kill()
+                    worker.process.join()
+                worker.restart_if_dead()
+            worker.connection.send(message)
+
+    def _receive(self, name: str, document: Document):
+        metrics.DOCUMENTS.inc(1, (name,))
+        run_start = self._run_start_of(name, document)
+        self._send(self._workers[self._shard(run_start)], (name, document))
+        if name == "stop" and run_start is not None:
+            self._runs.forget(run_start)
+
+    def _check_health(self):
+        while not self._stopped.wait(self._health_check_period):
+            # The workers finish these runs themselves, only the routing is forgotten here.
+            if self._run_timeout is not None:
+                for run_start in self._runs.expired(self._run_timeout):
+                    self._runs.forget(run_start)
+            for worker in self._workers:
+                if worker.hung(self._heartbeat_timeout):
+                    logger.warning(
+                        "Worker %d hasn't read documents for %.0f seconds, killing it.",
+                        worker.shard,
+                        self._heartbeat_timeout,
+                    )
+                    # Not under the lock, which a send blocked on the hung worker holds.
+                    worker.process.kill()
+                    worker.process.join()
+                with worker.lock:
+                    if not self._stopped.is_set():
+                        worker.restart_if_dead()
+
+    def start(self):
+        """Start the worker processes and their health checks, without listening on zmq."""
+
+        self._workers = [
+            _Worker(
+                shard,
+                self._context,
+                (
+                    self.NOMAD_API_URL,
+                    self.NOMAD_API_TOKEN,
+                    self._client_options,
+                    _per_worker(self._callback_options, shard),
+                    logger.getEffectiveLevel(),
+                    None
+                    if self._metrics_port is None
+                    else self._metrics_port + 1 + shard,
+                ),
+            )
+            for shard in range(self._processes)
+        ]
+        metrics.LIVE_WORKERS.set_function(
+            lambda: sum(worker.process.is_alive() for worker in self._workers)
+        )
+        self._health_thread = threading.Thread(
+            target=self._check_health, name="nomad-health-check", daemon=True
+        )
+        self._health_thread.start()
+
+    def __call__(self, name: str, document: Document):
+        self._receive(name, document)
+
+    def serve(self):
+        """Start the workers, then listen on `zmq_url`, blocking while documents are received."""
+
+        self.start()
+        dispatcher = RemoteDispatcher(self.ZMQ_URL)
+        dispatcher.subscribe(self._receive)
+        dispatcher.start()
+
+    def join(self):
+        """Stop the workers once they've uploaded every document sent to them."""
+
+        self._stopped.set()
+        if self._health_thread:
+            self._health_thread.join()
+        for worker in self._workers:
+            worker.stop()
@@ -1,13 +1,35 @@
-import threading
 import queue
+import threading
+import time
 import typing
+
 from tiled.client import from_uri
 from tiled.client.container import Container
+from tiled.queries import Key
+
+from .callback import NomadCallback
+from .logger import logger
+from .nomad_api import NomadClient
+from .retry import RetryPolicy
 
 DEFAULT_POLL_PERIOD = 5.0  # seconds
+DEFAULT_PAGE_SIZE = 100  # runs fetched per request
+DEFAULT_MAX_RECONNECT_DELAY = 60.0  # seconds
+DEFAULT_MAX_RUN_ATTEMPTS = 3  # times the documents of a run are read before giving up
+
+
+def connect(tiled_url: str, tiled_api_secret: str) -> Container:
+    return typing.cast(Container, from_uri(tiled_url, api_key=tiled_api_secret))
 
 
 class NomadTiledListener:
+    """Polls a tiled catalog of bluesky runs and uploads each new run to NOMAD once it has stopped.
+
+    Only runs started after the listener first connects are uploaded. Each poll costs
+    a count of the catalog, a search for runs started since the newest one seen and a
+    lookup of each run still in progress, so it doesn't grow with the catalog.
+    """
+
     def __init__(
         self,
         nomad_api_url: str,
@@ -15,27 +37,164 @@ class NomadTiledListener:
         tiled_url: str,
         tiled_api_secret: str,
         poll_period: float = DEFAULT_POLL_PERIOD,
+        client: NomadClient | None = None,
+        callback: NomadCallback | None = None,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        max_reconnect_delay: float = DEFAULT_MAX_RECONNECT_DELAY,
+        max_run_attempts: int = DEFAULT_MAX_RUN_ATTEMPTS,
     ) -> None:
+        self._client = client or NomadClient(nomad_api_url, nomad_api_token)
+        self._callback = callback or NomadCallback(
+            nomad_api_url, nomad_api_token, client=self._client
+        )
+
         self._tiled_url = tiled_url
         self._tiled_api_secret = tiled_api_secret
+        self._poll_period = poll_period
+        self._page_size = page_size
+        self._reconnect = RetryPolicy(
+            base_delay=poll_period, max_delay=max_reconnect_delay
+        )
 
         # Tiled client and number of elements at previous poll,
-        # `None` in the case of not connected. A thready will poll
+        # `None` in the case of not connected. A thread will poll
         self._tiled_client: Container | None = None
         self._number_of_elements: int | None = None
 
+        # The high-water mark, start time of the newest run seen and the uids of the
+        # runs started at exactly that time, since the search for newer runs includes them.
+        # Set to the time of the first poll, so runs started after it are all uploaded
+        # even if the catalog was empty then.
+        self._high_water_time: float | None = None
+        self._high_water_uids: set[str] = set()
+
+        # Runs seen without a stop document, checked again each poll.
+        self._in_progress: set[str] = set()
+
+        # Stopped runs waiting to have their documents sent, by start uid.
         self._run_queue: queue.Queue[tuple[str, typing.Any]] = queue.Queue()
 
-    def _serve(self): ...
+        # Runs whose documents couldn't be read are looked up again by the next poll,
+        # up to `max_run_attempts` times.
+        self._max_run_attempts = max_run_attempts
+        self._failed_attempts: dict[str, int] = {}
+
+    def _serve(self):
+        failed_attempts = 0
+        while True:
+            if self._tiled_client is None and not self.try_connect():
+                failed_attempts += 1
+                delay = self._reconnect.delay(failed_attempts)
+                logger.warning(
+                    f"Couldn't connect to tiled at `{self._tiled_url}`, retrying in {delay:.2f} seconds."
+                )
+                time.sleep(delay)
+                continue
+            failed_attempts = 0
+
+            try:
+                self.poll()
+            except Exception as exception:
+                logger.warning(
+                    f"Polling tiled at `{self._tiled_url}` failed with `{exception}`, reconnecting."
+                )
+                self._tiled_client = None
+                continue
+            time.sleep(self._poll_period)
+
+    def _mark(self, uid: str, start_time: float):
+        if self._high_water_time is None or start_time > self._high_water_time:
+            self._high_water_time = start_time
+            self._high_water_uids = {uid}
+        elif start_time == self._high_water_time:
+            self._high_water_uids.add(uid)
+
+    def _seen(self, uid: str, run: typing.Any):
+        if run.metadata.get("stop"):
+            self._in_progress.discard(uid)
+            self._run_queue.put((uid, run))
+        else:
+            self._in_progress.add(uid)
+
+    def poll(self):
+        """Queue the runs which have stopped since the last poll."""
+
+        assert self._tiled_client is not None
+        tiled_client = self._tiled_client
+
+        for uid in list(self._in_progress):
+            self._seen(uid, tiled_client[uid])
+
+        # A count is cheap, only search when the catalog has changed.
+        number_of_elements = len(tiled_client)
+        if number_of_elements == self._number_of_elements:
+            return
+
+        if self._high_water_time is None:
+            # Start from now rather than uploading the whole catalog, also uploading
+            # the newest run if it's still running.
+            self._high_water_time = time.time()
+            if number_of_elements:
+                run = tiled_client.values().last()
+                if not run.metadata.get("stop"):
+                    self._in_progress.add(run.metadata["start"]["uid"])
+            self._number_of_elements = number_of_elements
+            return
+
+        new_runs = tiled_client.search(Key("start.time") >= self._high_water_time)
+        seen_uids = set(self._high_water_uids)
+        offset = 0
+        while True:
+            page = new_runs.items()[offset : offset + self._page_size]
+            for _, run in page:
+                start = run.metadata["start"]
+                if start["uid"] in seen_uids:
+                    continue
+                self._mark(start["uid"], start["time"])
+                self._seen(start["uid"], run)
+            if len(page) < self._page_size:
+                break
+            offset += self._page_size
+
+        self._number_of_elements = number_of_elements
 
     def serve(self):
+        """Starts polling tiled in a thread, then blocks sending the documents of each new run to NOMAD."""
+
+        self._callback.serve()
+
         self._serve_thread = threading.Thread(target=self._serve, daemon=True)
-        self._serve_thread.start
+        self._serve_thread.start()
+
+        while True:
+            uid, run = self._run_queue.get()
+            logger.info(f"Uploading run `{uid}` from tiled.")
+            try:
+                # Read in full first, so a retry doesn't send the documents of a run
+                # which failed part way through again.
+                documents = list(run.documents())
+            except Exception as exception:
+                attempts = self._failed_attempts.get(uid, 0) + 1
+                if attempts >= self._max_run_attempts:
+                    self._failed_attempts.pop(uid, None)
+                    logger.error(
+                        f"Failed to read run `{uid}` from tiled {attempts} times, skipping it: {exception!r}"
+                    )
+                    continue
+                self._failed_attempts[uid] = attempts
+                logger.warning(
+                    f"Failed to read run `{uid}` from tiled, retrying on the next poll: {exception!r}"
+                )
+                self._in_progress.add(uid)
+                continue
+            self._failed_attempts.pop(uid, None)
+            for name, document in documents:
+                self._callback(name, document)
 
-    def try_connect(self):
+    def try_connect(self) -> bool:
         try:
-            self._tiled_client = typing.cast(
-                Container, from_uri(self._tiled_url, api_key=self._tiled_api_secret)
-            )
+            self._tiled_client = connect(self._tiled_url, self._tiled_api_secret)
         except Exception as exception:
+            logger.debug(f"Connecting to tiled failed with `{exception}`.")
             self._tiled_client = None
+        return self._tiled_client is not None
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+DEFAULT_MAX_ENTRIES = 10000
+
+# Files smaller than this are sent again rather than referenced, it's cheap and
+# keeps each upload complete on its own.
+DEFAULT_MIN_REFERENCE_BYTES = 1024 * 1024
+
+
+class UploadCache:
+    """The content hashes of what has been uploaded, and where, so that it isn't sent again.
+
+    Maps the sha256 of content to the upload and name it was last added under, keeping
+    the `max_entries` most recently used. The hashes of files are also kept, by path,
+    size and modification time, so an unchanged file is only read once.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        min_reference_bytes: int = DEFAULT_MIN_REFERENCE_BYTES,
+    ):
+        self.max_entries = max_entries
+        self.min_reference_bytes = min_reference_bytes
+
+        self._lock = threading.Lock()
+        self._locations: OrderedDict[str, tuple[str, str]] = OrderedDict()
+        self._file_digests: OrderedDict[tuple[str, int, int], str] = OrderedDict()
+
+    def __reduce__(self):
+        # Each worker process of a supervisor starts with its own empty cache.
+        return UploadCache, (self.max_entries, self.min_reference_bytes)
+
+    @staticmethod
+    def digest(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def file_digest(self, path: Path) -> str:
+        stat = os.stat(path)
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._file_digests.get(key)
+            if digest is not None:
+                self._file_digests.move_to_end(key)
+                return digest
+        with path.open("rb") as file:
+            digest = hashlib.file_digest(file, "sha256").hexdigest()
+        with self._lock:
+            self._file_digests[key] = digest
+            if len(self._file_digests) > self.max_entries:
+                self._file_digests.popitem(last=False)
+        return digest
+
+    def get(self, digest: str) -> tuple[str, str] | None:
+        """The upload ID and name the content with `digest` was last added under, if it's remembered."""
+
+        with self._lock:
+            location = self._locations.get(digest)
+            if location is not None:
+                self._locations.move_to_end(digest)
+            return location
+
+    def add(self, digest: str, upload_id: str, name: str):
+        with self._lock:
+            self._locations[digest] = (upload_id, name)
+            self._locations.move_to_end(digest)
+            if len(self._locations) > self.max_entries:
+                self._locations.popitem(last=False)
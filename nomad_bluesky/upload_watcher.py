@@ -0,0 +1,232 @@
+import threading
+import time
+import weakref
+from collections.abc import Callable
+from typing import Any
+
+from . import metrics
+from .logger import logger
+from .nomad_api import DEFAULT_PROCESSING_TIMEOUT, NomadClient
+
+# Seconds between polls of an upload once its run has stopped, starting at the minimum
+# and doubling up to the maximum, which is also the period uploads of runs still in
+# progress are polled at, only to notice failures.
+DEFAULT_MIN_INTERVAL = 1.0
+DEFAULT_MAX_INTERVAL = 60.0
+
+# Uploads polled in one request.
+DEFAULT_BATCH_SIZE = 100
+
+UploadCallback = Callable[[str, dict[str, Any] | None], None]
+
+# Every watcher in the process, summed over when the metrics are collected without
+# keeping the watchers alive.
+_watchers: "weakref.WeakSet[UploadWatcher]" = weakref.WeakSet()
+
+metrics.WATCHED_UPLOADS.set_function(
+    lambda: sum(len(watcher._watched) for watcher in list(_watchers))
+)
+
+
+class _Watched:
+    __slots__ = (
+        "deadline",
+        "interval",
+        "next_poll",
+        "on_failed",
+        "on_processed",
+        "stopped",
+        "upload_id",
+    )
+
+    def __init__(
+        self,
+        upload_id: str,
+        interval: float,
+        on_processed: UploadCallback | None,
+        on_failed: UploadCallback | None,
+    ):
+        self.upload_id = upload_id
+        self.stopped = False
+        self.interval = interval
+        self.next_poll = time.monotonic() + interval
+        self.deadline: float | None = None
+        self.on_processed = on_processed
+        self.on_failed = on_failed
+
+
+class UploadWatcher:
+    """Polls the processing status of many uploads together, from a single thread.
+
+    Uploads are watched from when they're created. Once their run has stopped, they're
+    polled every `min_interval` seconds at first, backing off to `max_interval`, until
+    NOMAD has finished processing them. Until then they're polled every `max_interval`,
+    to notice processing failures. Whenever a request is due it asks for the `batch_size`
+    uploads due soonest, so polling hundreds of uploads takes a few requests a minute.
+
+    `on_processed` is called with the ID and status of each upload which NOMAD
+    processed after its run stopped. `on_failed` is called when processing fails, or
+    with a status of `None` when it hasn't finished within `processing_timeout` seconds.
+    Both are called from the watcher's thread.
+    """
+
+    def __init__(
+        self,
+        client: NomadClient,
+        on_processed: UploadCallback | None = None,
+        on_failed: UploadCallback | None = None,
+        min_interval: float = DEFAULT_MIN_INTERVAL,
+        max_interval: float = DEFAULT_MAX_INTERVAL,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        processing_timeout: float = DEFAULT_PROCESSING_TIMEOUT,
+    ):
+        self._client = client
+        self._on_processed = on_processed
+        self._on_failed = on_failed
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.batch_size = batch_size
+        self.processing_timeout = processing_timeout
+
+        self._watched: dict[str, _Watched] = {}
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+
+        _watchers.add(self)
+
+    def watch(
+        self,
+        upload_id: str,
+        on_processed: UploadCallback | None = None,
+        on_failed: UploadCallback | None = None,
+    ):
+        """Start watching an upload whose run is in progress, with callbacks for it alone."""
+
+        with self._condition:
+            self._watched[upload_id] = _Watched(
+                upload_id, self.max_interval, on_processed, on_failed
+            )
+            self._condition.notify()
+
+    def stopped(self, upload_id: str):
+        """The run of the upload has stopped, so the next processing to finish completes it."""
+
+        with self._condition:
+            watched = self._watched.get(upload_id)
+            if watched is None:
+                watched = self._watched[upload_id] = _Watched(
+                    upload_id, self.min_interval, None, None
+                )
+            watched.stopped = True
+            watched.interval = self.min_interval
+            watched.next_poll = time.monotonic() + self.min_interval
+            watched.deadline = time.monotonic() + self.processing_timeout
+            self._condition.notify()
+
+    def unwatch(self, upload_id: str):
+        with self._condition:
+            self._watched.pop(upload_id, None)
+
+    def _due(self) -> list[_Watched] | None:
+        """Wait for a poll to be due, returns the uploads to poll or `None` once stopping."""
+
+        with self._condition:
+            while True:
+                if self._stopping and not any(
+                    watched.stopped for watched in self._watched.values()
+                ):
+                    return None
+                if not self._watched:
+                    self._condition.wait()
+                    continue
+                soonest = min(watched.next_poll for watched in self._watched.values())
+                delay = soonest - time.monotonic()
+                if delay <= 0:
+                    break
+                self._condition.wait(delay)
+            return sorted(self._watched.values(), key=lambda w: w.next_poll)[
+                : self.batch_size
+            ]
+
+    def _finish(
+        self,
+        watched: _Watched,
+        upload: dict[str, Any] | None,
+        callbacks: list[UploadCallback | None],
+    ):
+        with self._condition:
+            self._watched.pop(watched.upload_id, None)
+        for callback in callbacks:
+            if callback is None:
+                continue
+            try:
+                callback(watched.upload_id, upload)
+            except Exception as exception:
+                logger.error(
+                    f"Callback for upload `{watched.upload_id}` failed: {exception!r}"
+                )
+
+    def _update(self, watched: _Watched, upload: dict[str, Any] | None, now: float):
+        if upload is not None and not upload.get("process_running"):
+            if upload.get("process_status") == "FAILURE":
+                logger.error(
+                    "NOMAD failed to process upload `%s`: %s",
+                    watched.upload_id,
+                    upload.get("errors"),
+                )
+                self._finish(watched, upload, [watched.on_failed, self._on_failed])
+                return
+            if watched.stopped:
+                logger.info("NOMAD processed upload `%s`.", watched.upload_id)
+                self._finish(
+                    watched, upload, [watched.on_processed, self._on_processed]
+                )
+                return
+
+        if watched.deadline is not None and now >= watched.deadline:
+            logger.error(
+                "NOMAD didn't finish processing upload `%s` within %g seconds.",
+                watched.upload_id,
+                self.processing_timeout,
+            )
+            self._finish(watched, None, [watched.on_failed, self._on_failed])
+            return
+
+        with self._condition:
+            watched.interval = (
+                min(watched.interval * 2, self.max_interval)
+                if watched.stopped
+                else self.max_interval
+            )
+            watched.next_poll = now + watched.interval
+
+    def _poll(self):
+        while (batch := self._due()) is not None:
+            metrics.UPLOAD_POLLS.inc()
+            try:
+                uploads = self._client.get_uploads(
+                    [watched.upload_id for watched in batch]
+                )
+            except Exception as exception:
+                logger.warning(f"Polling the status of uploads failed: {exception!r}")
+                uploads = []
+            by_id = {upload["upload_id"]: upload for upload in uploads}
+            now = time.monotonic()
+            for watched in batch:
+                self._update(watched, by_id.get(watched.upload_id), now)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._poll, name="nomad-upload-watcher", daemon=True
+        )
+        self._thread.start()
+
+    def join(self):
+        """Wait until the uploads of every stopped run have finished processing, then stop polling."""
+
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
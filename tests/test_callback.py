@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import requests
+
+from benchmarks.documents import generate_run
+from benchmarks.mock_nomad import MockNomad
+from nomad_bluesky.callback import NomadCallback
+from nomad_bluesky.nomad_api import NomadClient
+from nomad_bluesky.retry import RetryPolicy
+from nomad_bluesky.state_store import StateStore
+
+
+class _ArchivesFail(NomadClient):
+    def add_archive_to_upload(self, *args, **kwargs):
+        raise requests.ConnectionError("NOMAD went away")
+
+
+def test_archive_which_failed_to_upload_is_sent_again_after_a_restart(tmp_path: Path):
+    documents = list(generate_run(10))
+    options = {
+        "aggregate": True,
+        "state_path": tmp_path / "state.db",
+        "staging_path": tmp_path,
+    }
+
+    with MockNomad() as nomad:
+        callback = NomadCallback(
+            nomad.url,
+            "token",
+            client=_ArchivesFail(nomad.url, "token", retry=RetryPolicy(1)),
+            **options,
+        )
+        callback.serve()
+        for name, document in documents:
+            callback(name, document)
+        callback.join()
+
+        state = StateStore(tmp_path / "state.db")
+        assert len(state.pending()) == len(documents)
+        assert list(state.runs()) == [documents[0][1]["uid"]]
+        assert len(state.descriptors()) == 1
+        state.close()
+        assert list(tmp_path.glob("run_*"))
+
+        callback = NomadCallback(nomad.url, "token", **options)
+        callback.serve()
+        callback.join()
+        requests_made = nomad.stats()["requests"]
+
+    assert requests_made == {"create_upload": 1, "raw": 1}
+    state = StateStore(tmp_path / "state.db")
+    assert state.pending() == []
+    assert state.runs() == {}
+    assert state.descriptors() == {}
+    state.close()
+    assert not list(tmp_path.glob("run_*"))
@@ -0,0 +1,68 @@
+import pickle
+import queue
+import threading
+from pathlib import Path
+
+import pytest
+
+from nomad_bluesky.document_queue import SpillQueue
+
+
+def test_items_beyond_memory_are_spilled_and_drained_in_order(tmp_path: Path):
+    spill_queue = SpillQueue(max_in_memory=10, spill_path=tmp_path / "spill")
+    for item in range(100):
+        spill_queue.put(("event", {"seq_num": item}))
+
+    metrics = spill_queue.metrics()
+    assert metrics["depth"] == 100
+    assert metrics["in_memory"] == 10
+    assert metrics["spilled"] == 90
+    assert metrics["spill_bytes"] > 0
+
+    assert [spill_queue.get(timeout=0)[1]["seq_num"] for _ in range(100)] == list(
+        range(100)
+    )
+    assert spill_queue.metrics()["spill_bytes"] == 0
+    # Truncated once it's emptied.
+    assert (tmp_path / "spill").stat().st_size == 0
+    spill_queue.close()
+
+
+def test_items_put_while_draining_stay_behind_spilled_ones():
+    spill_queue = SpillQueue(max_in_memory=4)
+    for item in range(10):
+        spill_queue.put(item)
+    drained = [spill_queue.get(timeout=0) for _ in range(5)]
+    # There's room in memory again, but these still go behind what's spilled.
+    for item in range(10, 15):
+        spill_queue.put(item)
+    drained += [spill_queue.get(timeout=0) for _ in range(10)]
+
+    assert drained == list(range(15))
+    assert spill_queue.qsize() == 0
+    spill_queue.close()
+
+
+def test_get_times_out_when_empty():
+    spill_queue = SpillQueue()
+    with pytest.raises(queue.Empty):
+        spill_queue.get(timeout=0.01)
+    spill_queue.close()
+
+
+def test_put_blocks_once_the_spill_file_is_full():
+    # Room for three items on disk, after one in memory.
+    record_bytes = 8 + len(pickle.dumps(0))
+    spill_queue = SpillQueue(max_in_memory=1, max_spill_bytes=3 * record_bytes)
+    for item in range(4):
+        spill_queue.put(item)
+
+    blocked = threading.Thread(target=spill_queue.put, args=(4,))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+
+    assert [spill_queue.get(timeout=1) for _ in range(5)] == list(range(5))
+    blocked.join(1.0)
+    assert not blocked.is_alive()
+    spill_queue.close()
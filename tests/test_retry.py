@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from benchmarks.mock_nomad import MockNomad
+from nomad_bluesky.nomad_api import NomadClient
+from nomad_bluesky.retry import CircuitBreaker, RetryPolicy, is_retryable, retry_after
+
+
+def _http_error(status_code: int, headers: dict[str, str] | None = None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return requests.HTTPError(response=response)
+
+
+@pytest.mark.parametrize(
+    "exception, retryable",
+    [
+        (_http_error(503), True),
+        (_http_error(429), True),
+        (_http_error(404), False),
+        (_http_error(401), False),
+        (requests.Timeout(), True),
+        (requests.ConnectionError(), True),
+        (ValueError(), False),
+    ],
+)
+def test_is_retryable(exception: BaseException, retryable: bool):
+    assert is_retryable(exception) is retryable
+
+
+def test_retry_after():
+    assert retry_after(None) is None
+    assert retry_after(_http_error(503).response) is None
+    assert retry_after(_http_error(503, {"Retry-After": "2"}).response) == 2.0
+    assert retry_after(_http_error(503, {"Retry-After": "soon"}).response) is None
+    past = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert retry_after(_http_error(503, {"Retry-After": past}).response) == 0.0
+
+
+def test_delays_grow_up_to_the_maximum():
+    policy = RetryPolicy(base_delay=0.5, max_delay=4.0)
+    for attempt, bound in [(1, 1.0), (2, 2.0), (3, 4.0), (10, 4.0)]:
+        for _ in range(100):
+            assert 0 <= policy.delay(attempt) <= bound
+
+
+def test_retry_after_is_waited_for_at_least_up_to_the_maximum():
+    policy = RetryPolicy(base_delay=0.5, max_delay=4.0)
+    assert 3.0 <= policy.delay(1, retry_after=3.0) <= 4.0
+    assert policy.delay(1, retry_after=100.0) == 4.0
+
+
+def test_circuit_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+
+
+def test_circuit_lets_a_single_trial_through_once_reset():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    breaker.record_failure()
+    start = time.monotonic()
+    breaker.before_call()
+    assert time.monotonic() - start >= 0.1
+
+    # Everyone else waits for the trial.
+    second = threading.Thread(target=breaker.before_call)
+    second.start()
+    second.join(0.2)
+    assert second.is_alive()
+
+    breaker.record_success()
+    second.join(1.0)
+    assert not second.is_alive()
+    assert not breaker.is_open
+
+
+def test_circuit_reopens_if_the_trial_fails():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.end_call()
+    assert breaker.is_open
+
+    start = time.monotonic()
+    breaker.before_call()
+    assert time.monotonic() - start >= 0.05
+
+
+def test_a_trial_which_records_nothing_lets_the_next_one_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    breaker.record_failure()
+    breaker.before_call()
+
+    second = threading.Thread(target=breaker.before_call)
+    second.start()
+    second.join(0.2)
+    assert second.is_alive()
+
+    # e.g. a response which isn't retryable, which is neither a success nor a failure.
+    breaker.end_call()
+    second.join(1.0)
+    assert not second.is_alive()
+    assert breaker.is_open
+
+
+def test_client_gives_up_after_max_attempts():
+    with MockNomad(error_rate=1.0) as nomad:
+        client = NomadClient(
+            nomad.url,
+            "token",
+            retry=RetryPolicy(max_attempts=3, base_delay=0.0),
+            circuit_breaker=CircuitBreaker(failure_threshold=10),
+        )
+        with pytest.raises(requests.HTTPError):
+            client.create_upload("run")
+        assert nomad.stats()["requests"] == {"create_upload": 3}
@@ -0,0 +1,71 @@
+from pathlib import Path
+
+from benchmarks.documents import generate_run
+from benchmarks.mock_nomad import MockNomad
+from nomad_bluesky.callback import NomadCallback
+from nomad_bluesky.state_store import StateStore
+
+
+def test_state_is_kept_across_a_restart(tmp_path: Path):
+    state = StateStore(tmp_path / "state.db")
+    first = state.journal("start", {"uid": "run"})
+    second = state.journal("descriptor", {"uid": "descriptor", "run_start": "run"})
+    third = state.journal("event", {"descriptor": "descriptor"})
+    state.acknowledge([first])
+    state.add_run("run", "upload")
+    state.add_descriptor("descriptor", "run")
+    state.add_resource("resource", "run")
+    state.add_run_file("run", tmp_path / "image.h5")
+    state.set_archive_parts("run", [{"name": "part_0.zip"}])
+    state.close()
+
+    state = StateStore(tmp_path / "state.db")
+    assert state.pending() == [
+        (second, "descriptor", {"uid": "descriptor", "run_start": "run"}),
+        (third, "event", {"descriptor": "descriptor"}),
+    ]
+    assert state.runs() == {"run": "upload"}
+    assert state.descriptors() == {"descriptor": "run"}
+    assert state.resources() == {"resource": "run"}
+    assert state.run_files() == {"run": [tmp_path / "image.h5"]}
+    assert state.archive_parts("run") == [{"name": "part_0.zip"}]
+    state.close()
+
+
+def test_removed_runs_are_forgotten(tmp_path: Path):
+    state = StateStore(tmp_path / "state.db")
+    state.add_run("run", "upload")
+    state.add_descriptor("descriptor", "run")
+    state.add_resource("resource", "run")
+    state.add_run_file("run", tmp_path / "image.h5")
+    state.set_archive_parts("run", [{"name": "part_0.zip"}])
+    state.remove_run("run")
+    state.close()
+
+    state = StateStore(tmp_path / "state.db")
+    assert state.runs() == {}
+    assert state.descriptors() == {}
+    assert state.resources() == {}
+    assert state.run_files() == {}
+    assert state.archive_parts("run") == []
+    state.close()
+
+
+def test_callback_resumes_the_journal_of_a_previous_process(tmp_path: Path):
+    documents = list(generate_run(10))
+    state = StateStore(tmp_path / "state.db")
+    for name, document in documents:
+        state.journal(name, document)
+    state.close()
+
+    with MockNomad() as nomad:
+        callback = NomadCallback(nomad.url, "token", state_path=tmp_path / "state.db")
+        callback.serve()
+        callback.join()
+        requests = nomad.stats()["requests"]
+
+    assert requests["create_upload"] == 1
+    state = StateStore(tmp_path / "state.db")
+    assert state.pending() == []
+    assert state.runs() == {}
+    state.close()
@@ -0,0 +1,102 @@
+import threading
+from typing import Any
+
+from nomad_bluesky.upload_watcher import UploadWatcher
+
+
+class _Client:
+    """Answers polls as NOMAD would, recording the uploads asked for in each."""
+
+    def __init__(self):
+        self.polls: list[list[str]] = []
+        self.running: set[str] = set()
+        self.failed: set[str] = set()
+        self._lock = threading.Lock()
+
+    def get_uploads(self, upload_ids: list[str]) -> list[dict[str, Any]]:
+        with self._lock:
+            self.polls.append(list(upload_ids))
+            return [
+                {
+                    "upload_id": upload_id,
+                    "process_running": upload_id in self.running,
+                    "process_status": "FAILURE"
+                    if upload_id in self.failed
+                    else "SUCCESS",
+                }
+                for upload_id in upload_ids
+            ]
+
+
+def _watcher(client: _Client, **kwargs) -> tuple[UploadWatcher, list, list]:
+    processed: list[str] = []
+    failed: list[tuple[str, dict[str, Any] | None]] = []
+    watcher = UploadWatcher(
+        client,  # type: ignore[arg-type]
+        on_processed=lambda upload_id, upload: processed.append(upload_id),
+        on_failed=lambda upload_id, upload: failed.append((upload_id, upload)),
+        **kwargs,
+    )
+    return watcher, processed, failed
+
+
+def test_stopped_uploads_are_polled_in_batches():
+    client = _Client()
+    watcher, processed, failed = _watcher(client, min_interval=0.01, batch_size=100)
+    upload_ids = [f"upload_{i}" for i in range(250)]
+    for upload_id in upload_ids:
+        watcher.stopped(upload_id)
+    watcher.start()
+    watcher.join()
+
+    assert sorted(processed) == sorted(upload_ids)
+    assert failed == []
+    assert all(len(poll) <= 100 for poll in client.polls)
+    assert len(client.polls) == 3
+
+
+def test_uploads_are_only_processed_once_their_run_has_stopped():
+    client = _Client()
+    watcher, processed, failed = _watcher(client, min_interval=0.01, max_interval=0.01)
+    watcher.watch("running")
+    watcher.start()
+    while len(client.polls) < 3:
+        threading.Event().wait(0.01)
+    assert processed == []
+
+    watcher.stopped("running")
+    watcher.join()
+    assert processed == ["running"]
+
+
+def test_uploads_still_processing_are_polled_again():
+    client = _Client()
+    client.running.add("upload")
+    watcher, processed, failed = _watcher(client, min_interval=0.01)
+    watcher.stopped("upload")
+    watcher.start()
+    while len(client.polls) < 2:
+        threading.Event().wait(0.01)
+    assert processed == []
+
+    client.running.clear()
+    watcher.join()
+    assert processed == ["upload"]
+
+
+def test_failures_and_timeouts_are_reported():
+    client = _Client()
+    client.failed.add("failed")
+    client.running.add("slow")
+    watcher, processed, failed = _watcher(
+        client, min_interval=0.01, processing_timeout=0.1
+    )
+    watcher.watch("failed")
+    watcher.stopped("slow")
+    watcher.start()
+    watcher.join()
+
+    assert processed == []
+    assert [upload_id for upload_id, _ in failed] == ["failed", "slow"]
+    assert failed[0][1] is not None and failed[0][1]["process_status"] == "FAILURE"
+    assert failed[1][1] is None